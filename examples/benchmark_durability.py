@@ -0,0 +1,31 @@
+from py3jsondb import JsonDatabase
+from py3jsondb.utils.atomic_write import DURABILITY_LEVELS
+from tempfile import mkdtemp
+from os.path import join
+from shutil import rmtree
+import time
+
+# compare the cost of a save for every durability level
+# and for small and large databases
+
+SAVES = 50
+workdir = mkdtemp()
+
+try:
+    for n_entries in (10, 10000):
+        for durability in DURABILITY_LEVELS:
+            path = join(workdir, f"{durability}_{n_entries}.json")
+            db = JsonDatabase("users", path, durability=durability)
+            for i in range(n_entries):
+                db.add_entry({"name": f"user{i}", "age": i % 90},
+                             allow_duplicates=True)
+
+            start = time.perf_counter()
+            for i in range(SAVES):
+                db.update_entry(0, {"age": i}, overwrite=False)
+                db.save()
+            elapsed = time.perf_counter() - start
+            print(f"{n_entries:>6} entries  durability={durability:<6} "
+                  f"{elapsed / SAVES * 1000:8.2f} ms/save")
+finally:
+    rmtree(workdir)
@@ -0,0 +1,42 @@
+from py3jsondb.utils.serializers import available_serializers, \
+    available_codecs, get_serializer, get_codec
+import time
+
+# load and store throughput of a large table for every installed backend
+
+N_ENTRIES = 100000
+ROUNDS = 3
+
+table = {"users": [{"name": f"user{i}", "age": i % 90,
+                    "tags": ["a", "b", str(i)],
+                    "address": {"city": "lisbon", "zip": f"{i:05d}"}}
+                   for i in range(N_ENTRIES)]}
+
+
+def bench(func):
+    best = None
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+for name in available_serializers():
+    serializer = get_serializer(name)
+    for pretty in (True, False):
+        data = serializer.dumps(table, pretty)
+        store = bench(lambda: serializer.dumps(table, pretty))
+        load = bench(lambda: serializer.loads(data))
+        fmt = "pretty" if pretty else "compact"
+        print(f"{name:<8} {fmt:<8} {len(data) / 1e6:7.2f} MB  "
+              f"store {store * 1000:8.1f} ms  load {load * 1000:8.1f} ms")
+
+for name in available_codecs():
+    codec = get_codec(name)
+    data = codec.dumps(table)
+    store = bench(lambda: codec.dumps(table))
+    load = bench(lambda: codec.loads(data))
+    print(f"{name:<8} {'binary':<8} {len(data) / 1e6:7.2f} MB  "
+          f"store {store * 1000:8.1f} ms  load {load * 1000:8.1f} ms")
@@ -1,16 +1,30 @@
 from py3jsondb.utils import *
 from py3jsondb.jsonpath import JsonPath
+from py3jsondb.jsonl import JsonlTable
+from py3jsondb.indexes import HashIndex, FieldIndex, TableIndexes, \
+    index_from_definition, index_definitions_path, load_index_file, \
+    save_index_definitions, PathIndex, PrimaryKeyIndex
 from py3jsondb.exceptions import InvalidEntryID, DatabaseNotCommitted, \
-    SessionError, MatchError, TableNotFound,TableCanNotBeEmpty,ChildNotFound
-from os.path import expanduser, isdir, dirname, exists, isfile, join
-from os import makedirs, remove
-import json
+    SessionError, MatchError, TableNotFound,TableCanNotBeEmpty,ChildNotFound, \
+    TransactionConflict, TransactionClosed
+from os.path import expanduser, isdir, dirname, exists, isfile, join, getsize
+from os import makedirs, remove, stat
+from threading import Thread, Lock
+from copy import deepcopy
+from weakref import WeakSet
 import logging
 from pprint import pprint
 from xdg import BaseDirectory
-from py3jsondb.utils.combo_lock import ComboLock, DummyLock
+from py3jsondb.utils.combo_lock import ComboLock, DummyLock, get_lock_path
+from py3jsondb.utils.serializers import get_serializer
+from py3jsondb.utils.snapshot_cache import snapshot_path
+from py3jsondb.utils.file_watcher import get_watcher
+from py3jsondb.utils.group_commit import GroupCommitWriter
+from py3jsondb.utils.atomic_write import atomic_write, check_durability, \
+    fsync_dir, sync_file, DURABILITY_NONE, DURABILITY_FSYNC
 
-from tempfile import gettempdir
+from shutil import rmtree
+from urllib.parse import quote
 
 LOG = logging.getLogger("JsonDatabase")
 
@@ -18,21 +32,78 @@ LOG = logging.getLogger("JsonDatabase")
 class JsonStorage(dict):
     """
     persistent python dict
+
+    with wal=True only the changes recorded with log_change are written by
+    store(), they are appended to a write-ahead log next to the json file
+    and folded into it by compact() once the log grows past wal_threshold
+
+    saves are atomic, durability selects how much syncing is paid for it:
+    'none' (rename only), 'flush' (fsync the file) or 'fsync' (fsync the
+    file and its directory)
+
+    serializer picks the json backend (orjson, msgspec, ujson or json),
+    by default the stdlib json, pretty=False stores compact json
+
+    with snapshot_cache=True the parsed file is also kept as a binary
+    snapshot (<path>.cache) that is loaded instead of parsing the json while
+    the json file is unchanged
+
+    refresh() only reloads the file when another process changed it, this
+    is detected by comparing stat results or with inotify=True (linux only)
+    by listening to inotify events, parse_count counts the files parsed
     """
 
-    def __init__(self, path, disable_lock=False):
+    def __init__(self, path, disable_lock=False, wal=False,
+                 wal_threshold=4 * 1024 * 1024, background_compaction=True,
+                 durability=DURABILITY_NONE, serializer=None, pretty=True,
+                 snapshot_cache=False, inotify=False):
         super().__init__()
-        lock_path = join(gettempdir(), path.split("/")[-1] + ".lock")
+        self.disable_lock = disable_lock
         if disable_lock:
             LOG.warning("Lock is disabled, database might get corrupted if "
                         "different processes try to use it at same time!")
-            self.lock = DummyLock(lock_path)
-        else:
-            self.lock = ComboLock(lock_path)
+        self.lock = self._new_lock(get_lock_path(path))
         self.path = path
+        self.wal = wal
+        self.wal_threshold = wal_threshold
+        self.background_compaction = background_compaction
+        self.durability = check_durability(durability)
+        self.serializer = get_serializer(serializer)
+        self.pretty = pretty
+        self.snapshot_cache = snapshot_cache
+        self.parse_count = 0
+        self._changes = []
+        self._wal_pending = []
+        # taken by log_change, stores drop only the changes they wrote
+        self._changes_lock = Lock()
+        # changes were logged while a snapshot was written, they may be in
+        # it so the next store must not append them to the log
+        self._full_store = False
+        # keys set or deleted through the dict interface without a change
+        # record, with wal=True the next store must write a full snapshot
+        self._untracked = set()
+        # serializes appends, compactions and snapshots of this process,
+        # self.lock does nothing with disable_lock=True, transactions hold
+        # it while publishing so a store never writes half of a commit
+        self._wal_lock = Lock()
+        self._compactor = None
+        self._watcher = None
         if self.path:
+            watched = [expanduser(self.path)]
+            if self.wal:
+                watched.append(self.wal_path)
+            self._watcher = get_watcher(*watched, inotify=inotify)
             self.load_local(self.path)
 
+    def _new_lock(self, lock_path):
+        if self.disable_lock:
+            return DummyLock(lock_path)
+        return ComboLock(lock_path)
+
+    @property
+    def wal_path(self):
+        return expanduser(self.path) + ".wal"
+
     def load_local(self, path):
         """
             Load local json file into self.
@@ -40,56 +111,334 @@ class JsonStorage(dict):
             Args:
                 path (str): file to load
         """
-        with self.lock:
+        repair_wal = False
+        with self.lock.read_lock():
             path = expanduser(path)
             if exists(path) and isfile(path):
                 self.clear()
                 try:
-                    config = load_commented_json(path)
+                    self.parse_count += 1
+                    config = load_commented_json(path, self.serializer,
+                                                 self.snapshot_cache)
                     for key in config:
                         self[key] = config[key]
                     LOG.debug("Json {} loaded".format(path))
                 except Exception as e:
                     LOG.error("Error loading json '{}'".format(path))
                     LOG.error(repr(e))
+                self._changes = []
+                self._full_store = False
+                if self.wal:
+                    self._wal_pending = []
+                    repair_wal = self._replay_wal(path)
+                self._untracked = set()
+                self._mark_synced(path)
             else:
                 LOG.debug("Json '{}' not defined, skipping".format(path))
+        if repair_wal:
+            self._repair_wal(path)
 
     def clear(self):
         for k in dict(self):
             self.pop(k)
 
+    # changes made through the dict interface are not recorded, the keys
+    # are remembered so a write-ahead log never misses them
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._untracked.add(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._untracked.add(key)
+
+    def pop(self, key, *args):
+        if key in self:
+            self._untracked.add(key)
+        return super().pop(key, *args)
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._untracked.add(key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self._untracked.add(key)
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
     def reload(self):
         if exists(self.path) and isfile(self.path):
             self.load_local(self.path)
         else:
             raise DatabaseNotCommitted
 
-    def store(self, path=None):
+    def refresh(self):
+        """
+            reload the file only if it was changed by someone else since it
+            was last loaded or stored
+
+            Returns:
+                bool: True if the file was reloaded
+        """
+        if self._watcher is None or not self._watcher.changed():
+            return False
+        if not isfile(expanduser(self.path)):
+            return False
+        LOG.debug("Json '{}' changed on disk, reloading".format(self.path))
+        self.load_local(self.path)
+        return True
+
+    def _mark_synced(self, path):
+        # memory matches the file, remember its state to detect other writers
+        if self._watcher is not None and path == expanduser(self.path):
+            self._watcher.mark()
+
+    def store(self, path=None, full=False):
         """
             store the json db locally.
+
+            Args:
+                path (str): where to store, defaults to self.path
+                full (bool): with wal=True write a full snapshot instead
+                             of appending the recorded changes to the log
         """
-        with self.lock:
-            path = path or self.path
-            if not path:
-                LOG.warning("json db path not set")
-                return
-            path = expanduser(path)
+        path = path or self.path
+        if not path:
+            LOG.warning("json db path not set")
+            return
+        path = expanduser(path)
+        if self.wal and not full and not self._full_store and \
+                not self._untracked and \
+                path == expanduser(self.path) and isfile(path):
+            self._append_wal()
+            return
+        with self._wal_lock, self.lock:
             if dirname(path) and not isdir(dirname(path)):
                 makedirs(dirname(path))
-            with open(path, 'w', encoding="utf-8") as f:
-                json.dump(self, f, indent=4, ensure_ascii=False)
+            written = self._pending_changes()
+            untracked = set(self._untracked)
+            with atomic_write(path, self.durability, "wb") as f:
+                self.serializer.dump(self, f, self.pretty)
+            self._mark_synced(path)
+            if path == expanduser(self.path):
+                # the snapshot contains the changes logged before it
+                self._drop_changes(len(written))
+                self._untracked -= untracked
+                if self.wal:
+                    if isfile(self.wal_path):
+                        remove(self.wal_path)
+
+    def changed_in_place(self):
+        """
+            compare self with its file, values returned by the storage may
+            have been modified in place without recording a change
+
+            Returns:
+                bool: True if the file does not match self, a file changed
+                      by another process since the last load or store is
+                      not compared
+        """
+        if not self.path or self._watcher is not None and \
+                self._watcher.changed():
+            return False
+        path = expanduser(self.path)
+        if not isfile(path):
+            return bool(self)
+        if self.wal and isfile(self.wal_path):
+            # self is the snapshot plus the log, a new snapshot folds it
+            return True
+        return _differs_from_file(path, self.serializer.dumps(self,
+                                                              self.pretty))
 
     def remove(self):
         with self.lock:
             if isfile(self.path):
                 remove(self.path)
+            if self.wal and isfile(self.wal_path):
+                remove(self.wal_path)
+            if isfile(snapshot_path(expanduser(self.path))):
+                remove(snapshot_path(expanduser(self.path)))
 
     def merge(self, conf, merge_lists=True, skip_empty=True, no_dupes=True,
               new_only=False):
         merge_dict(self, conf, merge_lists, skip_empty, no_dupes, new_only)
+        # nested values are merged in place
+        self._untracked.update(k for k in conf if k in self)
         return self
 
+    # change tracking
+    @property
+    def is_dirty(self):
+        """ True if changes were recorded with log_change, or keys were set
+        or deleted through the dict interface, since the last load or store """
+        return bool(self._changes) or bool(self._untracked)
+
+    def changes(self):
+        """
+            changes recorded since the last load or store
+
+            Returns:
+                list: change records, dicts with 'op', 'path' and 'value'
+        """
+        return list(self._changes)
+
+    def log_change(self, op, path, value=None):
+        """
+            record a change already applied to self, see apply_change
+
+            Args:
+                op (str): one of 'append', 'set', 'update' or 'delete'
+                path (list): path of the modified node
+                value: the new value
+        """
+        record = {"op": op, "path": list(path)}
+        if op != "delete":
+            record["value"] = value
+        with self._changes_lock:
+            self._changes.append(record)
+            if len(record["path"]) == 1 and op in ("set", "delete"):
+                # the record describes the whole key
+                self._untracked.discard(record["path"][0])
+            if self.wal:
+                self._wal_pending.append(self.serializer.dumps(record,
+                                                               pretty=False))
+
+    def _pending_changes(self):
+        """ the changes logged so far, see _drop_changes """
+        with self._changes_lock:
+            return list(self._changes)
+
+    def _drop_changes(self, count):
+        """ forget the first count changes once they were stored, the
+        changes logged in the meantime stay pending """
+        with self._changes_lock:
+            del self._changes[:count]
+            if self.wal:
+                self._wal_pending = []
+                self._full_store = bool(self._changes)
+
+    # write-ahead log
+    @staticmethod
+    def _snapshot_id(path):
+        # a log is only valid on top of the exact snapshot it was started on
+        st = stat(path)
+        return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+    def _read_wal(self, path):
+        """ returns the valid change records of the log of path and the
+        byte offset where they end, stale logs return None """
+        wal_path = path + ".wal"
+        if not isfile(wal_path):
+            return None, 0
+        records = []
+        end = 0
+        with open(wal_path, "rb") as f:
+            header = f.readline()
+            try:
+                base = self.serializer.loads(header)["base"]
+            except Exception:
+                base = None
+            if base != self._snapshot_id(path):
+                LOG.warning("Discarding stale write-ahead log '{}'"
+                            .format(wal_path))
+                return None, 0
+            end = f.tell()
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn write
+                try:
+                    records.append(self.serializer.loads(line))
+                except ValueError:
+                    break
+                end = f.tell()
+        return records, end
+
+    def _replay_wal(self, path):
+        """ apply the log of path, returns True if the log is stale or has
+        a torn tail, see _repair_wal """
+        records, end = self._read_wal(path)
+        wal_path = path + ".wal"
+        if records is None:
+            return isfile(wal_path)
+        for record in records:
+            apply_change(self, record["op"], record["path"],
+                         record.get("value"))
+        LOG.debug("Replayed {} changes from '{}'".format(len(records),
+                                                        wal_path))
+        return getsize(wal_path) > end
+
+    def _repair_wal(self, path):
+        """ remove a stale log or truncate a torn one, the log is read again
+        under the write lock since another process may have changed it """
+        with self._wal_lock, self.lock:
+            records, end = self._read_wal(path)
+            wal_path = path + ".wal"
+            if records is None:
+                if isfile(wal_path):
+                    remove(wal_path)
+            elif getsize(wal_path) > end:
+                LOG.warning("Truncating torn write-ahead log '{}'"
+                            .format(wal_path))
+                with open(wal_path, "r+b") as f:
+                    f.truncate(end)
+
+    def _append_wal(self):
+        with self._wal_lock, self.lock:
+            with self._changes_lock:
+                self._changes = []
+                lines = self._wal_pending
+                self._wal_pending = []
+            if lines:
+                path = expanduser(self.path)
+                new_log = not isfile(self.wal_path)
+                if new_log:
+                    header = self.serializer.dumps(
+                        {"base": self._snapshot_id(path)}, pretty=False)
+                    lines = [header] + lines
+                with open(self.wal_path, "ab") as f:
+                    f.write(b"\n".join(lines) + b"\n")
+                    sync_file(f, self.durability)
+                if new_log and self.durability == DURABILITY_FSYNC:
+                    fsync_dir(dirname(self.wal_path))
+                self._mark_synced(path)
+            needs_compaction = isfile(self.wal_path) and \
+                getsize(self.wal_path) > self.wal_threshold
+        if needs_compaction:
+            if not self.background_compaction:
+                self.compact()
+            elif self._compactor is None or not self._compactor.is_alive():
+                self._compactor = Thread(target=self.compact, daemon=True)
+                self._compactor.start()
+
+    def compact(self):
+        """
+            fold the write-ahead log into a new json snapshot
+
+            the snapshot is rebuilt from the files on disk, so this is safe
+            to run in a background thread while self keeps being modified
+        """
+        with self._wal_lock, self.lock:
+            path = expanduser(self.path)
+            records, _ = self._read_wal(path)
+            if not records:
+                return
+            data = load_commented_json(path, self.serializer)
+            for record in records:
+                apply_change(data, record["op"], record["path"],
+                             record.get("value"))
+            # once the snapshot is replaced the old log no longer matches it
+            with atomic_write(path, self.durability, "wb") as f:
+                self.serializer.dump(data, f, self.pretty)
+            remove(self.wal_path)
+            self._mark_synced(path)
+            LOG.debug("Compacted {} changes into '{}'".format(len(records),
+                                                             path))
+
     def __enter__(self):
         """ Context handler """
         return self
@@ -103,6 +452,319 @@ class JsonStorage(dict):
             raise SessionError
 
 
+def _differs_from_file(path, data):
+    """ True if the file at path does not contain exactly data """
+    if getsize(path) != len(data):
+        return True
+    with open(path, "rb") as f:
+        return f.read() != data
+
+
+class _UnloadedTable:
+    """ placeholder for a table of SplitJsonStorage that was not read yet """
+
+    def __repr__(self):
+        return "<unloaded table>"
+
+
+_UNLOADED = _UnloadedTable()
+
+
+class SplitJsonStorage(JsonStorage):
+    """
+    persistent python dict of tables, stored as a small catalog plus one
+    json file per table
+
+    only the catalog is read when loading, a table file is read the first
+    time the table is accessed and store() only writes the tables touched
+    by the changes recorded with log_change
+
+        users.db                catalog, {"format": ..., "tables": {...}}
+        users.db.tables/        one json file per table
+
+    with table_format="jsonl" new tables are stored as JSON Lines files and
+    loaded as JsonlTable, entries are then decoded on access and new entries
+    appended to the end of the file
+
+    with table_locks=True every table file has its own lock, writers of
+    different tables do not wait for each other and self.lock is only
+    taken for the catalog
+    """
+    CATALOG_FORMAT = "py3jsondb/split"
+    TABLE_FORMATS = ("json", "jsonl")
+
+    def __init__(self, path, disable_lock=False, durability=DURABILITY_NONE,
+                 serializer=None, pretty=True, table_format="json",
+                 snapshot_cache=False, inotify=False, table_locks=False):
+        if table_format not in self.TABLE_FORMATS:
+            raise ValueError("table_format must be one of {}".format(
+                ", ".join(self.TABLE_FORMATS)))
+        self.table_format = table_format
+        self.table_locks = table_locks
+        # table name -> lock, only used with table_locks
+        self._table_locks = {}
+        self._catalog = {}
+        self._catalog_dirty = False
+        super().__init__(path, disable_lock=disable_lock,
+                         durability=durability, serializer=serializer,
+                         pretty=pretty, snapshot_cache=snapshot_cache,
+                         inotify=inotify)
+
+    @property
+    def tables_path(self):
+        return expanduser(self.path) + ".tables"
+
+    def table_path(self, table_name):
+        """ path of the json file of a table """
+        if table_name not in self._catalog:
+            self._catalog[table_name] = quote(str(table_name), safe="") + \
+                                        "." + self.table_format
+            self._catalog_dirty = True
+        return join(self.tables_path, self._catalog[table_name])
+
+    def table_lock(self, table_name):
+        """ lock of the file of a table, self.lock unless table_locks """
+        if not self.table_locks:
+            return self.lock
+        if table_name not in self._table_locks:
+            self._table_locks[table_name] = self._new_lock(
+                get_lock_path(self.path, table_name))
+        return self._table_locks[table_name]
+
+    # lazy table access
+    def _load_table(self, table_name):
+        path = self.table_path(table_name)
+        if path.endswith(".jsonl"):
+            table = JsonlTable(path, self.serializer)
+        elif isfile(path):
+            self.parse_count += 1
+            if self.table_locks:
+                with self.table_lock(table_name).read_lock():
+                    table = load_commented_json(path, self.serializer,
+                                                self.snapshot_cache)
+            else:
+                table = load_commented_json(path, self.serializer,
+                                            self.snapshot_cache)
+            LOG.debug("Table {} loaded from {}".format(table_name, path))
+        else:
+            table = []
+        dict.__setitem__(self, table_name, table)
+        return table
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if value is _UNLOADED:
+            value = self._load_table(key)
+        return value
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def pop(self, key, *args):
+        if key in self:
+            value = self[key]
+            dict.pop(self, key)
+            self._untracked.add(key)
+            return value
+        return dict.pop(self, key, *args)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def clear(self):
+        for table in dict.values(self):
+            if isinstance(table, JsonlTable):
+                table.close()
+        dict.clear(self)
+
+    def log_change(self, op, path, value=None):
+        super().log_change(op, path, value)
+        table = dict.get(self, path[0])
+        if isinstance(table, JsonlTable) and \
+                (len(path) > 2 or len(path) == 2 and op == "update"):
+            # the entry was modified in place, keep it until the next store
+            table.touch(path[1])
+
+    @property
+    def loaded_tables(self):
+        """ names of the tables that were read from disk or created """
+        return [k for k in self.keys() if dict.__getitem__(self, k)
+                is not _UNLOADED]
+
+    # persistence
+    def load_local(self, path):
+        """
+            Load the catalog, tables are loaded on first access
+
+            A regular single file json database is loaded completely, the
+            next store() converts it to the split layout
+
+            Args:
+                path (str): catalog file to load
+        """
+        with self.lock.read_lock():
+            path = expanduser(path)
+            if exists(path) and isfile(path):
+                self.clear()
+                self._changes = []
+                self._untracked = set()
+                self._catalog = {}
+                self._catalog_dirty = False
+                try:
+                    self.parse_count += 1
+                    data = load_commented_json(path, self.serializer,
+                                               self.snapshot_cache)
+                except Exception as e:
+                    LOG.error("Error loading json '{}'".format(path))
+                    LOG.error(repr(e))
+                    return
+                self._mark_synced(path)
+                if isinstance(data, dict) and \
+                        data.get("format") == self.CATALOG_FORMAT:
+                    self._catalog = dict(data["tables"])
+                    for table_name in self._catalog:
+                        dict.__setitem__(self, table_name, _UNLOADED)
+                    LOG.debug("Catalog {} loaded".format(path))
+                else:
+                    for table_name in data:
+                        self[table_name] = data[table_name]
+                        self.log_change("set", [table_name], self[table_name])
+                    LOG.debug("Json {} loaded, it will be converted to one "
+                              "file per table on the next store"
+                              .format(path))
+            else:
+                LOG.debug("Json '{}' not defined, skipping".format(path))
+
+    def store(self, path=None, full=False):
+        """
+            store the catalog and the tables with recorded changes
+
+            Args:
+                path (str): store a regular single file json database
+                            there instead
+                full (bool): store every loaded table, needed after
+                             tables were modified in place
+        """
+        if path and expanduser(path) != expanduser(self.path):
+            path = expanduser(path)
+            with self.lock:
+                if dirname(path) and not isdir(dirname(path)):
+                    makedirs(dirname(path))
+                data = {k: list(v) if isinstance(v, JsonlTable) else v
+                        for k, v in self.items()}
+                with atomic_write(path, self.durability, "wb") as f:
+                    self.serializer.dump(data, f, self.pretty)
+            return
+        with self._wal_lock:
+            self._store_changes(full)
+
+    def _store_changes(self, full):
+        written = self._pending_changes()
+        untracked = set(self._untracked)
+        if full:
+            dirty = self.loaded_tables
+        else:
+            dirty = []
+            for change in written:
+                if change["path"][0] not in dirty:
+                    dirty.append(change["path"][0])
+            # tables set or deleted through the dict interface
+            dirty += [k for k in untracked if k not in dirty]
+        path = expanduser(self.path)
+        if not self.table_locks:
+            with self.lock:
+                self._store_tables(dirty, full)
+                self._store_catalog(path, full)
+        else:
+            self._store_tables(dirty, full)
+            if self._catalog_dirty or full or not isfile(path):
+                with self.lock:
+                    self._store_catalog(path, full)
+        self._drop_changes(len(written))
+        self._untracked -= untracked
+
+    def changed_in_place(self):
+        """
+            compare the loaded tables with their files, see
+            JsonStorage.changed_in_place
+
+            Returns:
+                bool: True if a table file does not match its table
+        """
+        if self._watcher is not None and self._watcher.changed():
+            return False
+        for table_name in self.loaded_tables:
+            table = dict.__getitem__(self, table_name)
+            path = self.table_path(table_name)
+            if isinstance(table, JsonlTable):
+                if table.changed_in_place():
+                    return True
+            elif not isfile(path) or _differs_from_file(
+                    path, self.serializer.dumps(table, self.pretty)):
+                return True
+        return False
+
+    def _store_tables(self, dirty, full):
+        if not isdir(self.tables_path):
+            makedirs(self.tables_path)
+        for table_name in dirty:
+            if table_name in self:
+                table = self[table_name]
+                table_path = self.table_path(table_name)
+                with self._store_lock(table_name):
+                    if isinstance(table, JsonlTable):
+                        table.flush(self.durability, full)
+                    elif table_path.endswith(".jsonl"):
+                        table = JsonlTable.from_list(table_path, table,
+                                                     self.serializer,
+                                                     self.durability)
+                        dict.__setitem__(self, table_name, table)
+                    else:
+                        with atomic_write(table_path,
+                                          self.durability, "wb") as f:
+                            self.serializer.dump(table, f, self.pretty)
+            elif table_name in self._catalog:
+                table_path = join(self.tables_path,
+                                  self._catalog.pop(table_name))
+                self._catalog_dirty = True
+                with self._store_lock(table_name):
+                    for p in (table_path, table_path + ".idx"):
+                        if isfile(p):
+                            remove(p)
+
+    def _store_lock(self, table_name):
+        # self.lock is already held when tables share it
+        if self.table_locks:
+            return self.table_lock(table_name)
+        return DummyLock(None)
+
+    def _store_catalog(self, path, full):
+        if self._catalog_dirty or full or not isfile(path):
+            with atomic_write(path, self.durability, "wb") as f:
+                self.serializer.dump({"format": self.CATALOG_FORMAT,
+                                      "tables": self._catalog},
+                                     f, self.pretty)
+            self._catalog_dirty = False
+            self._mark_synced(path)
+
+    def remove(self):
+        with self.lock:
+            if isfile(self.path):
+                remove(self.path)
+            if isdir(self.tables_path):
+                rmtree(self.tables_path)
+
+
 class JsonDatabase(object):
     """ 
     searchable persistent dict. support add, update, delete in any level nested json tree.
@@ -127,26 +789,124 @@ class JsonDatabase(object):
     :type disable_lock: boolean
     :param extension: extension
     :type extension: str
+    :param wal: append changes to a write-ahead log instead of rewriting the whole file on save
+    :type wal: boolean
+    :param wal_threshold: size in bytes of the write-ahead log that triggers a compaction
+    :type wal_threshold: int
+    :param durability: none, flush or fsync, how much syncing a save pays for
+    :type durability: str
+    :param split_tables: store a catalog plus one file per table, tables are loaded on first use
+    :type split_tables: boolean
+    :param serializer: json backend, one of orjson, msgspec, ujson or json, default is the stdlib json
+    :type serializer: str
+    :param pretty: indent the stored json, else store compact json
+    :type pretty: boolean
+    :param table_format: json or jsonl (one entry per line, decoded on access), only used with split_tables=True
+    :type table_format: str
+    :param snapshot_cache: keep a binary snapshot of the parsed file to skip json parsing on the next load
+    :type snapshot_cache: boolean
+    :param inotify: detect changes made by other processes with inotify instead of stat, linux only
+    :type inotify: boolean
+    :param path_index: index the paths of every key and leaf value, get_path_by_key, get_path_by_value and
+                       get_path_by_key_value then no longer walk the whole tree
+    :type path_index: boolean
+    :param primary_key: key holding a stable id of every entry, entry ids are then the values of that key instead of
+                        positions, entries added without it get the next integer id and removed entries are dropped
+                        from the table in batches
+    :type primary_key: str
+    :param table_locks: lock every table file separately so writers of different tables do not wait for each other,
+                        only used with split_tables=True
+    :type table_locks: boolean
+    :param group_commit: save from a background thread, the saves requested at about the same time by
+                         different threads are served by a single write
+    :type group_commit: boolean
+    :param commit_window: seconds the background thread waits for more saves before writing, only used with
+                          group_commit=True
+    :type commit_window: float
     """
     def __init__(self,
             table_name,
             path=None,
             disable_lock=False,
-            extension="json"):
-        self.tables = []
-        self.name = table_name
-        self.tables.append(self.name)
-        self.path = path or f"{self.name}.{extension}"
-        self.db = JsonStorage(self.path, disable_lock=disable_lock)
+            extension="json",
+            wal=False,
+            wal_threshold=4 * 1024 * 1024,
+            durability=DURABILITY_NONE,
+            split_tables=False,
+            serializer=None,
+            pretty=True,
+            table_format="json",
+            snapshot_cache=False,
+            inotify=False,
+            path_index=False,
+            primary_key=None,
+            table_locks=False,
+            group_commit=False,
+            commit_window=0.002):
+        self._init_state(table_name, path or f"{table_name}.{extension}",
+                         primary_key, path_index)
+        self._writer = GroupCommitWriter(self._store, commit_window) \
+            if group_commit else None
+        if table_locks and not split_tables:
+            raise ValueError("table_locks requires split_tables")
+        if split_tables:
+            if wal:
+                raise ValueError("wal is not supported with split_tables")
+            self.db = SplitJsonStorage(self.path, disable_lock=disable_lock,
+                                       durability=durability,
+                                       serializer=serializer, pretty=pretty,
+                                       table_format=table_format,
+                                       snapshot_cache=snapshot_cache,
+                                       inotify=inotify,
+                                       table_locks=table_locks)
+        else:
+            self.db = JsonStorage(self.path, disable_lock=disable_lock,
+                                  wal=wal, wal_threshold=wal_threshold,
+                                  durability=durability,
+                                  serializer=serializer, pretty=pretty,
+                                  snapshot_cache=snapshot_cache,
+                                  inotify=inotify)
+
+        # the storage already loaded the file
+        self.tables = list(self.db.keys())
+        self._index_definitions, self._next_ids = load_index_file(
+            self.path, self.db.serializer)
+        if self.name not in self.db:
+            self.db[self.name] = []
+            self._log_change("set", [self.name], [])
+        if self.name not in self.tables:
+            self.tables.append(self.name)
 
-        self.db[self.name] = []
-        self.db.load_local(self.path)
-        try:
-            self.get_tables()
-        except Exception as e:
-            pass
 
 
+    def _init_state(self, table_name, path, primary_key=None,
+                    path_index=False):
+        """
+            set the state shared by databases, transactions and replicas, self.db is set by the caller
+        """
+        self.name = table_name
+        self.tables = [table_name]
+        self.path = path
+        self.primary_key = primary_key
+        # table name -> TableIndexes
+        self._indexes = {}
+        # table name -> {field: definition} of the indexes created with create_index
+        self._index_definitions = {}
+        # table name -> highest id given in primary key mode
+        self._next_ids = {}
+        # built on first path lookup, see _path_lookup
+        self._path_index = PathIndex() if path_index else None
+        # table name -> PrimaryKeyIndex, only used with primary_key
+        self._primary_keys = {}
+        # table name -> number of changes, transactions look for tables changed since their snapshot
+        self._versions = {}
+        # held while a transaction takes its snapshot or commits
+        self._commit_lock = Lock()
+        self._writer = None
+        # the open transactions, they share the containers of self.db
+        self._snapshots = WeakSet()
+        # id -> container copied since the last snapshot, safe to modify in place
+        self._owned = {}
 
     # operator overloads
     def __enter__(self):
@@ -156,18 +916,23 @@ class JsonDatabase(object):
     def __exit__(self, _type, value, traceback):
         """ Commits changes and Closes the session """
         try:
-            self.save()
+            self.close()
         except Exception as e:
             LOG.error(e)
             raise SessionError
 
     def __repr__(self):
-        return str(jsonify_recursively(self.db[self.name]))
+        return str(jsonify_recursively(self._table()))
 
     def __len__(self):
+        if self.primary_key is not None and self.name in self.db:
+            return len(self.db[self.name]) - \
+                len(self._primary_key_index().dead)
         return len(self.db.get(self.name, []))
 
     def __getitem__(self, entry):
+        if self.primary_key is not None:
+            return self.db[self.name][self._slot(entry)]
         if not isinstance(entry, int):
             try:
                 entry_id = int(entry)
@@ -182,25 +947,118 @@ class JsonDatabase(object):
         return self.db[self.name][entry_id]
 
     def __setitem__(self, entry_id, value):
-        if not isinstance(entry_id, int) or entry_id >= len(self.db[self.name]) or entry_id < 0:
+        if self.primary_key is not None:
+            self.update_entry(entry_id, value)
+        elif not isinstance(entry_id, int) or entry_id >= len(self.db[self.name]) or entry_id < 0:
             raise InvalidEntryID
         else:
             self.update_entry(entry_id, value)
 
     def __iter__(self):
-        for entry in self.db[self.name]:
+        for entry in self._table():
             yield entry
 
     def __contains__(self, entry):
         entry = jsonify_recursively(entry)
-        return entry in self.db[self.name]
+        if self._hash_index().find(entry):
+            return True
+        # the index does not see entries modified in place, a match found
+        # by the scan means it is stale
+        if entry in self._table():
+            self.reindex()
+            return True
+        return False
 
     # database
-    def save(self):
+    def save(self, force=False, wait=True):
         """
-            store the json db locally.
+            store the json db locally, does nothing if there are no changes
+
+            when no change was recorded the database is compared with its file first, entries modified in place
+            are stored then
+
+            with group_commit=True the background thread makes the write, the saves requested until it starts
+            share it
+
+        :param force: store everything, needed after entries were modified in place while other changes were
+                      recorded with wal=True or split_tables=True
+        :type force: boolean
+        :param wait: with group_commit=True, return once a write including the changes made so far is done,
+                     with wait=False the database must not be modified until then, see flush()
+        :type wait: boolean
+        """
+        if self._writer is None:
+            self._store(force)
+            return
+        ticket = self._writer.request(force)
+        if wait:
+            self._writer.wait(ticket)
+
+    def flush(self):
+        """
+            wait for the saves requested with wait=False, only used with group_commit=True
+        """
+        if self._writer is not None:
+            self._writer.wait()
+
+    def close(self):
+        """
+            save the changes and stop the background writer of group_commit=True, it can not save anymore
+
+            with group_commit=True the databases that are not closed make their pending writes when the
+            interpreter exits
+        """
+        try:
+            self.save()
+        finally:
+            if self._writer is not None:
+                self._writer.close()
+
+    def _store(self, force=False):
+        self._compact()
+        # nothing recorded, entries may still have been modified in place
+        full = force or not self.db.is_dirty and self.db.changed_in_place()
+        if full or self.db.is_dirty:
+            if self.primary_key is not None:
+                self._save_next_ids()
+            self.db.store(self.path, full=full)
+
+    @property
+    def is_dirty(self):
+        """
+            True if the database has changes that were not saved yet
+        """
+        return self.db.is_dirty or \
+            any(pk.dead for pk in self._primary_keys.values())
+
+    def changes(self, table_name=None):
         """
-        self.db.store(self.path)
+            get the changes that the next save will write
+
+        :param table_name: only return changes of this table
+        :type table_name: str
+        :return: change records, dicts with op (append, set, update or delete), path and value
+        :rtype: list
+        """
+        self._compact()
+        changes = self.db.changes()
+        if table_name is not None:
+            changes = [c for c in changes if c["path"][0] == table_name]
+        return changes
+
+    def dirty_tables(self):
+        """
+            get the tables that have changes that were not saved yet
+
+        :return: table names
+        :rtype: list
+        """
+        self._compact()
+        tables = []
+        for change in self.db.changes():
+            if change["path"][0] not in tables:
+                tables.append(change["path"][0])
+        return tables
 
     def reload(self):
         """
@@ -208,17 +1066,352 @@ class JsonDatabase(object):
         """
         self.db.reload()
 
+    @property
+    def parse_count(self):
+        """
+            number of files parsed since the database was opened
+        """
+        return self.db.parse_count
+
+    def compact(self):
+        """
+            fold the write-ahead log into the json file, only used with wal=True
+        """
+        self.db.compact()
+
+    def _log_change(self, op, path, value=None):
+        """
+            record a mutation of self.db, see apply_change
+
+        :param op: one of append, set, update or delete
+        :type op: str
+        :param path: the path of the modified node
+        :type path: list
+        :param value: the new value
+        :type value: any
+        """
+        self.db.log_change(op, path, value)
+        self._touch(path[0])
+        if self._path_index is not None:
+            self._path_index.apply_change(op, path, self.db)
+        if path[0] in self._indexes:
+            self._indexes[path[0]].apply_change(op, path,
+                                                self.db.get(path[0]))
+        if path[0] in self._primary_keys:
+            self._primary_keys[path[0]].apply_change(op, path,
+                                                     self.db.get(path[0]))
+
+    def _touch(self, table_name):
+        self._versions[table_name] = self._versions.get(table_name, 0) + 1
+
+    def _mutable(self, path, deep=False):
+        """
+            get the node at path to modify it in place, mutators get every container they change here so the
+            containers shared with open transactions are copied first
+
+        :param path: path of a table or of a container in it, [] is the dict of tables
+        :type path: list
+        :param deep: the caller also modifies the containers nested in the node
+        :type deep: boolean
+        """
+        if not self._snapshots:
+            self._owned = {}
+            node = self.db
+            for key in path:
+                node = node[key]
+            return node
+        return self._copy_path(path, deep)
+
+    def _copy_path(self, path, deep=False):
+        """
+            copy the containers along path that were not copied since the last snapshot, see _mutable
+        """
+        node = self.db
+        for depth, key in enumerate(path):
+            child = node[key]
+            if id(child) not in self._owned:
+                old = child
+                if deep and depth == len(path) - 1:
+                    child = deepcopy(old)
+                elif isinstance(old, dict):
+                    child = dict(old)
+                elif isinstance(old, (list, JsonlTable)):
+                    child = list(old)
+                else:
+                    # a leaf, nothing to modify in place
+                    return old
+                self._owned[id(child)] = child
+                if depth == 0:
+                    self._replace_table(key, old, child)
+                else:
+                    node[key] = child
+            node = child
+        return node
+
+    def _replace_table(self, table_name, old, new):
+        """ put the copy of a table in place, the open transactions keep the original """
+        for tx in list(self._snapshots):
+            tx.db.pin(table_name, old)
+        dict.__setitem__(self.db, table_name, new)
+        self._rebind(table_name, old, new)
+
+    def _rebind(self, table_name, old, new):
+        """ point the indexes of a table at its copy """
+        if table_name in self._indexes:
+            self._indexes[table_name].rebind(old, new)
+        if table_name in self._primary_keys:
+            self._primary_keys[table_name].rebind(old, new)
+        if self._path_index is not None:
+            self._path_index.rebind(table_name, old, new)
+
+    def transaction(self):
+        """
+            start a transaction, it works on a snapshot of the tables taken now and its changes become visible
+            to the database all at once when it commits
+
+            used as a context manager it commits at the end of the block and rolls back if the block fails::
+
+                with db.transaction() as tx:
+                    tx.add_entry({"name": "jarbas"})
+
+        :return: the transaction, a JsonDatabase of the snapshot
+        :rtype: Transaction
+        """
+        return Transaction(self)
+
+    def _table(self, table_name=None):
+        """
+            get a table without the entries removed in primary key mode, readers that go through every entry
+            or use positions must get the table here
+        """
+        table_name = table_name or self.name
+        self._compact(table_name)
+        return self.db[table_name]
+
+    def _primary_key_index(self, table_name=None):
+        """
+            get the ids of the entries of a table, built on first use and kept up to date by _log_change
+        """
+        table_name = table_name or self.name
+        pk = self._primary_keys.get(table_name)
+        if pk is None:
+            pk = self._primary_keys[table_name] = \
+                PrimaryKeyIndex(self.primary_key)
+            pk.next_id = self._next_ids.get(table_name, 0)
+        table = self.db[table_name]
+        if pk.is_stale(table):
+            pk.build(table)
+        return pk
+
+    def _slot(self, entry_id):
+        """
+            get the position of an entry of the current table, entry ids are positions unless primary_key is set
+        """
+        if self.primary_key is None:
+            return entry_id
+        slot = self._primary_key_index().slot(entry_id)
+        if slot is None:
+            raise InvalidEntryID
+        return slot
+
+    def _entry_id(self, slot):
+        """
+            get the id of the entry at a position of the current table
+        """
+        if self.primary_key is None:
+            return slot
+        return self._primary_key_index().id_at(slot)
+
+    def _compact(self, table_name=None):
+        """
+            drop the entries removed in primary key mode from a table, or from every table
+
+        :param table_name: the table, default is every table
+        :type table_name: str
+        """
+        names = [table_name] if table_name else list(self._primary_keys)
+        for name in names:
+            pk = self._primary_keys.get(name)
+            if pk is None or not pk.dead or pk.table is not self.db.get(name):
+                continue
+            table = self._mutable([name])
+            # later slots are dropped first so the records replay in order
+            dead = sorted(pk.dead, reverse=True)
+            if len(dead) <= 16:
+                # a few deletions, the other indexes shift their positions
+                for slot in dead:
+                    del table[slot]
+                    self.db.log_change("delete", [name, slot])
+                    if self._path_index is not None:
+                        self._path_index.apply_change("delete", [name, slot],
+                                                      self.db)
+                    if name in self._indexes:
+                        self._indexes[name].apply_change("delete",
+                                                         [name, slot], table)
+            else:
+                if type(table) is list:
+                    table[:] = [e for slot, e in enumerate(table)
+                                if slot not in pk.dead]
+                else:
+                    for slot in dead:
+                        del table[slot]
+                for slot in dead:
+                    self.db.log_change("delete", [name, slot])
+                if name in self._indexes:
+                    self._indexes[name].invalidate()
+                if self._path_index is not None:
+                    self._path_index.invalidate()
+            pk.compact()
+
+    def _get_index(self, name, factory, table_name=None):
+        """
+            get an index of a table, it is built on first use and kept up to date by _log_change
+
+        :param name: unique name of the index in the table
+        :type name: str
+        :param factory: creates the index if it does not exist yet
+        :type factory: callable
+        :param table_name: the table, default is the current table
+        :type table_name: str
+        :return: the index
+        :rtype: py3jsondb.indexes.Index
+        """
+        table_name = table_name or self.name
+        if table_name not in self._indexes:
+            self._indexes[table_name] = TableIndexes()
+        return self._indexes[table_name].get(name, self._table(table_name),
+                                             factory)
+
+    def _hash_index(self, table_name=None):
+        return self._get_index("hash", HashIndex, table_name)
+
+    def _field_index(self, field, table_name=None):
+        """
+            get the index of a field created with create_index, None if the field is not indexed
+        """
+        table_name = table_name or self.name
+        definition = self._index_definitions.get(table_name, {}).get(field)
+        if definition is None or table_name not in self.db:
+            return None
+        return self._get_index(("field", field),
+                               lambda: index_from_definition(field, definition),
+                               table_name)
+
+    def _save_index_definitions(self):
+        with self.db.lock:
+            save_index_definitions(self.path, self._index_definitions,
+                                   self.db.serializer, self.db.durability,
+                                   self._next_ids)
+
+    def _save_next_ids(self):
+        """
+            persist the primary key high-water marks that moved, before the entries using them are stored
+        """
+        moved = False
+        for name, pk in self._primary_keys.items():
+            if pk.next_id > self._next_ids.get(name, 0):
+                self._next_ids[name] = pk.next_id
+                moved = True
+        if moved:
+            self._save_index_definitions()
+
+    def create_index(self, field, table_name=None, index_type="hash",
+                     **options):
+        """
+            index the values of a field, lookups of the field by value no longer scan the table
+
+            the index is kept up to date by every method that modifies the table, its definition is stored
+            next to the database file (<path>.indexes) and the index is rebuilt on first use after loading
+
+        :param field: the key of the entries to index
+        :type field: str
+        :param table_name: the indexed table, default is the current table
+        :type table_name: str
+        :param index_type: hash for lookups by value, ordered to also answer range queries and sort by the field,
+                           token for Query.value_contains_token and value_contains, fuzzy for
+                           Query.contains_value(fuzzy=True)
+        :type index_type: str
+        :param options: options of the index type, tokenizer (whitespace or words) and ignore_case for token indexes
+        :type options: dict
+        """
+        table_name = table_name or self.name
+        if table_name not in self.db:
+            raise TableNotFound
+        index = index_from_definition(field, dict(options, type=index_type))
+        definitions = self._index_definitions.setdefault(table_name, {})
+        definitions[field] = index.definition()
+        if table_name in self._indexes:
+            self._indexes[table_name].indexes.pop(("field", field), None)
+        self._save_index_definitions()
+        # build it now rather than on the first lookup
+        self._field_index(field, table_name)
+
+    def drop_index(self, field, table_name=None):
+        """
+            delete the index of a field
+
+        :param field: the indexed key
+        :type field: str
+        :param table_name: the indexed table, default is the current table
+        :type table_name: str
+        """
+        table_name = table_name or self.name
+        definitions = self._index_definitions.get(table_name, {})
+        if definitions.pop(field, None) is None:
+            return
+        if not definitions:
+            self._index_definitions.pop(table_name)
+        if table_name in self._indexes:
+            self._indexes[table_name].indexes.pop(("field", field), None)
+        self._save_index_definitions()
+
+    def get_indexes(self, table_name=None):
+        """
+            get the indexed fields of a table
+
+        :param table_name: the table, default is the current table
+        :type table_name: str
+        :return: the indexed fields
+        :rtype: list
+        """
+        return list(self._index_definitions.get(table_name or self.name, {}))
+
+    def reindex(self):
+        """
+            rebuild all indexes on next use, needed after entries were modified in place
+        """
+        self._compact()
+        for pk in self._primary_keys.values():
+            pk.invalidate()
+        for indexes in self._indexes.values():
+            indexes.invalidate()
+        if self._path_index is not None:
+            self._path_index.invalidate()
+
+    def _path_lookup(self):
+        """
+            get the path index, built or rebuilt if the tables changed, None if path_index is disabled
+        """
+        if self._path_index is None:
+            return None
+        self._compact()
+        if self._path_index.is_stale(self.db):
+            self._path_index.build(self.db)
+        return self._path_index
+
     def delete_database(self):
         """
             delete the current json db
         """
         self.db.remove()
+        if isfile(index_definitions_path(self.path)):
+            remove(index_definitions_path(self.path))
 
     def print(self):
         """
             print the json tree of current table
         """
-        pprint(jsonify_recursively(self.db[self.name]))
+        pprint(jsonify_recursively(self._table()))
 
     def add_table(self,table_name):
         """
@@ -229,6 +1422,7 @@ class JsonDatabase(object):
         """
         if table_name not in self.tables:
             self.db[table_name] = []
+            self._log_change("set", [table_name], [])
             self.save()
         self.name = table_name
         self.get_tables()
@@ -246,12 +1440,12 @@ class JsonDatabase(object):
 
     def get_tables(self):
         """
-            get all tables of database
+            get all tables of database, the file is only reloaded if another process changed it
 
         :return: all tables of database
         :rtype: list
         """
-        self.reload()
+        self.db.refresh()
         self.tables = list(self.db.keys())
         return self.tables
 
@@ -269,15 +1463,52 @@ class JsonDatabase(object):
         if self.name == table_name:
             self.name = self.tables[0]
         self.db.pop(table_name)
+        self._log_change("delete", [table_name])
+        self._indexes.pop(table_name, None)
+        self._primary_keys.pop(table_name, None)
+        self._next_ids.pop(table_name, None)
+        if self._index_definitions.pop(table_name, None):
+            self._save_index_definitions()
         self.save()
         self.get_tables()
 
     # item manipulations
     def _append_entry(self, entry):
         entry = jsonify_recursively(entry)
-        self.db[self.name].append(entry)
+        self._mutable([self.name]).append(entry)
+        self._log_change("append", [self.name], entry)
         return len(self.db[self.name])
 
+    def _with_id(self, entry, entry_id=None):
+        """
+            get a copy of a dict entry holding its primary key, entry_id or the next id if it has none
+        """
+        if not isinstance(entry, dict):
+            raise ValueError("entries must be dicts when primary_key is set")
+        entry = jsonify_recursively(entry)
+        if entry_id is None:
+            entry_id = entry.get(self.primary_key)
+            if entry_id is None:
+                entry_id = self._primary_key_index().next_id
+        elif entry.get(self.primary_key, entry_id) != entry_id:
+            raise ValueError("the primary key of an entry can not be changed")
+        if entry.get(self.primary_key) == entry_id:
+            return entry
+        return dict(entry, **{self.primary_key: entry_id})
+
+    def _add_entry_with_id(self, entry, allow_duplicates):
+        pk = self._primary_key_index()
+        entry = self._with_id(entry)
+        entry_id = entry[self.primary_key]
+        slot = pk.slot(entry_id)
+        if slot is not None:
+            if not allow_duplicates and self.db[self.name][slot] == entry:
+                return entry_id
+            raise ValueError("primary key {} is already used".format(
+                repr(entry_id)))
+        self._append_entry(entry)
+        return entry_id
+
     def add_entry(self, entry, allow_duplicates=False):
         """ 
         add an entry to current table
@@ -289,6 +1520,8 @@ class JsonDatabase(object):
         :return: the entry id
         :rtype: int
         """
+        if self.primary_key is not None:
+            return self._add_entry_with_id(entry, allow_duplicates)
         if allow_duplicates or entry not in self:
             self._append_entry(entry)
             return len(self.db[self.name])
@@ -308,8 +1541,21 @@ class JsonDatabase(object):
         :rtype: list
         """
         entry = jsonify_recursively(entry)
+        table = self._table()
+        if strictly:
+            return [(table[idx], self._entry_id(idx))
+                    for idx in self._hash_index().find(entry)]
+        candidates = enumerate(table)
+        if isinstance(entry, dict):
+            # only entries sharing the value of an indexed field can match
+            for field, value in entry.items():
+                index = self._field_index(field)
+                if isinstance(index, FieldIndex):
+                    candidates = ((idx, table[idx])
+                                  for idx in index.find(value))
+                    break
         matches = []
-        for idx, data in enumerate(self.db[self.name]):
+        for idx, data in candidates:
             # TODO match strategy
             # - require exact match
             # - require list of keys to match
@@ -319,10 +1565,10 @@ class JsonDatabase(object):
             # by default check for exact matches
             if strictly:
                 if data == entry:
-                    matches.append((data, idx))
+                    matches.append((data, self._entry_id(idx)))
             else:
                 if entry.items() < data.items():
-                    matches.append((data, idx))
+                    matches.append((data, self._entry_id(idx)))
         return matches
 
     def merge_entry(self, entry, entry_id=None, match_strategy=None,
@@ -334,22 +1580,29 @@ class JsonDatabase(object):
                 raise MatchError
             match, entry_id = matches[0][1]
         else:
-            match = self.db[self.name][entry_id]
+            # merge_dict also modifies the nested values of the entry
+            match = self._mutable([self.name, self._slot(entry_id)],
+                                  deep=True)
         # TODO merge strategy
         # - only merge some keys
         # - dont merge some keys
         # - merge all keys
         # - dont overwrite keys
         entry = jsonify_recursively(entry)
-        self.db[self.name][entry_id] = merge_dict(match, entry)
+        slot = self._slot(entry_id)
+        if self.primary_key is not None:
+            entry = self._with_id(entry, entry_id)
+        self._mutable([self.name])[slot] = merge_dict(match, entry)
+        self._log_change("set", [self.name, slot],
+                         self.db[self.name][slot])
 
 
     # item_id
     def get_entry_id(self, entry,strictly=True):
         """
         get entry_id of current table
-        entry_id is simply the index of the entry in the table
-        WARNING: this is not immutable across sessions
+        entry_id is simply the index of the entry in the table, or its primary key if primary_key is set
+        WARNING: positions are not immutable across sessions, primary keys are
 
         :param entry: the entry you want to match
         :type entry: dict or list
@@ -382,7 +1635,7 @@ class JsonDatabase(object):
         :return: the entry id list, return -1 if not found
         :rtype: list
         """
-        entry = {key,value}
+        entry = {key: value}
         return self.get_entry_id(entry,strictly)
 
     def get_entry_by_id(self,entry_id):
@@ -394,7 +1647,7 @@ class JsonDatabase(object):
         :return: the entry info
         :rtype: dict
         """
-        return self.db[self.name][entry_id]
+        return self.db[self.name][self._slot(entry_id)]
 
     def get_entry_path_by_id(self,entry_id):
         """
@@ -405,7 +1658,7 @@ class JsonDatabase(object):
         :return: the entry path
         :rtype: list
         """
-        return [self.name,entry_id]
+        return [self.name,self._slot(entry_id)]
 
     def get_child_by_entry_id(self,entry_id,child_name='children'):
         """
@@ -418,9 +1671,9 @@ class JsonDatabase(object):
         :return: the child info
         :rtype: dict
         """ 
-        entry = self.db[self.name][entry_id]
+        entry = self.db[self.name][self._slot(entry_id)]
         if child_name in list(entry.keys()):
-            return self.db[self.name][entry_id][child_name]
+            return entry[child_name]
         else:
             raise ChildNotFound
 
@@ -435,8 +1688,11 @@ class JsonDatabase(object):
         :param child_name: custom child node name
         :type child_name: str
         """ 
-        entry = self.db[self.name][entry_id]
+        slot = self._slot(entry_id)
+        self._check_child_name(child_name)
+        entry = self._mutable([self.name, slot])
         entry[child_name] = child_data
+        self._log_change("set", [self.name, slot, child_name], child_data)
 
     def get_child_path_of_entry(self,entry_id,child_name='children'):
         """
@@ -449,7 +1705,7 @@ class JsonDatabase(object):
         :return: the child path
         :rtype: list
         """ 
-        return [self.name,entry_id,child_name]
+        return [self.name,self._slot(entry_id),child_name]
 
     def update_child_of_entry(self,entry_id,child_data,overwrite=True,child_name='children'):
         """
@@ -464,12 +1720,15 @@ class JsonDatabase(object):
         :param child_name: custom child node name
         :type child_name: str
         """ 
-        entry = self.db[self.name][entry_id]
+        slot = self._slot(entry_id)
+        self._check_child_name(child_name)
         if overwrite:
-            entry[child_name] = child_data
+            self._mutable([self.name, slot])[child_name] = child_data
+            self._log_change("set", [self.name, slot, child_name], child_data)
         else:
             if isinstance(child_data,dict):
-                entry[child_name].update(child_data)
+                self._mutable([self.name, slot, child_name]).update(child_data)
+                self._log_change("update", [self.name, slot, child_name], child_data)
             else:
                 raise Exception("only dict can use overwrite=False")
 
@@ -482,9 +1741,12 @@ class JsonDatabase(object):
         :param child_name: custom child node name
         :type child_name: str
         """ 
-        entry = self.db[self.name][entry_id]
+        slot = self._slot(entry_id)
+        self._check_child_name(child_name)
+        entry = self.db[self.name][slot]
         if child_name in list(entry.keys()):
-            self.db[self.name][entry_id].pop(child_name)
+            self._mutable([self.name, slot]).pop(child_name)
+            self._log_change("delete", [self.name, slot, child_name])
         else:
             raise ChildNotFound
 
@@ -500,11 +1762,17 @@ class JsonDatabase(object):
         :type overwrite: boolean
         """
         new_entry = jsonify_recursively(new_entry)
+        slot = self._slot(entry_id)
+        if self.primary_key is not None and \
+                (overwrite or self.primary_key in new_entry):
+            new_entry = self._with_id(new_entry, entry_id)
         if overwrite:
-            self.db[self.name][entry_id] = new_entry
+            self._mutable([self.name])[slot] = new_entry
+            self._log_change("set", [self.name, slot], new_entry)
         else:
             if isinstance(new_entry,dict):
-                self.db[self.name][entry_id].update(new_entry)
+                self._mutable([self.name, slot]).update(new_entry)
+                self._log_change("update", [self.name, slot], new_entry)
             else:
                 raise Exception("only dict can use overwrite=False")
 
@@ -515,9 +1783,24 @@ class JsonDatabase(object):
         :param entry_id: the entry id
         :type entry_id: int
         """
-        res = self.db[self.name].pop(entry_id)
+        if self.primary_key is not None:
+            # leave a tombstone, the following entries keep their slots
+            pk = self._primary_key_index()
+            slot = self._slot(entry_id)
+            res = self.db[self.name][slot]
+            pk.kill(slot)
+            self._touch(self.name)
+            if len(pk.dead) * 2 > len(pk.table):
+                self._compact(self.name)
+            return res
+        res = self._mutable([self.name]).pop(entry_id)
+        self._log_change("delete", [self.name, entry_id])
         return res
 
+    def _check_child_name(self, child_name):
+        if self.primary_key is not None and child_name == self.primary_key:
+            raise ValueError("the primary key of an entry can not be changed")
+
     # search
     def search_by_key(self, key, fuzzy=False, thresh=0.7, include_empty=False):
         """
@@ -532,8 +1815,13 @@ class JsonDatabase(object):
         :return: search result
         :rtype: list
         """ 
+        self._compact()
         if fuzzy:
-            return get_key_recursively_fuzzy(self.db, key, thresh, not include_empty)
+            # the path index knows the keys that may reach thresh
+            index = self._path_lookup()
+            candidates = None if index is None else \
+                set(index.fuzzy_keys(key, thresh))
+            return get_key_recursively_fuzzy(self.db, key, thresh, not include_empty, candidates)
         return get_key_recursively(self.db, key, not include_empty)
 
     def search_by_value(self, key, value, fuzzy=False, thresh=0.7):
@@ -551,8 +1839,13 @@ class JsonDatabase(object):
         :return: search result
         :rtype: list
         """ 
+        self._compact()
         if fuzzy:
-            return get_value_recursively_fuzzy(self.db, key, value, thresh)
+            # the path index knows the values that may reach thresh
+            index = self._path_lookup()
+            candidates = None if index is None else \
+                set(index.fuzzy_values(value, thresh))
+            return get_value_recursively_fuzzy(self.db, key, value, thresh, candidates)
         return get_value_recursively(self.db, key, value)
 
     def get_path_by_key(self,key,fuzzy=False,thresh=0.7):
@@ -568,6 +1861,10 @@ class JsonDatabase(object):
         :return: detail path
         :rtype: list
         """ 
+        index = self._path_lookup()
+        if index is not None:
+            return index.find_key(key, fuzzy, thresh)
+        self._compact()
         jp = JsonPath(self.db,mode = 'key',fuzzy=fuzzy,thresh=thresh)
         paths = jp.find_all(key)
         return paths
@@ -585,6 +1882,12 @@ class JsonDatabase(object):
         :return: detail path
         :rtype: list
         """ 
+        index = self._path_lookup()
+        if index is not None:
+            paths = index.find_value(value, fuzzy, thresh)
+            if paths is not None:
+                return paths
+        self._compact()
         jp = JsonPath(self.db,mode = 'value',fuzzy=fuzzy,thresh=thresh)
         paths = jp.find_all(value)
         return paths
@@ -604,6 +1907,10 @@ class JsonDatabase(object):
         :return: detail path
         :rtype: list
         """ 
+        index = self._path_lookup()
+        if index is not None:
+            return index.find_key_value(key, value, fuzzy, thresh)
+        self._compact()
         jp = JsonPath(self.db,mode = 'key_value',fuzzy=fuzzy,thresh=thresh)
         paths = jp.find_all({key:value})
         return paths
@@ -617,11 +1924,13 @@ class JsonDatabase(object):
         :param new_value: the updated value
         :type new_value: any
         """ 
-        obj_ptr = self.db
-        for key in path:
+        object_path = self._object_path(path)
+        obj_ptr = self._mutable(object_path)
+        for key in path[len(object_path):]:
             if key == path[-1]:
                 obj_ptr[key] = new_value
             obj_ptr = obj_ptr[key]
+        self._log_change("set", object_path + [path[-1]], new_value)
 
     def get_value_by_path(self,path):
         """
@@ -655,6 +1964,11 @@ class JsonDatabase(object):
             obj_ptr = obj_ptr[key]
         return None
 
+    @staticmethod
+    def _object_path(path):
+        # get_object_by_path stops at the first key equal to the last one
+        return list(path[:list(path).index(path[-1])])
+
     def get_child_by_path(self,path,child_name='children'):
         """
         get the child info by path
@@ -684,8 +1998,9 @@ class JsonDatabase(object):
         :param child_name: the custom child name
         :type child_name: str
         """ 
-        val = self.get_object_by_path(path)
+        val = self._mutable(self._object_path(path))
         val[child_name] = child_data
+        self._log_change("set", self._object_path(path) + [child_name], child_data)
 
     def update_child_of_path(self,path,child_data,overwrite=True,child_name='children'):
         """
@@ -700,12 +2015,14 @@ class JsonDatabase(object):
         :param child_name: the custom child name
         :type child_name: str
         """ 
-        val = self.get_object_by_path(path)
+        object_path = self._object_path(path)
         if overwrite:
-            val[child_name] = child_data
+            self._mutable(object_path)[child_name] = child_data
+            self._log_change("set", object_path + [child_name], child_data)
         else:
             if isinstance(child_data,dict):
-                val[child_name].update(child_data)
+                self._mutable(object_path + [child_name]).update(child_data)
+                self._log_change("update", self._object_path(path) + [child_name], child_data)
             else:
                 raise Exception("only dict can use overwrite=False")
 
@@ -719,8 +2036,215 @@ class JsonDatabase(object):
         :param child_name: the custom child name
         :type child_name: str
         """ 
-        val = self.get_object_by_path(path)
+        val = self._mutable(self._object_path(path))
         val.pop(child_name)
+        self._log_change("delete", self._object_path(path) + [child_name])
+
+class _TransactionStorage(dict):
+    """
+    the tables of a Transaction, a shallow copy of the dict of tables of the
+    database, change records are kept until the transaction commits
+    """
+
+    def __init__(self, storage):
+        # tables of SplitJsonStorage that were not read yet stay unloaded
+        super().__init__(dict.items(storage))
+        self._storage = storage
+        # the tables of the snapshot, compared with the database on commit
+        self.base = dict(self)
+        # tables added, replaced or deleted by the transaction
+        self.modified = set()
+        self._changes = []
+        self.lock = storage.lock
+        self._wal_lock = storage._wal_lock
+        self.serializer = storage.serializer
+        self.durability = storage.durability
+
+    def _resolve(self, key, value):
+        if value is _UNLOADED:
+            value = self._storage[key]
+            dict.__setitem__(self, key, value)
+            self.base[key] = value
+        return value
+
+    def __getitem__(self, key):
+        return self._resolve(key, dict.__getitem__(self, key))
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.modified.add(key)
+
+    def pin(self, key, value):
+        """ keep the version of a table the database is about to replace if
+        it was not loaded yet """
+        if dict.get(self, key) is _UNLOADED:
+            dict.__setitem__(self, key, value)
+            self.base[key] = value
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def pop(self, key, *args):
+        if key in self:
+            self.modified.add(key)
+        return dict.pop(self, key, *args)
+
+    @property
+    def is_dirty(self):
+        return bool(self._changes)
+
+    def changes(self):
+        return list(self._changes)
+
+    def log_change(self, op, path, value=None):
+        record = {"op": op, "path": list(path)}
+        if op != "delete":
+            record["value"] = value
+        self._changes.append(record)
+
+    def refresh(self):
+        return False
+
+    @property
+    def parse_count(self):
+        return self._storage.parse_count
+
+
+class Transaction(JsonDatabase):
+    """
+    a JsonDatabase working on a snapshot of the tables of another one, see
+    JsonDatabase.transaction()
+
+    the snapshot shares the tables and entries of the database, a table or
+    entry is copied the first time the transaction modifies it, readers of
+    the database keep seeing the committed version and a rollback only drops
+    the copies
+
+    while transactions are open the database copies the containers it
+    modifies the same way, the snapshots never see writes made after they
+    were taken
+
+    :param db: the database
+    :type db: JsonDatabase
+    """
+    def __init__(self, db):
+        with db._commit_lock:
+            # entries removed in primary key mode are not part of the snapshot
+            db._compact()
+            # the snapshot shares every container, the database copies them
+            # before modifying them from now on
+            db._snapshots.add(self)
+            db._owned = {}
+            self.db = _TransactionStorage(db.db)
+            self._base_versions = dict(db._versions)
+        self._parent = db
+        self._init_state(db.name, db.path, db.primary_key,
+                         db._path_index is not None)
+        self.tables = list(self.db.keys())
+        self._index_definitions = db._index_definitions
+        self._next_ids = db._next_ids
+        self.closed = False
+
+    def __exit__(self, _type, value, traceback):
+        """ Commits the transaction, or rolls it back if the block failed """
+        if self.closed:
+            return
+        if _type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    def save(self, force=False, wait=True):
+        """
+            does nothing, the changes are handed to the database by commit() and stored by its save()
+        """
+
+    def _check_open(self):
+        if self.closed:
+            raise TransactionClosed
+
+    def _mutable(self, path, deep=False):
+        self._check_open()
+        return self._copy_path(path, deep)
+
+    def _replace_table(self, table_name, old, new):
+        self.db[table_name] = new
+        self._rebind(table_name, old, new)
+
+    def commit(self):
+        """
+            make the changes of the transaction visible to the database at once, they are recorded as changes
+            of the database and stored by its next save()
+
+            fails with TransactionConflict and rolls back if a modified table was changed by another writer
+            since the snapshot was taken
+        """
+        self._check_open()
+        self._compact()
+        db = self._parent
+        # a store of the database waits for the whole commit
+        with db._commit_lock, db.db._wal_lock:
+            for name in self.db.modified:
+                base = self.db.base.get(name)
+                current = dict.get(db.db, name)
+                if current is not base and base is not _UNLOADED or \
+                        db._versions.get(name, 0) != \
+                        self._base_versions.get(name, 0):
+                    self.rollback()
+                    raise TransactionConflict(
+                        "table {} was changed since the transaction "
+                        "started".format(name))
+            # every table is published at once, the changes of the tables
+            # are logged below
+            dict.update(db.db, {name: self.db[name]
+                                for name in self.db.modified
+                                if name in self.db})
+            for name in self.db.modified:
+                if name not in self.db:
+                    dict.pop(db.db, name, None)
+                db._touch(name)
+                # the indexes built on the copies are up to date, the
+                # other ones are rebuilt on next use
+                if name in self._indexes:
+                    db._indexes[name] = self._indexes[name]
+                else:
+                    db._indexes.pop(name, None)
+                if name in self._primary_keys:
+                    db._primary_keys[name] = self._primary_keys[name]
+                else:
+                    db._primary_keys.pop(name, None)
+            for change in self.db.changes():
+                db.db.log_change(change["op"], change["path"],
+                                 change.get("value"))
+            if self.db.modified:
+                if db._path_index is not None:
+                    db._path_index.invalidate()
+                db.tables = list(db.db.keys())
+                if db.name not in db.tables:
+                    db.name = db.tables[0]
+        self._close()
+
+    def rollback(self):
+        """
+            drop the changes of the transaction
+        """
+        self._close()
+
+    def _close(self):
+        self.closed = True
+        self._parent._snapshots.discard(self)
+        self._owned = {}
+        self._indexes = {}
+        self._primary_keys = {}
+
 
 # XDG aware classes
 
@@ -731,10 +2255,11 @@ class JsonStorageXDG(JsonStorage):
                  name,
                  xdg_folder=BaseDirectory.xdg_cache_home,
                  disable_lock=False, subfolder="json_database",
-                 extension="json"):
+                 extension="json", snapshot_cache=False):
         self.name = name
         path = join(xdg_folder, subfolder, f"{name}.{extension}")
-        super().__init__(path, disable_lock=disable_lock)
+        super().__init__(path, disable_lock=disable_lock,
+                         snapshot_cache=snapshot_cache)
 
 
 class JsonDatabaseXDG(JsonDatabase):
@@ -742,14 +2267,16 @@ class JsonDatabaseXDG(JsonDatabase):
 
     def __init__(self, name, xdg_folder=BaseDirectory.xdg_data_home,
                  disable_lock=False, subfolder="json_database",
-                 extension="jsondb"):
+                 extension="jsondb", snapshot_cache=False):
         path = join(xdg_folder, subfolder, f"{name}.{extension}")
-        super().__init__(name, path, disable_lock=disable_lock, extension=extension)
+        super().__init__(name, path, disable_lock=disable_lock, extension=extension,
+                         snapshot_cache=snapshot_cache)
 
 class JsonConfigXDG(JsonStorageXDG):
     """ xdg respectful config files, using json_storage.JsonStorageXDG """
 
     def __init__(self, name, xdg_folder=BaseDirectory.xdg_config_home,
                  disable_lock=False, subfolder="json_database",
-                 extension="json"):
-        super().__init__(name, xdg_folder, disable_lock, subfolder, extension)
+                 extension="json", snapshot_cache=False):
+        super().__init__(name, xdg_folder, disable_lock, subfolder, extension,
+                         snapshot_cache)
@@ -0,0 +1,383 @@
+""" asyncio front ends of JsonStorage, JsonDatabase and Query
+
+file access, lock waits, parsing and searches run in an executor, the
+default executor of the event loop unless one is given, so the loop keeps
+serving other tasks while the database is loaded, saved or searched
+
+the wrapped objects are not thread safe, the calls made through one
+AsyncJsonDatabase or AsyncJsonStorage run one at a time in the order they
+were awaited
+"""
+import asyncio
+from functools import partial
+
+from py3jsondb import JsonDatabase, JsonStorage
+from py3jsondb.search import Query
+
+
+class _AsyncWrapper:
+    """ runs the calls of a wrapped object in an executor, one at a time
+
+    the object is created in the executor on first use by _open
+    """
+
+    def __init__(self, executor=None):
+        self.executor = executor
+        self._obj = None
+        # created by the first call, before python 3.10 a lock is bound to
+        # the event loop of the thread creating it
+        self._lock = None
+
+    def _open(self):
+        raise NotImplementedError
+
+    def _in_executor(self, func):
+        return asyncio.get_running_loop().run_in_executor(self.executor, func)
+
+    @staticmethod
+    async def _finish(future):
+        """ await a future of the executor, a cancelled caller still waits
+        for the thread to be done so the next call does not run with it """
+        try:
+            return await asyncio.shield(future)
+        finally:
+            while not future.done():
+                try:
+                    await asyncio.wait([future])
+                except asyncio.CancelledError:
+                    pass
+
+    async def _run(self, func, *args, **kwargs):
+        """ run func(obj, *args, **kwargs) in the executor """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._obj is None:
+                self._obj = await self._finish(self._in_executor(self._open))
+            return await self._finish(self._in_executor(
+                partial(func, self._obj, *args, **kwargs)))
+
+    async def _call(self, name, *args, **kwargs):
+        return await self._run(
+            lambda obj: getattr(obj, name)(*args, **kwargs))
+
+    async def open(self):
+        """
+            load the file, done by the first call otherwise
+        """
+        await self._run(lambda obj: None)
+        return self
+
+    async def __aenter__(self):
+        return await self.open()
+
+
+class AsyncJsonStorage(_AsyncWrapper):
+    """
+    JsonStorage whose loads and stores do not block the event loop
+
+    the dict itself is read and modified directly, but not while store(),
+    reload() or refresh() is running, await them first::
+
+        async with AsyncJsonStorage("config.json") as storage:
+            storage["key"] = "value"
+        # stored on exit
+
+    :param path: json file path
+    :type path: str
+    :param executor: runs the blocking calls, default is the executor of the event loop
+    :type executor: concurrent.futures.Executor
+    :param kwargs: the options of JsonStorage
+    :type kwargs: dict
+    """
+
+    def __init__(self, path, executor=None, **kwargs):
+        super().__init__(executor)
+        self.path = path
+        self._kwargs = kwargs
+
+    def _open(self):
+        return JsonStorage(self.path, **self._kwargs)
+
+    @property
+    def storage(self):
+        """
+            the wrapped JsonStorage, None until it was opened
+        """
+        return self._obj
+
+    def _loaded(self):
+        if self._obj is None:
+            raise RuntimeError("open the storage first, await open() or "
+                               "use async with")
+        return self._obj
+
+    async def __aexit__(self, _type, value, traceback):
+        await self.store()
+
+    def __getattr__(self, name):
+        # in memory methods, get, keys, changes, log_change...
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._loaded(), name)
+
+    def __getitem__(self, key):
+        return self._loaded()[key]
+
+    def __setitem__(self, key, value):
+        self._loaded()[key] = value
+
+    def __delitem__(self, key):
+        del self._loaded()[key]
+
+    def __contains__(self, key):
+        return key in self._loaded()
+
+    def __iter__(self):
+        return iter(self._loaded())
+
+    def __len__(self):
+        return len(self._loaded())
+
+    async def store(self, path=None, full=False):
+        """
+            see JsonStorage.store
+        """
+        await self._call("store", path, full)
+
+    async def reload(self):
+        """
+            see JsonStorage.reload
+        """
+        await self._call("reload")
+
+    async def refresh(self):
+        """
+            see JsonStorage.refresh
+        """
+        return await self._call("refresh")
+
+    async def compact(self):
+        """
+            see JsonStorage.compact
+        """
+        await self._call("compact")
+
+    async def remove(self):
+        """
+            see JsonStorage.remove
+        """
+        await self._call("remove")
+
+
+class AsyncJsonDatabase(_AsyncWrapper):
+    """
+    JsonDatabase whose methods are awaitable and run in an executor
+
+    save, reload, get_tables, the searches and the path lookups are defined
+    here, every other method of JsonDatabase is awaitable as well::
+
+        async with AsyncJsonDatabase("users", "users.db") as db:
+            await db.add_entry({"name": "jarbas"})
+            users = await db.query().equal("name", "jarbas").build()
+        # saved on exit
+
+    :param table_name: table name of database
+    :type table_name: str
+    :param path: json file path
+    :type path: str
+    :param executor: runs the blocking calls, default is the executor of the event loop
+    :type executor: concurrent.futures.Executor
+    :param kwargs: the options of JsonDatabase
+    :type kwargs: dict
+    """
+
+    def __init__(self, table_name, path=None, executor=None, **kwargs):
+        super().__init__(executor)
+        self.table_name = table_name
+        self.path = path
+        self._kwargs = kwargs
+
+    def _open(self):
+        return JsonDatabase(self.table_name, self.path, **self._kwargs)
+
+    @property
+    def db(self):
+        """
+            the wrapped JsonDatabase, None until it was opened
+        """
+        return self._obj
+
+    async def __aexit__(self, _type, value, traceback):
+        await self.close()
+
+    def __getattr__(self, name):
+        if name.startswith("_") or not callable(getattr(JsonDatabase, name,
+                                                        None)):
+            raise AttributeError(name)
+        return partial(self._call, name)
+
+    def query(self):
+        """
+            get a query of the current table, its results are awaitable
+
+        :rtype: AsyncQuery
+        """
+        return AsyncQuery(self)
+
+    async def save(self, force=False, wait=True, **kwargs):
+        """
+            see JsonDatabase.save
+        """
+        await self._call("save", force, wait, **kwargs)
+
+    async def close(self):
+        """
+            see JsonDatabase.close
+        """
+        await self._call("close")
+
+    async def reload(self):
+        """
+            see JsonDatabase.reload
+        """
+        await self._call("reload")
+
+    async def get_tables(self):
+        """
+            see JsonDatabase.get_tables
+        """
+        return await self._call("get_tables")
+
+    async def search_by_key(self, key, fuzzy=False, thresh=0.7,
+                            include_empty=False):
+        """
+            see JsonDatabase.search_by_key
+        """
+        return await self._call("search_by_key", key, fuzzy, thresh,
+                                include_empty)
+
+    async def search_by_value(self, key, value, fuzzy=False, thresh=0.7):
+        """
+            see JsonDatabase.search_by_value
+        """
+        return await self._call("search_by_value", key, value, fuzzy, thresh)
+
+    async def get_path_by_key(self, key, fuzzy=False, thresh=0.7):
+        """
+            see JsonDatabase.get_path_by_key
+        """
+        return await self._call("get_path_by_key", key, fuzzy, thresh)
+
+    async def get_path_by_value(self, value, fuzzy=False, thresh=0.7):
+        """
+            see JsonDatabase.get_path_by_value
+        """
+        return await self._call("get_path_by_value", value, fuzzy, thresh)
+
+    async def get_path_by_key_value(self, key, value, fuzzy=False,
+                                    thresh=0.7):
+        """
+            see JsonDatabase.get_path_by_key_value
+        """
+        return await self._call("get_path_by_key_value", key, value, fuzzy,
+                                thresh)
+
+
+class AsyncQuery:
+    """
+    Query of an AsyncJsonDatabase
+
+    filters, order_by(), limit() and offset() are recorded like with Query,
+    the methods returning results are awaitable and run the query in the
+    executor of the database, async for iterates the result
+
+    :param db: the database
+    :type db: AsyncJsonDatabase
+    """
+
+    def __init__(self, db):
+        self._db = db
+        # (method name, args, kwargs) replayed on a Query
+        self._calls = []
+
+    def __getattr__(self, name):
+        if name.startswith("_") or not callable(getattr(Query, name, None)):
+            raise AttributeError(name)
+
+        def record(*args, **kwargs):
+            self._calls.append((name, args, kwargs))
+            return self
+        return record
+
+    def _query(self, db):
+        query = Query(db)
+        for name, args, kwargs in self._calls:
+            getattr(query, name)(*args, **kwargs)
+        return query
+
+    async def _result(self, name, *args, **kwargs):
+        return await self._db._run(
+            lambda db: getattr(self._query(db), name)(*args, **kwargs))
+
+    async def __aiter__(self):
+        for entry in await self.build():
+            yield entry
+
+    async def build(self):
+        """ see Query.build """
+        return await self._result("build")
+
+    async def first(self):
+        """ see Query.first """
+        return await self._result("first")
+
+    async def count(self):
+        """ see Query.count """
+        return await self._result("count")
+
+    async def exists(self):
+        """ see Query.exists """
+        return await self._result("exists")
+
+    async def explain(self):
+        """ see Query.explain """
+        return await self._result("explain")
+
+    async def sum(self, key):
+        """ see Query.sum """
+        return await self._result("sum", key)
+
+    async def avg(self, key):
+        """ see Query.avg """
+        return await self._result("avg", key)
+
+    async def min(self, key):
+        """ see Query.min """
+        return await self._result("min", key)
+
+    async def max(self, key):
+        """ see Query.max """
+        return await self._result("max", key)
+
+    async def distinct(self, key):
+        """ see Query.distinct """
+        return await self._result("distinct", key)
+
+    def group_by(self, key):
+        """ see Query.group_by, agg() is awaitable """
+        return AsyncGroupBy(self, key)
+
+
+class AsyncGroupBy:
+    """ GroupBy of an AsyncQuery """
+
+    def __init__(self, query, key):
+        self.query = query
+        self.key = key
+
+    async def agg(self, **aggregations):
+        """ see GroupBy.agg """
+        return await self.query._db._run(
+            lambda db: self.query._query(db).group_by(self.key).agg(
+                **aggregations))
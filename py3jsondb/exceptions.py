@@ -20,4 +20,13 @@ class TableCanNotBeEmpty(ValueError):
     """ Table can not be empty """
 
 class ChildNotFound(FileNotFoundError):
-    """ Child has not been created yet """
\ No newline at end of file
+    """ Child has not been created yet """
+
+class TransactionConflict(RuntimeError):
+    """ Another writer changed a table modified by the transaction """
+
+class TransactionClosed(RuntimeError):
+    """ Transaction was already committed or rolled back """
+
+class ReadOnlyReplica(RuntimeError):
+    """ Replicas can not be modified """
@@ -0,0 +1,1329 @@
+""" secondary indexes of JsonDatabase tables
+
+an index maps keys computed from the entries of a table to the positions
+of those entries, indexes are built on first use and then kept up to date
+from the change records every JsonDatabase mutator logs
+
+entries modified in place without the JsonDatabase methods are not seen
+by the indexes, call JsonDatabase.reindex() after doing so
+"""
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from os.path import expanduser, isfile
+import logging
+import re
+
+from py3jsondb.utils import SEQUENCE_TYPES, fuzzy_match_thresh
+from py3jsondb.utils.atomic_write import atomic_write, DURABILITY_NONE
+from py3jsondb.utils.serializers import get_serializer
+
+LOG = logging.getLogger("JsonDatabase")
+
+_SCALARS = frozenset((str, int, float, bool, type(None)))
+
+
+class _Sentinel:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+# keys of entries without the indexed field and of values that can not be
+# hashed, json null is a valid value so None can not be used for those
+MISSING = _Sentinel("MISSING")
+UNHASHABLE = _Sentinel("UNHASHABLE")
+# key of the slots of deleted entries
+DELETED = _Sentinel("DELETED")
+
+
+def freeze(value):
+    """ hashable equivalent of a json value, equal values freeze equal
+
+    Args:
+        value: json compatible python object
+
+    Returns:
+        dicts as frozensets of items, lists as tuples, other values as is
+    """
+    cls = type(value)
+    if cls in _SCALARS:
+        return value
+    if cls is dict or isinstance(value, dict):
+        return frozenset([(k, freeze(v)) for k, v in value.items()])
+    if cls is list or isinstance(value, SEQUENCE_TYPES + (tuple,)):
+        return tuple([freeze(v) for v in value])
+    return value
+
+
+class Index:
+    """ maps keys of the entries of a table to their positions
+
+    entries are stored in slots, a deleted entry leaves a dead slot behind
+    instead of renumbering the following ones, positions are computed from
+    the slots when looked up and the dead slots are dropped in one pass
+    once they are a quarter of the index
+
+    subclasses define key_of, or keys_of when an entry has several keys
+    """
+    # True if keys_of returns several keys per entry
+    multi = False
+
+    def __init__(self):
+        self.table = None
+        # key (or tuple of keys if multi) of the entry at every slot,
+        # DELETED for dead slots
+        self._keys = []
+        # key -> slot, or sorted list of slots if several
+        self._buckets = {}
+        # sorted dead slots
+        self._dead = []
+
+    def key_of(self, entry):
+        raise NotImplementedError
+
+    def keys_of(self, entry):
+        return (self.key_of(entry),)
+
+    def _entry_keys(self, slot):
+        if self.multi:
+            return self._keys[slot]
+        return (self._keys[slot],)
+
+    @property
+    def size(self):
+        """ number of entries indexed """
+        return len(self._keys) - len(self._dead)
+
+    def _slot(self, pos):
+        """ slot of the entry at a position of the table """
+        dead = self._dead
+        if not dead or pos < dead[0]:
+            return pos
+        # the smallest slot with pos live slots before it
+        low, high = pos, pos + len(dead)
+        while low < high:
+            mid = (low + high) // 2
+            if mid - bisect_right(dead, mid) < pos:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def _positions(self, slots):
+        """ positions in the table of sorted live slots """
+        dead = self._dead
+        if not dead:
+            return list(slots)
+        return [slot - bisect_left(dead, slot) for slot in slots]
+
+    def _live_keys(self):
+        """ (position, key) of every entry """
+        if not self._dead:
+            return enumerate(self._keys)
+        return enumerate(key for key in self._keys if key is not DELETED)
+
+    # maintenance
+    def build(self, table):
+        """ index every entry of table """
+        self.table = table
+        self._keys = []
+        self._buckets = {}
+        self._dead = []
+        for entry in table:
+            self.append(entry)
+
+    def is_stale(self, table):
+        """ True if the index does not describe table anymore """
+        return self.table is not table or self.size != len(table)
+
+    def invalidate(self):
+        """ drop the index contents, it is rebuilt on next use """
+        self.table = None
+        self._keys = []
+        self._buckets = {}
+        self._dead = []
+
+    def rebind(self, old, new):
+        """ follow a copy of the indexed table holding the same entries """
+        if self.table is old:
+            self.table = new
+
+    def append(self, entry):
+        slot = len(self._keys)
+        keys = tuple(self.keys_of(entry))
+        self._keys.append(keys if self.multi else keys[0])
+        for key in keys:
+            self._bucket_add(key, slot)
+
+    def replace(self, pos, entry):
+        slot = self._slot(pos)
+        for key in self._entry_keys(slot):
+            self._bucket_remove(key, slot)
+        keys = tuple(self.keys_of(entry))
+        self._keys[slot] = keys if self.multi else keys[0]
+        for key in keys:
+            self._bucket_add(key, slot)
+
+    def delete(self, pos):
+        slot = self._slot(pos)
+        for key in self._entry_keys(slot):
+            self._bucket_remove(key, slot)
+        self._keys[slot] = DELETED
+        insort(self._dead, slot)
+        if len(self._dead) * 4 >= len(self._keys):
+            self._compact()
+
+    def _compact(self):
+        """ drop the dead slots, the slots become the positions again """
+        for key, bucket in self._buckets.items():
+            if isinstance(bucket, list):
+                self._buckets[key] = self._positions(bucket)
+            else:
+                self._buckets[key] = self._positions((bucket,))[0]
+        self._keys = [key for key in self._keys if key is not DELETED]
+        self._dead = []
+
+    def _bucket_add(self, key, pos):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._buckets[key] = pos
+        elif isinstance(bucket, list):
+            if bucket[-1] < pos:
+                bucket.append(pos)
+            else:
+                i = bisect_left(bucket, pos)
+                if i == len(bucket) or bucket[i] != pos:
+                    bucket.insert(i, pos)
+        elif bucket != pos:
+            self._buckets[key] = sorted((bucket, pos))
+
+    def _bucket_remove(self, key, pos):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return
+        if isinstance(bucket, list):
+            i = bisect_left(bucket, pos)
+            if i < len(bucket) and bucket[i] == pos:
+                del bucket[i]
+            if len(bucket) == 1:
+                self._buckets[key] = bucket[0]
+        elif bucket == pos:
+            del self._buckets[key]
+
+    # lookups
+    def positions(self, key):
+        """ sorted positions of the entries with key """
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return []
+        if isinstance(bucket, list):
+            return self._positions(bucket)
+        return self._positions((bucket,))
+
+    def positions_of(self, keys):
+        """ sorted positions of the entries with any of keys """
+        slots = set()
+        for key in keys:
+            bucket = self._buckets.get(key)
+            if isinstance(bucket, list):
+                slots.update(bucket)
+            elif bucket is not None:
+                slots.add(bucket)
+        return self._positions(sorted(slots))
+
+    # statistics, used by Query to estimate how many entries a filter keeps
+    def count(self, key):
+        """ number of entries with key """
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return 0
+        if isinstance(bucket, list):
+            return len(bucket)
+        return 1
+
+    def distinct(self):
+        """ number of distinct keys """
+        return len(self._buckets)
+
+
+class HashIndex(Index):
+    """ hash of every entry, finds exact duplicates without a table scan
+
+    entries that can not be hashed share the None key, candidates are
+    always compared with == so hash collisions are harmless
+    """
+
+    def __init__(self):
+        super().__init__()
+        # the last entry looked up and its key, add_entry appends the entry
+        # it just looked up so its key is not computed twice
+        self._last = None
+
+    def key_of(self, entry):
+        if self._last is not None and self._last[0] == entry:
+            return self._last[1]
+        try:
+            return hash(freeze(entry))
+        except TypeError:
+            return None
+
+    def find(self, entry):
+        """ sorted positions of the entries equal to entry """
+        key = self.key_of(entry)
+        self._last = (entry, key)
+        candidates = self.positions(key)
+        if key is not None and None in self._buckets:
+            candidates = sorted(set(candidates + self.positions(None)))
+        return [pos for pos in candidates if self.table[pos] == entry]
+
+
+class FieldIndex(Index):
+    """ values of one field of the entries
+
+    Arguments:
+        field (str): the indexed key, entries that are not dicts or do not
+                     have it are kept under the MISSING key
+    """
+    type = "hash"
+
+    def __init__(self, field):
+        super().__init__()
+        self.field = field
+
+    def key_of(self, entry):
+        if not isinstance(entry, dict) or self.field not in entry:
+            return MISSING
+        return self.value_key(entry[self.field])
+
+    @staticmethod
+    def value_key(value):
+        value = freeze(value)
+        try:
+            hash(value)
+        except TypeError:
+            return UNHASHABLE
+        return value
+
+    def find(self, value):
+        """ sorted positions of the entries whose field equals value """
+        key = self.value_key(value)
+        candidates = self.positions(key)
+        if key is not UNHASHABLE and UNHASHABLE in self._buckets:
+            candidates = sorted(set(candidates + self.positions(UNHASHABLE)))
+        field = self.field
+        return [pos for pos in candidates
+                if self.table[pos].get(field, MISSING) == value]
+
+    def count_value(self, value):
+        """ number of entries find(value) compares with value """
+        key = self.value_key(value)
+        n = self.count(key)
+        if key is not UNHASHABLE:
+            n += self.count(UNHASHABLE)
+        return n
+
+    def definition(self):
+        """ options persisted to recreate the index """
+        return {"type": self.type}
+
+
+def sort_family(value):
+    """ values of different families can not be compared with each other
+
+    Returns:
+        int: 0 for numbers, 1 for strings, None for values that are not
+             ordered by OrderedIndex (null, lists, dicts, NaN)
+    """
+    cls = type(value)
+    if cls is str:
+        return 1
+    if cls in (int, float, bool) and value == value:
+        return 0
+    return None
+
+
+class OrderedIndex(FieldIndex):
+    """ field index that also keeps the distinct numbers and strings of the
+    field sorted, range lookups bisect them instead of scanning the table
+
+    Arguments:
+        field (str): the indexed key
+    """
+    type = "ordered"
+
+    def __init__(self, field):
+        super().__init__(field)
+        # sorted distinct keys per sort_family, numbers and strings
+        self._sorted = ([], [])
+        self._building = False
+
+    def build(self, table):
+        self._sorted = ([], [])
+        self._building = True
+        try:
+            super().build(table)
+        finally:
+            self._building = False
+        # sort once instead of inserting every key in order
+        for family in range(2):
+            self._sorted[family].sort()
+
+    def invalidate(self):
+        super().invalidate()
+        self._sorted = ([], [])
+
+    def _bucket_add(self, key, pos):
+        new = key not in self._buckets
+        super()._bucket_add(key, pos)
+        family = sort_family(key) if new else None
+        if family is None:
+            return
+        if self._building:
+            self._sorted[family].append(key)
+        else:
+            insort(self._sorted[family], key)
+
+    def _bucket_remove(self, key, pos):
+        super()._bucket_remove(key, pos)
+        family = sort_family(key)
+        if family is not None and key not in self._buckets:
+            keys = self._sorted[family]
+            i = bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+
+    def supports(self, value):
+        """ True if range lookups can compare the field with value """
+        return sort_family(value) is not None
+
+    def is_mixed(self, family):
+        """ True if the field holds truthy values outside of family, a scan
+        comparing them with a value of family fails or may match them """
+        others = len(self._buckets) - len(self._sorted[family])
+        # falsy values are skipped by the query filters
+        for key in (MISSING, None, "" if family == 0 else 0):
+            if key in self._buckets:
+                others -= 1
+        return others > 0
+
+    def range_keys(self, low=None, high=None, include_low=False,
+                   include_high=False):
+        """ sorted distinct values of the field between low and high
+
+        Args:
+            low: lower bound, None for no bound
+            high: upper bound, None for no bound, low and high must be
+                  of the same family, see sort_family
+            include_low (bool): include values equal to low
+            include_high (bool): include values equal to high
+
+        Returns:
+            list: the values
+        """
+        bound = low if low is not None else high
+        family = sort_family(bound)
+        if family is None:
+            raise ValueError("can not range over {}".format(repr(bound)))
+        keys = self._sorted[family]
+        start, end = 0, len(keys)
+        if low is not None:
+            start = (bisect_left if include_low else bisect_right)(keys, low)
+        if high is not None:
+            end = (bisect_right if include_high else bisect_left)(keys, high)
+        return keys[start:end]
+
+    def range(self, low=None, high=None, include_low=False,
+              include_high=False):
+        """ positions of the entries whose field is between low and high,
+        in table order, see range_keys """
+        return self.positions_of(self.range_keys(low, high, include_low,
+                                                 include_high))
+
+    def first_key(self, reverse=False):
+        """ smallest value of the field, numbers before strings, or the
+        largest if reverse, None if no value can be ordered """
+        families = (1, 0) if reverse else (0, 1)
+        for family in families:
+            keys = self._sorted[family]
+            if keys:
+                return keys[-1] if reverse else keys[0]
+        return None
+
+    def sorted_positions(self, reverse=False):
+        """ positions of all entries ordered by the field, numbers before
+        strings, entries with equal values in table order, entries whose
+        value can not be ordered come last in table order """
+        positions = []
+        families = (1, 0) if reverse else (0, 1)
+        for family in families:
+            keys = self._sorted[family]
+            for key in (reversed(keys) if reverse else keys):
+                positions += self.positions(key)
+        positions += [pos for pos, key in self._live_keys()
+                      if sort_family(key) is None]
+        return positions
+
+
+class FuzzyStrings:
+    """ distinct strings grouped by length and by the characters they
+    contain, candidates() only returns the strings that may score a
+    threshold against a value without scoring the others
+
+    the shared character counts are the quick_ratio bound of
+    SequenceMatcher, see fuzzy_match_thresh, longer n-grams do not bound
+    its score and would drop real matches
+
+    Arguments:
+        strings (iterable): initial strings
+    """
+
+    def __init__(self, strings=()):
+        # length -> distinct strings of that length
+        self.lengths = {}
+        # character -> {string: occurrences of the character in it}
+        self.chars = {}
+        for string in strings:
+            self.add(string)
+
+    def __iter__(self):
+        for strings in self.lengths.values():
+            yield from strings
+
+    def add(self, string):
+        strings = self.lengths.setdefault(len(string), set())
+        if string in strings:
+            return
+        strings.add(string)
+        for char, n in Counter(string).items():
+            self.chars.setdefault(char, {})[string] = n
+
+    def discard(self, string):
+        strings = self.lengths.get(len(string))
+        if strings is None or string not in strings:
+            return
+        strings.discard(string)
+        if not strings:
+            del self.lengths[len(string)]
+        for char in set(string):
+            postings = self.chars[char]
+            del postings[string]
+            if not postings:
+                del self.chars[char]
+
+    def window(self, size, thresh):
+        """ strings whose length allows thresh against a string of size
+        characters, the real_quick_ratio bound """
+        if thresh <= 0:
+            return list(self)
+        # ratio <= 2 * min(a, b) / (a + b), rounded to err on the side
+        # of returning too many strings
+        low = int(size * thresh / (2 - thresh))
+        high = int(size * (2 - thresh) / thresh) + 1
+        return [string for n, strings in self.lengths.items()
+                if low <= n <= high for string in strings]
+
+    def candidates(self, value, thresh):
+        """ strings that may score thresh or more against value, the
+        others score less, see fuzzy_match_thresh
+
+        Args:
+            value (str): the searched string
+            thresh (float): minimum score
+
+        Returns:
+            list: the strings
+        """
+        if thresh <= 0 or type(value) is not str:
+            return list(self)
+        size = len(value)
+        if not size:
+            return list(self.lengths.get(0, ()))
+        shared = Counter()
+        for char, n in Counter(value).items():
+            for string, m in self.chars.get(char, {}).items():
+                shared[string] += n if n < m else m
+        return [string for string, m in shared.items()
+                if 2.0 * m / (size + len(string)) >= thresh]
+
+
+class FuzzyIndex(FieldIndex):
+    """ field index that also keeps the distinct strings of the field in
+    a FuzzyStrings, fuzzy lookups only score the strings whose length and
+    characters allow the threshold to be reached
+
+    Arguments:
+        field (str): the indexed key
+    """
+    type = "fuzzy"
+
+    def __init__(self, field):
+        super().__init__(field)
+        self._strings = FuzzyStrings()
+
+    def build(self, table):
+        self._strings = FuzzyStrings()
+        super().build(table)
+
+    def invalidate(self):
+        super().invalidate()
+        self._strings = FuzzyStrings()
+
+    def _bucket_add(self, key, pos):
+        new = key not in self._buckets
+        super()._bucket_add(key, pos)
+        if new and type(key) is str:
+            self._strings.add(key)
+
+    def _bucket_remove(self, key, pos):
+        super()._bucket_remove(key, pos)
+        if type(key) is str and key not in self._buckets:
+            self._strings.discard(key)
+
+    def search(self, value, thresh, ignore_case=False):
+        """ score the strings of the field that may reach thresh
+
+        Args:
+            value (str): the searched string, it is the first argument of
+                         fuzzy_match
+            thresh (float): minimum score
+            ignore_case (bool): compare lower cased strings
+
+        Returns:
+            list: (position, score) of the entries scoring thresh or more
+        """
+        if ignore_case:
+            # lower casing changes the characters, every string is scored
+            value = value.lower()
+            strings = self._strings
+        else:
+            strings = self._strings.candidates(value, thresh)
+        found = []
+        for key in strings:
+            score = fuzzy_match_thresh(value, key.lower() if ignore_case
+                                       else key, thresh)
+            if score >= thresh:
+                found += [(pos, score) for pos in self.positions(key)]
+        return found
+
+    def count_candidates(self, value, thresh, ignore_case=False):
+        """ number of entries search() may score and non_strings() returns,
+        an upper bound of the entries a fuzzy filter keeps """
+        count = self.count
+        strings = 0
+        window = 0
+        if ignore_case:
+            candidates = ()
+        else:
+            # the length bound is cheaper than the candidates
+            candidates = self._strings.window(len(value), thresh)
+        for key in candidates:
+            window += count(key)
+        for key in self._strings:
+            strings += count(key)
+        if ignore_case:
+            window = strings
+        return window + self.size - strings - count(MISSING)
+
+    def non_strings(self):
+        """ positions of the entries whose field is present but not a string """
+        return [pos for pos, key in self._live_keys()
+                if key is not MISSING and type(key) is not str]
+
+
+_WORD = re.compile(r"\w+")
+
+# tokenizer name -> function splitting a string in tokens
+TOKENIZERS = {
+    "whitespace": str.split,
+    "words": _WORD.findall
+}
+
+
+class TokenIndex(Index):
+    """ inverted index from the tokens of a field to the entries
+
+    strings are split in tokens, the elements of lists and the keys of
+    dicts are converted to strings and split too, lookups return the
+    entries that may match, callers compare them with their own predicate
+
+    Arguments:
+        field (str): the indexed key
+        tokenizer (str): whitespace (str.split) or words (runs of letters
+                         and digits), see TOKENIZERS
+        ignore_case (bool): index lower cased tokens, lookups of any case
+                            can use the index
+    """
+    type = "token"
+    multi = True
+
+    def __init__(self, field, tokenizer="whitespace", ignore_case=True):
+        super().__init__()
+        if tokenizer not in TOKENIZERS:
+            raise ValueError("unknown tokenizer {}, must be one of {}".format(
+                tokenizer, ", ".join(TOKENIZERS)))
+        self.field = field
+        self.tokenizer = tokenizer
+        self.ignore_case = ignore_case
+        self._tokenize = TOKENIZERS[tokenizer]
+
+    def tokens(self, text):
+        if self.ignore_case:
+            text = text.lower()
+        return self._tokenize(text)
+
+    def keys_of(self, entry):
+        if not isinstance(entry, dict) or self.field not in entry:
+            return ()
+        value = entry[self.field]
+        if isinstance(value, str):
+            return tuple(set(self.tokens(value)))
+        if isinstance(value, (dict,) + SEQUENCE_TYPES):
+            tokens = set()
+            for item in value:
+                tokens.update(self.tokens(str(item)))
+            return tuple(tokens)
+        return ()
+
+    def can_lookup(self, ignore_case):
+        """ True if the index answers a lookup with that case handling """
+        return self.ignore_case or not ignore_case
+
+    def find_tokens(self, text):
+        """ positions of the entries having every token of text, None if
+        text has no tokens and the index can not narrow the search """
+        tokens = set(self.tokens(text))
+        if not tokens:
+            return None
+        postings = sorted((self.positions(token) for token in tokens),
+                          key=len)
+        positions = set(postings[0])
+        for posting in postings[1:]:
+            positions.intersection_update(posting)
+        return sorted(positions)
+
+    def find_substring(self, text):
+        """ positions of the entries that may contain text, each token of
+        text is part of a token of the entry, None if text has no tokens
+
+        only the distinct tokens are searched, not the entries
+        """
+        keys = self.substring_keys(text)
+        if keys is None:
+            return None
+        return self.positions_of(keys)
+
+    def substring_keys(self, text):
+        """ distinct tokens containing the longest token of text, None if
+        text has no tokens """
+        tokens = self.tokens(text)
+        if not tokens:
+            return None
+        token = max(tokens, key=len)
+        return [key for key in self._buckets if token in key]
+
+    def count_tokens(self, text):
+        """ upper bound of the entries find_tokens(text) returns, None if
+        text has no tokens """
+        tokens = set(self.tokens(text))
+        if not tokens:
+            return None
+        return min(self.count(token) for token in tokens)
+
+    def definition(self):
+        return {"type": self.type, "tokenizer": self.tokenizer,
+                "ignore_case": self.ignore_case}
+
+
+class PrimaryKeyIndex:
+    """ slots of the entries of a table by the value of their primary key
+
+    removed entries are only marked dead, their slots stay in the table as
+    tombstones until compact() drops all of them in a single pass, so
+    removing an entry does not renumber the following ones
+
+    Arguments:
+        field (str): the key holding the id of the entries, entries without
+                     a hashable value for it can not be looked up
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self.table = None
+        # id -> slot of the live entries
+        self.slots = {}
+        # slots of the removed entries
+        self.dead = set()
+        # next automatic id, above every integer id of the table
+        self.next_id = 0
+        # id of the entry at every slot, None if it has none
+        self._ids = []
+
+    def build(self, table):
+        # next_id is a high-water mark, the ids of removed entries are
+        # never handed out again
+        self.table = table
+        self.slots = {}
+        self.dead = set()
+        self._ids = []
+        for entry in table:
+            self.append(entry)
+
+    def is_stale(self, table):
+        return self.table is not table or len(self._ids) != len(table)
+
+    def invalidate(self):
+        """ forget the table, tombstones are lost, compact it first """
+        self.table = None
+        self.slots = {}
+        self.dead = set()
+        self._ids = []
+
+    def rebind(self, old, new):
+        """ follow a copy of the table holding the same entries """
+        if self.table is old:
+            self.table = new
+
+    def id_of(self, entry):
+        if not isinstance(entry, dict):
+            return None
+        entry_id = entry.get(self.field)
+        try:
+            hash(entry_id)
+        except TypeError:
+            return None
+        return entry_id
+
+    def _index(self, slot, entry_id):
+        self._ids[slot] = entry_id
+        if entry_id is None:
+            return
+        if self.slots.setdefault(entry_id, slot) != slot:
+            LOG.warning("Duplicate primary key {}, only the first entry can "
+                        "be looked up".format(repr(entry_id)))
+        if type(entry_id) is int and entry_id >= self.next_id:
+            self.next_id = entry_id + 1
+
+    def _unindex(self, slot):
+        entry_id = self._ids[slot]
+        if entry_id is not None and self.slots.get(entry_id) == slot:
+            del self.slots[entry_id]
+        self._ids[slot] = None
+
+    def append(self, entry):
+        self._ids.append(None)
+        self._index(len(self._ids) - 1, self.id_of(entry))
+
+    def replace(self, slot, entry):
+        if slot in self.dead:
+            return
+        self._unindex(slot)
+        self._index(slot, self.id_of(entry))
+
+    def id_at(self, slot):
+        """ id of the entry at slot, None if it has none """
+        return self._ids[slot]
+
+    def slot(self, entry_id):
+        """ slot of the live entry with entry_id, None if there is none """
+        try:
+            return self.slots.get(entry_id)
+        except TypeError:
+            return None
+
+    def kill(self, slot):
+        """ mark the entry at slot as removed """
+        self._unindex(slot)
+        self.dead.add(slot)
+
+    def compact(self):
+        """ drop the tombstones, call it after deleting the dead slots
+        from the table
+
+        Returns:
+            list: the dropped slots, in decreasing order
+        """
+        dead = sorted(self.dead, reverse=True)
+        if not dead:
+            return dead
+        self._ids = [entry_id for slot, entry_id in enumerate(self._ids)
+                     if slot not in self.dead]
+        self.dead = set()
+        self.slots = {}
+        for slot, entry_id in enumerate(self._ids):
+            if entry_id is not None:
+                self.slots.setdefault(entry_id, slot)
+        return dead
+
+    def apply_change(self, op, path, table):
+        """ update the index after a change record of the table, see
+        TableIndexes.apply_change """
+        if self.table is None:
+            return
+        if self.table is not table:
+            self.invalidate()
+        elif len(path) == 1:
+            if op == "append" and len(self._ids) + 1 == len(table):
+                self.append(table[-1])
+            else:
+                self.invalidate()
+        elif not isinstance(path[1], int):
+            self.invalidate()
+        elif len(path) == 2 and op == "delete":
+            # the slot was removed without a tombstone, later slots moved
+            pos = path[1] if path[1] >= 0 else path[1] + len(self._ids)
+            self._unindex(pos)
+            del self._ids[pos]
+            self.dead = set(s - 1 if s > pos else s for s in self.dead
+                            if s != pos)
+            self.slots = {}
+            for slot, entry_id in enumerate(self._ids):
+                if entry_id is not None and slot not in self.dead:
+                    self.slots.setdefault(entry_id, slot)
+        elif len(path) == 2 or path[2] == self.field:
+            pos = path[1] if path[1] >= 0 else path[1] + len(table)
+            self.replace(pos, table[pos])
+
+
+class _PathNode:
+    """ a dict or list of the indexed tree
+
+    children maps the keys of the container to (seq, node, path, value):
+    the order of the key in the container, the _PathNode of a nested
+    container or None, the path tuple and the value of a leaf or MISSING
+    """
+    __slots__ = ("children", "next_seq", "source")
+
+    def __init__(self, source=None):
+        self.children = {}
+        self.next_seq = 0
+        # the indexed container, only kept for the tables
+        self.source = source
+
+
+class PathIndex:
+    """ paths of every key and hashable leaf value of a database
+
+    lookups return the paths JsonPath finds, in the same depth first order,
+    without walking the tree, the index is updated incrementally from the
+    change records of JsonDatabase
+    """
+
+    def __init__(self):
+        self._root = None
+        # key -> set of paths ending with it
+        self._keys = {}
+        # hashable leaf value -> set of paths of the leaves
+        self._values = {}
+        # FuzzyStrings of the string keys and values, built on the first
+        # fuzzy lookup
+        self._fuzzy_keys = None
+        self._fuzzy_values = None
+
+    # maintenance
+    def build(self, db):
+        """ index every table of db, a dict of tables """
+        self.invalidate()
+        self._root = _PathNode()
+        for name, table in db.items():
+            self._add(self._root, name, table, ())
+
+    def invalidate(self):
+        """ drop the index contents, it is rebuilt on next use """
+        self._root = None
+        self._keys = {}
+        self._values = {}
+        self._fuzzy_keys = None
+        self._fuzzy_values = None
+
+    def rebind(self, name, old, new):
+        """ follow a copy of the table name holding the same entries """
+        if self._root is None:
+            return
+        child = self._root.children.get(name)
+        if child is not None and child[1] is not None and \
+                child[1].source is old:
+            child[1].source = new
+
+    def is_stale(self, db):
+        """ True if the tables of db are not the indexed ones """
+        if self._root is None:
+            return True
+        children = self._root.children
+        if len(children) != len(db):
+            return True
+        for name, table in db.items():
+            child = children.get(name)
+            if child is None:
+                return True
+            if child[1] is None:
+                if isinstance(table, (dict,) + SEQUENCE_TYPES):
+                    return True
+            elif child[1].source is not table or \
+                    len(child[1].children) != len(table):
+                return True
+        return False
+
+    def _add(self, node, key, value, parent, seq=None):
+        # items of lists are ordered by their index, keys of dicts by when
+        # they were added, seq is None for new keys of dicts
+        if seq is None:
+            seq = node.next_seq
+            node.next_seq += 1
+        path = parent + (key,)
+        if key not in self._keys:
+            self._keys[key] = set()
+            if self._fuzzy_keys is not None and type(key) is str:
+                self._fuzzy_keys.add(key)
+        self._keys[key].add(path)
+        if isinstance(value, (dict,) + SEQUENCE_TYPES):
+            child = _PathNode(value if node is self._root else None)
+            if isinstance(value, dict):
+                for k, v in value.items():
+                    self._add(child, k, v, path)
+            else:
+                for k, v in enumerate(value):
+                    self._add(child, k, v, path, k)
+            node.children[key] = (seq, child, path, MISSING)
+            return
+        try:
+            if value not in self._values:
+                self._values[value] = set()
+                if self._fuzzy_values is not None and type(value) is str:
+                    self._fuzzy_values.add(value)
+            self._values[value].add(path)
+        except TypeError:
+            value = MISSING
+        node.children[key] = (seq, None, path, value)
+
+    def _remove(self, node, key):
+        seq, child, path, value = node.children.pop(key)
+        paths = self._keys.get(key)
+        if paths is not None:
+            paths.discard(path)
+            if not paths:
+                del self._keys[key]
+                if self._fuzzy_keys is not None and type(key) is str:
+                    self._fuzzy_keys.discard(key)
+        if child is not None:
+            for k in list(child.children):
+                self._remove(child, k)
+        elif value is not MISSING:
+            paths = self._values.get(value)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del self._values[value]
+                    if self._fuzzy_values is not None and \
+                            type(value) is str:
+                        self._fuzzy_values.discard(value)
+        return seq
+
+    def apply_change(self, op, path, db):
+        """ update the index after a change record
+
+        Args:
+            op (str): one of 'append', 'set', 'update' or 'delete'
+            path (list): path of the modified node, path[0] is the table
+            db (dict): the tables, already modified
+        """
+        if self._root is None:
+            return
+        try:
+            self._apply_change(op, list(path), db)
+        except (KeyError, IndexError, TypeError):
+            self.invalidate()
+
+    def _apply_change(self, op, path, db):
+        node, container = self._root, db
+        prefix = ()
+        for key in path[:-1]:
+            node = node.children[key][1]
+            container = container[key]
+            prefix += (key,)
+        key = path[-1]
+        if op == "append":
+            node = node.children[key][1]
+            container = container[key]
+            pos = len(container) - 1
+            if pos != len(node.children):
+                raise KeyError(key)
+            self._add(node, pos, container[pos], prefix + (key,), pos)
+        elif op in ("set", "update"):
+            if key in node.children:
+                seq = self._remove(node, key)
+            elif node is not self._root and \
+                    isinstance(container, SEQUENCE_TYPES):
+                seq = key
+            else:
+                seq = None
+            self._add(node, key, container[key], prefix, seq)
+        elif op == "delete":
+            if node is not self._root and \
+                    isinstance(container, SEQUENCE_TYPES):
+                # later items moved one position down
+                size = len(container) + 1
+                if key < 0:
+                    key += size
+                for pos in range(key, size):
+                    self._remove(node, pos)
+                for pos in range(key, len(container)):
+                    self._add(node, pos, container[pos], prefix, pos)
+            else:
+                self._remove(node, key)
+        else:
+            raise KeyError(op)
+
+    # lookups
+    def _order(self, path):
+        seqs = []
+        node = self._root
+        for key in path:
+            seq, node, _, _ = node.children[key]
+            seqs.append(seq)
+        return seqs
+
+    def _sorted(self, paths):
+        return [list(p) for p in sorted(paths, key=self._order)]
+
+    def fuzzy_keys(self, key, thresh):
+        """ string keys that may score thresh against key, see
+        FuzzyStrings.candidates """
+        if self._fuzzy_keys is None:
+            self._fuzzy_keys = FuzzyStrings(k for k in self._keys
+                                            if type(k) is str)
+        return self._fuzzy_keys.candidates(key, thresh)
+
+    def fuzzy_values(self, value, thresh):
+        """ string leaf values that may score thresh against value, see
+        FuzzyStrings.candidates """
+        if self._fuzzy_values is None:
+            self._fuzzy_values = FuzzyStrings(v for v in self._values
+                                              if type(v) is str)
+        return self._fuzzy_values.candidates(value, thresh)
+
+    def find_key(self, key, fuzzy=False, thresh=0.7):
+        """ paths ending with key, see JsonPath mode key """
+        if fuzzy:
+            paths = set()
+            for k in self.fuzzy_keys(key, thresh):
+                if fuzzy_match_thresh(k, key, thresh) >= thresh:
+                    paths.update(self._keys[k])
+            return self._sorted(paths)
+        try:
+            return self._sorted(self._keys.get(key, ()))
+        except TypeError:
+            return []
+
+    def find_value(self, value, fuzzy=False, thresh=0.7):
+        """ paths of the leaves equal to value, see JsonPath mode value
+
+        Returns:
+            list: the paths, None if value is a container, only leaves
+                  are indexed
+        """
+        if fuzzy:
+            paths = set()
+            for v in self.fuzzy_values(value, thresh):
+                if fuzzy_match_thresh(v, value, thresh) >= thresh:
+                    paths.update(self._values[v])
+            return self._sorted(paths)
+        if isinstance(value, (dict,) + SEQUENCE_TYPES):
+            return None
+        if value != value:
+            return []
+        try:
+            return self._sorted(self._values.get(value, ()))
+        except TypeError:
+            return None
+
+    def find_key_value(self, key, value, fuzzy=False, thresh=0.7):
+        """ paths ending with key whose value equals value, see JsonPath
+        mode key_value """
+        try:
+            candidates = self._keys.get(key, ())
+        except TypeError:
+            return []
+        paths = []
+        for path in candidates:
+            node = self._root
+            for k in path[:-1]:
+                node = node.children[k][1]
+            child = node.children[path[-1]]
+            if fuzzy:
+                if isinstance(child[3], str) and \
+                        fuzzy_match_thresh(child[3], value, thresh) >= thresh:
+                    paths.append(path)
+            elif child[1] is None and child[3] is not MISSING:
+                if child[3] == value:
+                    paths.append(path)
+            elif self._value_at(path) == value:
+                paths.append(path)
+        return self._sorted(paths)
+
+    def _value_at(self, path):
+        # tables keep their source, nested containers are read from it
+        table = self._root.children[path[0]][1].source
+        if len(path) == 1:
+            return table
+        value = table
+        for key in path[1:]:
+            value = value[key]
+        return value
+
+
+# index type -> class, used to recreate persisted indexes
+INDEX_TYPES = {
+    FieldIndex.type: FieldIndex,
+    OrderedIndex.type: OrderedIndex,
+    TokenIndex.type: TokenIndex,
+    FuzzyIndex.type: FuzzyIndex
+}
+
+
+def index_from_definition(field, definition):
+    """ create an empty index from a persisted definition
+
+    Args:
+        field (str): the indexed key
+        definition (dict): returned by Index.definition()
+
+    Returns:
+        Index: the index, it is built by TableIndexes.get
+    """
+    options = dict(definition)
+    index_type = options.pop("type", FieldIndex.type)
+    if index_type not in INDEX_TYPES:
+        raise ValueError("unknown index type {}, must be one of {}".format(
+            index_type, ", ".join(INDEX_TYPES)))
+    return INDEX_TYPES[index_type](field, **options)
+
+
+def index_definitions_path(path):
+    """ file listing the field indexes of the database stored at path """
+    return expanduser(path) + ".indexes"
+
+
+def load_index_definitions(path, serializer=None):
+    """ read the persisted index definitions of a database
+
+    Args:
+        path (str): the database file
+        serializer (str): json backend, see get_serializer
+
+    Returns:
+        dict: table name -> {field: definition}
+    """
+    return load_index_file(path, serializer)[0]
+
+
+def load_index_file(path, serializer=None):
+    """ read the index definitions and the primary key high-water marks
+    persisted next to a database
+
+    Args:
+        path (str): the database file
+        serializer (str): json backend, see get_serializer
+
+    Returns:
+        tuple: table name -> {field: definition}, table name -> next
+               automatic id
+    """
+    path = index_definitions_path(path)
+    if not isfile(path):
+        return {}, {}
+    with open(path, "rb") as f:
+        data = get_serializer(serializer).load(f)
+    return data.get("tables", {}), data.get("next_ids", {})
+
+
+def save_index_definitions(path, definitions, serializer=None,
+                           durability=DURABILITY_NONE, next_ids=None):
+    """ persist the index definitions of a database next to its file
+
+    Args:
+        path (str): the database file
+        definitions (dict): table name -> {field: definition}
+        serializer (str): json backend, see get_serializer
+        durability (str): one of 'none', 'flush' or 'fsync'
+        next_ids (dict): table name -> next automatic id of the primary key,
+                         ids below it were handed out and are never reused
+    """
+    data = {"format": "py3jsondb/indexes", "tables": definitions}
+    if next_ids:
+        data["next_ids"] = next_ids
+    with atomic_write(index_definitions_path(path), durability, "wb") as f:
+        get_serializer(serializer).dump(data, f)
+
+
+class TableIndexes:
+    """ the indexes of one table, kept up to date from change records """
+
+    def __init__(self):
+        self.indexes = {}
+
+    def get(self, name, table, factory):
+        """ get an index, built or rebuilt if it is missing or stale
+
+        Args:
+            name (str): unique name of the index in the table
+            table (list): the table
+            factory (callable): creates the index if it does not exist
+
+        Returns:
+            Index: the up to date index
+        """
+        index = self.indexes.get(name)
+        if index is None:
+            index = self.indexes[name] = factory()
+        if index.is_stale(table):
+            index.build(table)
+        return index
+
+    def apply_change(self, op, path, table):
+        """ update the indexes after a change record of the table
+
+        Args:
+            op (str): one of 'append', 'set', 'update' or 'delete'
+            path (list): path of the modified node, path[0] is the table
+            table (list): the table, already modified
+        """
+        for index in self.indexes.values():
+            if index.table is None:
+                continue
+            if index.table is not table:
+                index.invalidate()
+            elif len(path) == 1:
+                if op == "append" and index.size + 1 == len(table):
+                    index.append(table[-1])
+                else:
+                    index.invalidate()
+            elif not isinstance(path[1], int):
+                index.invalidate()
+            elif len(path) == 2 and op == "delete":
+                pos = path[1]
+                if pos < 0:
+                    pos += index.size
+                if index.size == len(table) + 1:
+                    index.delete(pos)
+                else:
+                    index.invalidate()
+            else:
+                # the entry or something nested in it changed
+                pos = path[1]
+                if pos < 0:
+                    pos += len(table)
+                if index.size == len(table):
+                    index.replace(pos, table[pos])
+                else:
+                    index.invalidate()
+
+    def invalidate(self):
+        for index in self.indexes.values():
+            index.invalidate()
+
+    def rebind(self, old, new):
+        """ follow a copy of the table holding the same entries """
+        for index in self.indexes.values():
+            index.rebind(old, new)
@@ -0,0 +1,353 @@
+from array import array
+from collections import OrderedDict
+from collections.abc import MutableSequence
+from os.path import isfile, getsize
+from os import fstat, stat, remove
+import mmap
+import struct
+
+from py3jsondb.utils.serializers import get_serializer
+from py3jsondb.utils.atomic_write import atomic_write, sync_file, \
+    DURABILITY_NONE
+
+
+class JsonlTable(MutableSequence):
+    """
+    list of entries stored as a JSON Lines file, one entry per line
+
+    the file is memory mapped and an offset index (kept next to the file,
+    <path>.idx) maps every entry to its byte range, entries are only decoded
+    when accessed so opening a table costs the same for any table size and
+    memory grows with the entries actually used
+
+    new entries are kept in memory and appended to the end of the file on
+    flush(), any other change rewrites the file
+
+    :param path: the .jsonl file
+    :type path: str
+    :param serializer: json backend, see get_serializer
+    :type serializer: str
+    :param cache_size: number of decoded entries kept in memory
+    :type cache_size: int
+    """
+    INDEX_HEADER = struct.Struct("<QQQ")
+
+    def __init__(self, path, serializer=None, cache_size=4096):
+        self.path = path
+        self.serializer = get_serializer(serializer)
+        self.cache_size = cache_size
+        self._file = None
+        self._mm = None
+        self._offsets = array("Q", [0])
+        # entries are referred to by codes, a code >= 0 is a line of the
+        # file and a negative code an entry kept in memory in self._mem
+        # positions in the file are their own code until the first change
+        # that is not an append materializes self._order
+        self._order = None
+        self._tail = []
+        self._mem = {}
+        self._next_mem = -1
+        self._cache = OrderedDict()
+        self._rewrite = False
+        self._open()
+
+    # file access
+    @property
+    def index_path(self):
+        return self.path + ".idx"
+
+    @property
+    def _n_file(self):
+        return len(self._offsets) - 1
+
+    def _open(self):
+        self.close()
+        self._offsets = array("Q", [0])
+        if not isfile(self.path) or getsize(self.path) == 0:
+            return
+        self._file = open(self.path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if not self._load_index():
+            self._build_index()
+
+    def close(self):
+        """ unmap the file, pending changes are kept in memory """
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _file_id(self):
+        st = stat(self.path)
+        return st.st_size, st.st_mtime_ns, st.st_ino
+
+    def _load_index(self):
+        if not isfile(self.index_path):
+            return False
+        with open(self.index_path, "rb") as f:
+            header = f.read(self.INDEX_HEADER.size)
+            if len(header) != self.INDEX_HEADER.size or \
+                    self.INDEX_HEADER.unpack(header) != self._file_id():
+                return False
+            offsets = array("Q")
+            offsets.frombytes(f.read())
+        self._offsets = offsets
+        return True
+
+    def _build_index(self):
+        mm = self._mm
+        offsets = array("Q", [0])
+        pos = mm.find(b"\n")
+        while pos != -1:
+            offsets.append(pos + 1)
+            pos = mm.find(b"\n", pos + 1)
+        # a last line without a newline is a torn append, it is ignored and
+        # cut off by the next flush
+        self._offsets = offsets
+        self._save_index()
+
+    def _save_index(self):
+        with atomic_write(self.index_path, DURABILITY_NONE, "wb") as f:
+            f.write(self.INDEX_HEADER.pack(*self._file_id()))
+            self._offsets.tofile(f)
+
+    def _read_line(self, line):
+        return self._mm[self._offsets[line]:self._offsets[line + 1]]
+
+    # entries
+    def _code(self, idx):
+        if self._order is not None:
+            return self._order[idx]
+        if idx < self._n_file:
+            return idx
+        return self._tail[idx - self._n_file]
+
+    def _index(self, idx):
+        size = len(self)
+        if idx < 0:
+            idx += size
+        if not 0 <= idx < size:
+            raise IndexError("table index out of range")
+        return idx
+
+    def _store_mem(self, value):
+        code = self._next_mem
+        self._next_mem -= 1
+        self._mem[code] = value
+        return code
+
+    def _decode(self, code):
+        if code < 0:
+            return self._mem[code]
+        if code in self._cache:
+            self._cache.move_to_end(code)
+            return self._cache[code]
+        value = self.serializer.loads(self._read_line(code))
+        self._cache[code] = value
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return value
+
+    def _materialize(self):
+        if self._order is None:
+            self._order = array("q", range(self._n_file))
+            self._order.extend(self._tail)
+            self._tail = []
+
+    def touch(self, idx):
+        """ mark an entry as modified in place, it is kept in memory and
+        written by the next flush() """
+        idx = self._index(idx)
+        code = self._code(idx)
+        if code >= 0:
+            value = self._decode(code)
+            self._materialize()
+            self._order[idx] = self._store_mem(value)
+            self._cache.pop(code, None)
+            self._rewrite = True
+
+    def __len__(self):
+        if self._order is not None:
+            return len(self._order)
+        return self._n_file + len(self._tail)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        return self._decode(self._code(self._index(idx)))
+
+    def __setitem__(self, idx, value):
+        if isinstance(idx, slice):
+            raise TypeError("JsonlTable does not support slice assignment")
+        idx = self._index(idx)
+        self._materialize()
+        old = self._order[idx]
+        self._order[idx] = self._store_mem(value)
+        self._mem.pop(old, None)
+        self._rewrite = True
+
+    def __delitem__(self, idx):
+        if isinstance(idx, slice):
+            for i in sorted(range(*idx.indices(len(self))), reverse=True):
+                del self[i]
+            return
+        idx = self._index(idx)
+        if self._order is None and idx >= self._n_file:
+            code = self._tail.pop(idx - self._n_file)
+        else:
+            self._materialize()
+            code = self._order.pop(idx)
+            self._rewrite = True
+        self._mem.pop(code, None)
+
+    def insert(self, idx, value):
+        if self._order is None and idx >= len(self):
+            self._tail.append(self._store_mem(value))
+            return
+        self._materialize()
+        self._order.insert(idx, self._store_mem(value))
+        self._rewrite = True
+
+    def append(self, value):
+        self.insert(len(self), value)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self._decode(self._code(idx))
+
+    def __repr__(self):
+        return "JsonlTable({}, {} entries)".format(self.path, len(self))
+
+    # persistence
+    @property
+    def is_dirty(self):
+        return self._rewrite or bool(self._tail)
+
+    def changed_in_place(self):
+        """ True if a decoded entry no longer matches its line, it was
+        modified in place """
+        return any(self._encode(value) != self._read_line(code)
+                   for code, value in self._cache.items())
+
+    def flush(self, durability=DURABILITY_NONE, full=False):
+        """
+            write pending changes to the file, new entries are appended and
+            any other change rewrites the file
+
+            Args:
+                durability (str): one of 'none', 'flush' or 'fsync'
+                full (bool): also write entries that were decoded and
+                             possibly modified in place
+        """
+        if full:
+            self._materialize()
+            for idx, code in enumerate(self._order):
+                if code in self._cache:
+                    self._order[idx] = self._store_mem(self._cache[code])
+            self._rewrite = True
+        if self._rewrite:
+            self._write_all(durability)
+        elif self._tail:
+            self._append_tail(durability)
+
+    def _encode(self, value):
+        return self.serializer.dumps(value, pretty=False) + b"\n"
+
+    def _append_tail(self, durability):
+        if self._n_file and not isfile(self.path):
+            # removed by another writer, write the entries known here
+            self._write_all(durability)
+            return
+        # called under the write lock of the table, other processes may
+        # have appended to the file or replaced it since it was mapped
+        with open(self.path, "a+b") as f:
+            st = fstat(f.fileno())
+            if self._file is None:
+                replaced = st.st_size > 0
+            else:
+                replaced = st.st_ino != fstat(self._file.fileno()).st_ino \
+                    or st.st_size < self._offsets[-1]
+            if replaced:
+                self._open()
+                self._cache.clear()
+            # lines appended by other writers
+            pos = self._offsets[-1]
+            f.seek(pos)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                pos += len(line)
+                self._offsets.append(pos)
+            # drop a torn last line before appending
+            f.seek(pos)
+            f.truncate()
+            for code in self._tail:
+                data = self._encode(self._mem.pop(code))
+                f.write(data)
+                pos += len(data)
+                self._offsets.append(pos)
+            sync_file(f, durability)
+        self._tail = []
+        self._open_after_write(self._offsets)
+
+    def _write_all(self, durability):
+        offsets = array("Q", [0])
+        with atomic_write(self.path, durability, "wb") as f:
+            pos = 0
+            for code in (self._order if self._order is not None
+                         else range(self._n_file)):
+                if code < 0:
+                    data = self._encode(self._mem[code])
+                else:
+                    # unchanged entries are copied without decoding
+                    data = self._read_line(code)
+                f.write(data)
+                pos += len(data)
+                offsets.append(pos)
+            for code in self._tail:
+                data = self._encode(self._mem[code])
+                f.write(data)
+                pos += len(data)
+                offsets.append(pos)
+        self._reset()
+        self._open_after_write(offsets)
+
+    def _reset(self):
+        self._order = None
+        self._tail = []
+        self._mem = {}
+        self._rewrite = False
+        self._cache.clear()
+
+    def _open_after_write(self, offsets):
+        self.close()
+        self._offsets = offsets
+        if getsize(self.path):
+            self._file = open(self.path, "rb")
+            self._mm = mmap.mmap(self._file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        self._save_index()
+
+    def remove(self):
+        """ delete the file and its offset index """
+        self.close()
+        for path in (self.path, self.index_path):
+            if isfile(path):
+                remove(path)
+
+    @classmethod
+    def from_list(cls, path, entries, serializer=None,
+                  durability=DURABILITY_NONE):
+        """ write a list of entries as a new JSON Lines file """
+        table = cls(path, serializer)
+        # replace whatever the file contained
+        table.close()
+        table._reset()
+        table._offsets = array("Q", [0])
+        for entry in entries:
+            table.append(entry)
+        table._rewrite = True
+        table.flush(durability)
+        return table
@@ -1,6 +1,7 @@
 import json
 from typing import List
 from difflib import SequenceMatcher
+from py3jsondb.utils import SEQUENCE_TYPES, fuzzy_match_thresh
 
 class JsonPath:
     def __init__(self, json_data, mode='key',fuzzy=False,thresh=0.7):
@@ -21,7 +22,7 @@ class JsonPath:
     def iter_node(self, rows, road_step, target):
         if isinstance(rows, dict):
             key_value_iter = (x for x in rows.items())
-        elif isinstance(rows, list):
+        elif isinstance(rows, SEQUENCE_TYPES):
             key_value_iter = (x for x in enumerate(rows))
         else:
             return
@@ -47,18 +48,19 @@ class JsonPath:
                         value = check[item_key]
                         target_value = target[target_key]
                         if isinstance(value, str):
-                            score = self._fuzzy_match(value, target_value)
+                            score = fuzzy_match_thresh(value, target_value,
+                                                       self.thresh)
                             if score >= self.thresh:
                                 yield current_path
                 else:
                     if isinstance(check, str):
-                        score = self._fuzzy_match(check, target)
+                        score = fuzzy_match_thresh(check, target, self.thresh)
                         if score >= self.thresh:
                             yield current_path
             else:
                 if check == target:
                     yield current_path
-            if isinstance(value, (dict, list)):
+            if isinstance(value, (dict,) + SEQUENCE_TYPES):
                 yield from self.iter_node(value, current_path, target)
 
     def find_one(self, target: str) -> list:
@@ -0,0 +1,446 @@
+""" shared memory read replicas of a JsonDatabase
+
+one process publishes a snapshot of the tables of a database into shared
+memory with ReplicaPublisher, reader processes open it with JsonReplica
+instead of parsing their own copy of the file: the snapshot is mapped, not
+copied, so memory stays flat as readers are added, attaching only parses a
+small catalog and entries are decoded when accessed
+
+a snapshot is the segment <name>_<generation>:
+
+    header      magic and size of the catalog
+    catalog     json, table name -> [offset, number of entries], the primary
+                key and the index definitions of the database
+    tables      per table the offsets of its entries (number of entries + 1
+                little endian u64, relative to the end of the offsets)
+                followed by the entries encoded as compact json
+
+the control segment <name> holds the generation of the latest snapshot, a
+new publication creates a new segment and only then bumps the generation,
+readers keep the snapshot they attached to until they refresh()
+
+NOTE: there is one publisher per name, publishing from several processes
+      at once is not supported
+"""
+from collections import OrderedDict
+from collections.abc import MutableSequence
+from hashlib import sha1
+from inspect import signature
+from os.path import abspath, expanduser, realpath
+import struct
+import time
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # python 3.7
+    raise ImportError("py3jsondb.replica needs python 3.8 or newer, "
+                      "multiprocessing.shared_memory is not available")
+
+from py3jsondb import JsonDatabase, LOG
+from py3jsondb.exceptions import DatabaseNotCommitted, ReadOnlyReplica, \
+    TableNotFound
+from py3jsondb.utils.combo_lock import DummyLock
+from py3jsondb.utils.serializers import get_serializer
+
+MAGIC = b"PJDBREP1"
+HEADER = struct.Struct("<8sQ")
+# magic, sequence (odd while the generation is written), generation
+CONTROL = struct.Struct("<8sQQ")
+OFFSET = struct.Struct("<Q")
+OFFSETS = struct.Struct("<QQ")
+
+# python >= 3.13 can open segments without the resource tracker
+_HAS_TRACK = "track" in signature(shared_memory.SharedMemory).parameters
+
+
+def replica_name(path):
+    """ get the shared memory name of the replica of a database file
+
+    Args:
+        path (str): the database file
+
+    Returns:
+        str: a short name unique to the absolute path of the file
+    """
+    path = realpath(abspath(expanduser(path)))
+    # posix shared memory names are short on some platforms
+    return "pjdb" + sha1(path.encode("utf-8")).hexdigest()[:12]
+
+
+def _open(name, create=False, size=0):
+    """ open a segment, it is not removed when the process exits
+
+    the segments belong to the name of the replica rather than to the
+    process that opened them, they are removed by the next publication or
+    ReplicaPublisher.close()
+    """
+    if _HAS_TRACK:
+        return shared_memory.SharedMemory(name, create, size, track=False)
+    # older versions register every segment a process opens with the
+    # resource tracker, which unlinks them when the process exits
+    shm = shared_memory.SharedMemory(name, create, size)
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def _unlink(shm):
+    if not _HAS_TRACK:
+        # unlink() unregisters the segment, register it back first
+        resource_tracker.register(shm._name, "shared_memory")
+    shm.unlink()
+
+
+def read_generation(control):
+    """ read the generation of the latest snapshot from a control segment """
+    while True:
+        magic, seq, generation = CONTROL.unpack_from(control.buf, 0)
+        if magic != MAGIC:
+            raise DatabaseNotCommitted
+        if seq % 2 == 0 and \
+                CONTROL.unpack_from(control.buf, 0)[1] == seq:
+            return generation
+        time.sleep(0)
+
+
+class ReplicaPublisher:
+    """
+    publishes snapshots of a JsonDatabase into shared memory for the
+    JsonReplica of other processes
+
+    :param db: the database
+    :type db: JsonDatabase
+    :param name: name of the shared memory segments, default is derived from the path of the database
+    :type name: str
+    """
+
+    def __init__(self, db, name=None):
+        self.db = db
+        self.name = name or replica_name(db.path)
+        self.serializer = db.db.serializer
+        self._segment = None
+        try:
+            self._control = _open(self.name, create=True, size=CONTROL.size)
+            CONTROL.pack_into(self._control.buf, 0, MAGIC, 0, 0)
+        except FileExistsError:
+            # a previous publisher, generations keep increasing
+            self._control = _open(self.name)
+        self.generation = read_generation(self._control)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, value, traceback):
+        self.close()
+
+    def _encode(self):
+        catalog = {"tables": {}, "primary_key": self.db.primary_key,
+                   "indexes": self.db._index_definitions}
+        chunks = []
+        offset = 0
+        for name in self.db.get_tables():
+            entries = [self.serializer.dumps(entry, pretty=False)
+                       for entry in self.db._table(name)]
+            catalog["tables"][name] = [offset, len(entries)]
+            pos = 0
+            offsets = [pos]
+            for data in entries:
+                pos += len(data)
+                offsets.append(pos)
+            chunks.append(struct.pack("<{}Q".format(len(offsets)), *offsets))
+            chunks.extend(entries)
+            offset += OFFSET.size * len(offsets) + pos
+        catalog = self.serializer.dumps(catalog, pretty=False)
+        return HEADER.pack(MAGIC, len(catalog)) + catalog + b"".join(chunks)
+
+    def publish(self):
+        """
+            write a snapshot of every table, readers see it on their next refresh()
+
+        :return: the generation of the snapshot
+        :rtype: int
+        """
+        data = self._encode()
+        generation = self.generation + 1
+        segment = _open("{}_{}".format(self.name, generation), create=True,
+                        size=max(len(data), 1))
+        segment.buf[:len(data)] = data
+        seq = CONTROL.unpack_from(self._control.buf, 0)[1]
+        CONTROL.pack_into(self._control.buf, 0, MAGIC, seq + 1, generation)
+        CONTROL.pack_into(self._control.buf, 0, MAGIC, seq + 2, generation)
+        old, self._segment = self._segment, segment
+        if old is None and self.generation:
+            # left by a previous publisher
+            try:
+                old = _open("{}_{}".format(self.name, self.generation))
+            except FileNotFoundError:
+                pass
+        self.generation = generation
+        if old is not None:
+            # attached readers keep their mapping of the old snapshot
+            old.close()
+            _unlink(old)
+        LOG.debug("Published generation {} of {} ({} bytes)".format(
+            generation, self.name, len(data)))
+        return generation
+
+    def close(self):
+        """
+            remove the segments, attached readers keep their snapshot but no reader can attach anymore
+        """
+        for shm in (self._segment, self._control):
+            if shm is None:
+                continue
+            shm.close()
+            _unlink(shm)
+        self._segment = self._control = None
+
+
+class ReplicaTable(MutableSequence):
+    """
+    read only list of the entries of a table in a snapshot, entries are
+    decoded when accessed
+
+    :param segment: the snapshot
+    :type segment: multiprocessing.shared_memory.SharedMemory
+    :param offset: position of the offsets of the table in the segment
+    :type offset: int
+    :param size: number of entries
+    :type size: int
+    :param serializer: json backend, see get_serializer
+    :type serializer: str
+    :param cache_size: number of decoded entries kept in memory
+    :type cache_size: int
+    """
+
+    def __init__(self, segment, offset, size, serializer=None,
+                 cache_size=4096):
+        # the segment, not a view of it, so it can be closed once unused
+        self._segment = segment
+        self._offset = offset
+        self._data = offset + OFFSET.size * (size + 1)
+        self._size = size
+        self.serializer = get_serializer(serializer)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def _index(self, idx):
+        if idx < 0:
+            idx += self._size
+        if not 0 <= idx < self._size:
+            raise IndexError("table index out of range")
+        return idx
+
+    def _decode(self, idx):
+        if idx in self._cache:
+            self._cache.move_to_end(idx)
+            return self._cache[idx]
+        start, end = OFFSETS.unpack_from(self._segment.buf,
+                                         self._offset + OFFSET.size * idx)
+        value = self.serializer.loads(
+            bytes(self._segment.buf[self._data + start:self._data + end]))
+        self._cache[idx] = value
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return value
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self._size))]
+        return self._decode(self._index(idx))
+
+    def __iter__(self):
+        for idx in range(self._size):
+            yield self._decode(idx)
+
+    def __setitem__(self, idx, value):
+        raise ReadOnlyReplica
+
+    def __delitem__(self, idx):
+        raise ReadOnlyReplica
+
+    def insert(self, idx, value):
+        raise ReadOnlyReplica
+
+    def __repr__(self):
+        return "ReplicaTable({} entries)".format(self._size)
+
+
+class ReplicaStorage(dict):
+    """
+    read only dict of the tables of the latest snapshot published under a
+    name, refresh() switches to a newer snapshot
+
+    :param name: name of the shared memory segments
+    :type name: str
+    :param serializer: json backend, see get_serializer
+    :type serializer: str
+    :param cache_size: number of decoded entries kept in memory per table
+    :type cache_size: int
+    """
+
+    def __init__(self, name, serializer=None, cache_size=4096):
+        super().__init__()
+        self.name = name
+        self.serializer = get_serializer(serializer)
+        self.cache_size = cache_size
+        self.lock = DummyLock(name)
+        self.durability = None
+        self.generation = None
+        self.primary_key = None
+        self.index_definitions = {}
+        self.parse_count = 0
+        self.is_dirty = False
+        try:
+            self._control = _open(name)
+        except FileNotFoundError:
+            raise DatabaseNotCommitted
+        self.refresh()
+
+    def refresh(self):
+        """
+            attach to the latest snapshot if a newer one was published
+
+        :return: True if the tables changed
+        :rtype: boolean
+        """
+        while True:
+            generation = read_generation(self._control)
+            if generation == self.generation:
+                return False
+            if generation == 0:
+                raise DatabaseNotCommitted
+            try:
+                segment = _open("{}_{}".format(self.name, generation))
+                break
+            except FileNotFoundError:
+                # replaced by a newer snapshot in the meantime
+                continue
+        magic, size = HEADER.unpack_from(segment.buf, 0)
+        if magic != MAGIC:
+            raise DatabaseNotCommitted
+        catalog = self.serializer.loads(
+            bytes(segment.buf[HEADER.size:HEADER.size + size]))
+        base = HEADER.size + size
+        tables = {name: ReplicaTable(segment, base + offset, count,
+                                     self.serializer.name, self.cache_size)
+                  for name, (offset, count) in catalog["tables"].items()}
+        # the previous snapshot is closed when its tables are unused
+        dict.clear(self)
+        dict.update(self, tables)
+        self.generation = generation
+        self.primary_key = catalog["primary_key"]
+        self.index_definitions = catalog["indexes"]
+        self.parse_count += 1
+        return True
+
+    def reload(self):
+        self.refresh()
+
+    def changes(self):
+        return []
+
+    def __setitem__(self, key, value):
+        raise ReadOnlyReplica
+
+    def pop(self, key, *args):
+        raise ReadOnlyReplica
+
+    def store(self, path=None, full=False):
+        raise ReadOnlyReplica
+
+
+class JsonReplica(JsonDatabase):
+    """
+    read only JsonDatabase of the latest snapshot published by a
+    ReplicaPublisher, see py3jsondb.replica
+
+    the primary key and the indexes created with create_index are the ones
+    of the published database, get_tables() and refresh() switch to a newer
+    snapshot
+
+    :param table_name: table name of database
+    :type table_name: str
+    :param path: json file path of the published database, used to derive the name of the replica
+    :type path: str
+    :param name: name of the shared memory segments, default is derived from path
+    :type name: str
+    :param extension: extension
+    :type extension: str
+    :param serializer: json backend of the published snapshots
+    :type serializer: str
+    :param cache_size: number of decoded entries kept in memory per table
+    :type cache_size: int
+    :param path_index: index the paths of every key and leaf value, see JsonDatabase
+    :type path_index: boolean
+    """
+    def __init__(self,
+                 table_name,
+                 path=None,
+                 name=None,
+                 extension="json",
+                 serializer=None,
+                 cache_size=4096,
+                 path_index=False):
+        self._init_state(table_name, path or f"{table_name}.{extension}",
+                         path_index=path_index)
+        self.db = ReplicaStorage(name or replica_name(self.path),
+                                 serializer=serializer, cache_size=cache_size)
+        if self.name not in self.db:
+            raise TableNotFound
+        self.tables = list(self.db.keys())
+        self.primary_key = self.db.primary_key
+        self._index_definitions = self.db.index_definitions
+
+    @property
+    def generation(self):
+        """
+            generation of the snapshot in use, increases with every publication
+        """
+        return self.db.generation
+
+    def refresh(self):
+        """
+            switch to the latest snapshot if a newer one was published
+
+        :return: True if the tables changed
+        :rtype: boolean
+        """
+        if not self.db.refresh():
+            return False
+        self.tables = list(self.db.keys())
+        self.primary_key = self.db.primary_key
+        self._index_definitions = self.db.index_definitions
+        # the indexes notice the new tables and are rebuilt on next use
+        return True
+
+    def get_tables(self):
+        self.refresh()
+        return self.tables
+
+    def reload(self):
+        self.refresh()
+
+    def _mutable(self, path, deep=False):
+        raise ReadOnlyReplica
+
+    def remove_entry(self, entry_id):
+        raise ReadOnlyReplica
+
+    def create_index(self, field, table_name=None, index_type="hash",
+                     **options):
+        raise ReadOnlyReplica
+
+    def drop_index(self, field, table_name=None):
+        raise ReadOnlyReplica
+
+    def transaction(self):
+        raise ReadOnlyReplica
+
+    def compact(self):
+        raise ReadOnlyReplica
+
+    def delete_database(self):
+        raise ReadOnlyReplica
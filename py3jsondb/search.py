@@ -1,169 +1,822 @@
-from py3jsondb.utils import fuzzy_match, match_one
-from py3jsondb import JsonDatabase, JsonStorageXDG
+from functools import partial
+from itertools import islice
+from math import log2
+
+from py3jsondb.utils import fuzzy_match_thresh, match_one
+from py3jsondb import JsonDatabase
+from py3jsondb.indexes import FieldIndex, FuzzyIndex, OrderedIndex, \
+    TokenIndex, MISSING, UNHASHABLE, freeze, sort_family
+
+
+class _Filter:
+    """ a predicate recorded by Query
+
+    test(entry) decides if an entry is kept, access() returns an _Access
+    when an index can tell which entries may pass the test, else None
+    """
+    def __init__(self, name, args, test, access=None):
+        self.name = name
+        self.args = args
+        self.test = test
+        self.access = access
+
+    def __repr__(self):
+        return "{}({})".format(self.name, ", ".join(repr(a)
+                                                    for a in self.args))
+
+
+class _Access:
+    """ how an index answers a filter
+
+    estimate is the number of entries positions() returns, or an upper
+    bound of it, computed from the index statistics without reading the
+    table
+    """
+    def __init__(self, index, method, estimate, positions, count=None):
+        self.index = index
+        self.method = method
+        self.estimate = estimate
+        self.positions = positions
+        # exact number of entries passing the filter, if the index knows it
+        self.count = count
+
+
+class _Plan:
+    """ how a Query reads the table, chosen by Query._plan """
+    def __init__(self, size, driver=None, access=None, order_index=None,
+                 estimate=None):
+        # number of entries of the table
+        self.size = size
+        # the filter whose index gives the entries to check and its access
+        self.driver = driver
+        self.access = access
+        # OrderedIndex reading the table in the requested order
+        self.order_index = order_index
+        # estimated number of entries passing every filter
+        self.estimate = size if estimate is None else estimate
 
 
 class Query:
+    """
+    filters over the entries of the current table of a JsonDatabase
+
+    filters are recorded and only run when the query is iterated, build(),
+    first(), count() or exists() is called, all of them are checked in a
+    single pass over the table, or over the entries an index returns for
+    one of them, and no list is built unless the result is sorted
+
+    limit() and offset() are applied after filtering and sorting, whatever
+    their place in the chain
+
+    when several filters can be answered by an index, the one expected to
+    return the fewest entries according to the index statistics gives the
+    entries to check, explain() shows the chosen plan
+    """
     def __init__(self, db):
+        self._filters = []
+        self._order = []
+        self._offset = 0
+        self._limit = None
         if isinstance(db, JsonDatabase):
-            self.result = list(db)
+            self._db = db
+            self._entries = None
         else:
-            self.result = [db]
+            self._db = None
+            self._entries = [db]
+
+    @property
+    def result(self):
+        return self.build()
+
+    @result.setter
+    def result(self, value):
+        self._db = None
+        self._entries = value
+        self._filters = []
+        self._order = []
 
+    def _field_index(self, key):
+        """ index of key, None if the query does not run on an indexed table """
+        if self._db is None:
+            return None
+        return self._db._field_index(key)
+
+    def _add(self, name, args, test, access=None):
+        self._filters.append(_Filter(name, args, test, access))
+        return self
+
+    @staticmethod
+    def _has_key(key, ignore_case):
+        # the test of contains_key without fuzzy matching, every filter on
+        # the value of a key starts with it
+        if ignore_case:
+            return lambda a: a.get(key) or a.get(key.lower())
+        return lambda a: a.get(key)
+
+    # filters
     def contains_key(self, key, fuzzy=False, thresh=0.7, ignore_case=False):
         if fuzzy:
-            after = []
-            for e in self.result:
-                filter = True
+            def test(e):
                 for k in e:
                     if ignore_case:
-                        score = fuzzy_match(k.lower(), key.lower())
+                        score = fuzzy_match_thresh(k.lower(), key.lower(),
+                                                   thresh)
                     else:
-                        score = fuzzy_match(k, key)
-                    if score < thresh:
-                        continue
-                    filter = False
-                if not filter:
-                    after.append(e)
-            self.result = after
-        elif ignore_case:
-            self.result = [a for a in self.result
-                           if a.get(key) or a.get(key.lower())]
+                        score = fuzzy_match_thresh(k, key, thresh)
+                    if score >= thresh:
+                        return True
+                return False
         else:
-            self.result = [a for a in self.result if a.get(key)]
-        return self
+            test = self._has_key(key, ignore_case)
+        return self._add("contains_key", (key,), test)
 
     def contains_value(self, key, value, fuzzy=False, thresh=0.75, ignore_case=False):
-        self.contains_key(key, ignore_case=ignore_case)
+        has_key = self._has_key(key, ignore_case)
+        access = None
         if fuzzy:
-            after = []
-            for e in self.result:
+            def test(e):
+                if not has_key(e):
+                    return False
                 if isinstance(e[key], str):
                     if ignore_case:
-                        score = fuzzy_match(value.lower(), e[key].lower())
+                        score = fuzzy_match_thresh(value.lower(),
+                                                   e[key].lower(), thresh)
                     else:
-                        score = fuzzy_match(value, e[key])
-                    if score > thresh:
-                        after.append(e)
+                        score = fuzzy_match_thresh(value, e[key], thresh)
+                    return score > thresh
                 elif isinstance(e[key], list):
                     if ignore_case:
                         v, score = match_one(value.lower(),
-                                             [_.lower() for _ in e[key]])
+                                             [_.lower() for _ in e[key]],
+                                             thresh)
                     else:
-                        v, score = match_one(value, e[key])
-                    if score < thresh:
-                        continue
-                    after.append(e)
+                        v, score = match_one(value, e[key], thresh)
+                    return score >= thresh
                 elif isinstance(e[key], dict):
                     if ignore_case:
                         v, score = match_one(value.lower(),
-                                             [_.lower() for _ in e[key].keys()])
+                                             [_.lower() for _ in e[key].keys()],
+                                             thresh)
                     else:
-                        v, score = match_one(value, e[key])
-                    if score < thresh:
-                        continue
-                    after.append(e)
-            self.result = after
+                        v, score = match_one(value, e[key], thresh)
+                    return score >= thresh
+                return False
+
+            access = partial(self._fuzzy_access, key, value, thresh,
+                             ignore_case)
         elif ignore_case and isinstance(value, str):
-            after = []
-            for a in self.result:
-                if isinstance(a[key], str) and value.lower() in a[key].lower():
-                    after.append(a)
-                elif value.lower() in a[key] or value in a[key]:
-                    after.append(a)
-            self.result = after
+            lowered = value.lower()
+
+            def test(a):
+                if not has_key(a):
+                    return False
+                if isinstance(a[key], str) and lowered in a[key].lower():
+                    return True
+                return lowered in a[key] or value in a[key]
         else:
-            self.result = [a for a in self.result if value in a[key]]
-        return self
+            def test(a):
+                return has_key(a) and value in a[key]
+        return self._add("contains_value", (key, value), test, access)
 
     def value_contains(self, key, value, ignore_case=False):
-        self.contains_key(key, ignore_case=ignore_case)
+        has_key = self._has_key(key, ignore_case)
         if ignore_case:
-            after = []
-            value = str(value).lower()
-            for e in self.result:
-                if isinstance(e[key], str) and ignore_case:
-                    if value.lower() in e[key].lower():
-                        after.append(e)
-                elif isinstance(e[key], list) and ignore_case:
-                    if value.lower() in [str(_).lower() for _ in e[key]]:
-                        after.append(e)
-                elif isinstance(e[key], dict) and ignore_case:
-                    if value.lower() in [str(_).lower() for _ in e[key].keys()]:
-                        after.append(e)
-
-                elif isinstance(e[key], str):
-                    if value in e[key]:
-                        after.append(e)
+            lowered = str(value).lower()
+
+            def test(e):
+                if not has_key(e):
+                    return False
+                if isinstance(e[key], str):
+                    return lowered in e[key].lower()
                 elif isinstance(e[key], list):
-                    if value in [str(_) for _ in e[key]]:
-                        after.append(e)
+                    return lowered in [str(_).lower() for _ in e[key]]
                 elif isinstance(e[key], dict):
-                    if value in [str(_) for _ in e[key].keys()]:
-                        after.append(e)
-
-            self.result = after
+                    return lowered in [str(_).lower() for _ in e[key].keys()]
+                return False
         else:
-            self.result = [e for e in self.result if value in e[key]]
-        return self
+            def test(e):
+                return has_key(e) and value in e[key]
+        access = partial(self._token_access, key,
+                         str(value) if ignore_case else value, ignore_case,
+                         substring=True)
+        return self._add("value_contains", (key, value), test, access)
 
     def value_contains_token(self, key, value, fuzzy=False, thresh=0.75, ignore_case=False):
-        self.contains_key(key, ignore_case=ignore_case)
-        after = []
+        has_key = self._has_key(key, ignore_case)
         value = str(value)
-        for e in self.result:
+
+        def test(e):
+            if not has_key(e):
+                return False
             if isinstance(e[key], str):
                 if fuzzy:
                     _, score = match_one(value.lower(),
-                                         e[key].lower().split(" "))
-                    if score > thresh:
-                        after.append(e)
+                                         e[key].lower().split(" "), thresh)
+                    return score > thresh
                 elif ignore_case and value.lower() in e[key].lower().split(" "):
-                    after.append(e)
-                elif value in e[key].split(" "):
-                    after.append(e)
-            elif value in e[key]:
-                after.append(e)
-        self.result = after
-        return self
+                    return True
+                return value in e[key].split(" ")
+            return value in e[key]
+
+        access = None
+        if not fuzzy:
+            access = partial(self._token_access, key, value, ignore_case)
+        return self._add("value_contains_token", (key, value), test, access)
 
     def equal(self, key, value, ignore_case=False):
-        self.contains_key(key, ignore_case=ignore_case)
+        has_key = self._has_key(key, ignore_case)
+        access = None
         if ignore_case and isinstance(value, str):
-            self.result = [a for a in self.result
-                           if a[key].lower() == value.lower()]
+            lowered = value.lower()
+
+            def test(a):
+                return has_key(a) and a[key].lower() == lowered
         else:
-            self.result = [a for a in self.result if a[key] == value]
-        return self
+            def test(a):
+                return has_key(a) and a[key] == value
+
+            access = partial(self._equal_access, key, value)
+        return self._add("equal", (key, value), test, access)
+
+    def _compare(self, name, args, test, ignore_case, low=None, high=None,
+                 include_low=False, include_high=False):
+        key = args[0]
+        has_key = self._has_key(key, ignore_case)
+        access = None
+        if not ignore_case:
+            access = partial(self._range_access, key, low, high, include_low,
+                             include_high)
+        return self._add(name, args, lambda a: has_key(a) and test(a[key]),
+                         access)
 
     def bellow(self, key, value, ignore_case=False):
-        self.contains_key(key, ignore_case=ignore_case)
-        self.result = [a for a in self.result if a[key] < value]
-        return self
+        return self._compare("bellow", (key, value), lambda v: v < value,
+                             ignore_case, high=value)
 
     def above(self, key, value, ignore_case=False):
-        self.contains_key(key, ignore_case=ignore_case)
-        self.result = [a for a in self.result if a[key] > value]
-        return self
+        return self._compare("above", (key, value), lambda v: v > value,
+                             ignore_case, low=value)
 
     def bellow_or_equal(self, key, value, ignore_case=False):
-        self.contains_key(key, ignore_case=ignore_case)
-        self.result = [a for a in self.result if a[key] <= value]
-        return self
+        return self._compare("bellow_or_equal", (key, value),
+                             lambda v: v <= value, ignore_case, high=value,
+                             include_high=True)
 
     def above_or_equal(self, key, value, ignore_case=False):
-        self.contains_key(key, ignore_case=ignore_case)
-        self.result = [a for a in self.result if a[key] >= value]
-        return self
+        return self._compare("above_or_equal", (key, value),
+                             lambda v: v >= value, ignore_case, low=value,
+                             include_low=True)
 
     def in_range(self, key, min_value, max_value, ignore_case=False):
-        self.contains_key(key, ignore_case=ignore_case)
-        self.result = [a for a in self.result if min_value < a[key] < max_value]
+        return self._compare("in_range", (key, min_value, max_value),
+                             lambda v: min_value < v < max_value,
+                             ignore_case, low=min_value, high=max_value)
+
+    def order_by(self, key, reverse=False):
+        """ sort the result by the value of key, numbers before strings,
+        entries whose value can not be ordered are kept last """
+        self._order.append((key, reverse))
+        return self
+
+    def offset(self, n):
+        """ skip the first n entries of the result """
+        self._offset = n
+        return self
+
+    def limit(self, n):
+        """ return at most n entries, the scan stops once they are found """
+        self._limit = n
         return self
 
     def all(self):
         return self
 
+    # index lookups, they return an _Access or None
+    def _equal_access(self, key, value):
+        index = self._field_index(key)
+        if not isinstance(index, FieldIndex):
+            return None
+        count = None
+        if type(value) in (str, int, float) and value and value == value \
+                and UNHASHABLE not in index._buckets:
+            # equal also requires a truthy value, as contains_key does
+            count = index.count(index.value_key(value))
+        return _Access(index, "lookup", index.count_value(value),
+                       lambda: index.find(value), count)
+
+    def _range_access(self, key, low, high, include_low, include_high):
+        index = self._field_index(key)
+        if not isinstance(index, OrderedIndex):
+            return None
+        families = set(sort_family(v) for v in (low, high) if v is not None)
+        if len(families) != 1 or None in families:
+            return None
+        if index.is_mixed(families.pop()):
+            # the scan compares every value, the index would skip the
+            # values of other types
+            return None
+        keys = index.range_keys(low, high, include_low, include_high)
+        return _Access(index, "range", sum(index.count(k) for k in keys),
+                       lambda: index.positions_of(keys),
+                       sum(index.count(k) for k in keys if k))
+
+    def _token_access(self, key, value, ignore_case, substring=False):
+        index = self._field_index(key)
+        if not isinstance(index, TokenIndex) or \
+                not index.can_lookup(ignore_case) or not isinstance(value, str):
+            return None
+        if substring:
+            keys = index.substring_keys(value)
+            if keys is None:
+                return None
+            return _Access(index, "substring",
+                           sum(index.count(k) for k in keys),
+                           lambda: index.positions_of(keys))
+        estimate = index.count_tokens(value)
+        if estimate is None:
+            return None
+        return _Access(index, "tokens", estimate,
+                       lambda: index.find_tokens(value))
+
+    def _fuzzy_access(self, key, value, thresh, ignore_case):
+        index = self._field_index(key)
+        if not isinstance(index, FuzzyIndex) or not isinstance(value, str):
+            return None
+
+        def positions():
+            # strings the index scored above thresh and every value that
+            # is not a string, the filter still scores them
+            found = set(pos for pos, score in
+                        index.search(value, thresh, ignore_case)
+                        if score > thresh)
+            found.update(index.non_strings())
+            return sorted(found)
+        return _Access(index, "fuzzy",
+                       index.count_candidates(value, thresh, ignore_case),
+                       positions)
+
+    # planning and execution
+    def _plan(self):
+        """ choose the filter whose index returns the fewest entries, the
+        entries it returns are checked against every filter, and whether
+        an ordered index can read the table in the requested order """
+        if self._db is None:
+            return _Plan(len(self._entries)
+                         if hasattr(self._entries, "__len__") else 0)
+        size = len(self._db._table())
+        driver = access = None
+        selectivity = 1.0
+        for f in self._filters:
+            if f.access is None:
+                continue
+            a = f.access()
+            if a is None:
+                continue
+            if size:
+                selectivity *= min(a.estimate, size) / size
+            if a.estimate < size and \
+                    (access is None or a.estimate < access.estimate):
+                driver, access = f, a
+        estimate = int(round(size * selectivity))
+        order_index = None
+        if len(self._order) == 1:
+            index = self._field_index(self._order[0][0])
+            if isinstance(index, OrderedIndex) and \
+                    self._stream_cost(size, estimate) <= \
+                    self._sort_cost(size if access is None
+                                    else access.estimate):
+                driver = access = None
+                order_index = index
+        return _Plan(size, driver, access, order_index, estimate)
+
+    def _stream_cost(self, size, estimate):
+        # entries checked when reading the whole table in order, a limit
+        # stops once enough entries passed the filters
+        if self._limit is None:
+            return size
+        wanted = self._offset + self._limit
+        return min(size, wanted * size / max(estimate, 1))
+
+    @staticmethod
+    def _sort_cost(n):
+        # entries checked and then sorted
+        return n + n * log2(max(n, 2))
+
+    def _source(self, plan):
+        if self._db is None:
+            return self._entries
+        table = self._db._table()
+        if plan.order_index is not None:
+            # the index yields the table in order, nothing to sort
+            return (table[idx] for idx in
+                    plan.order_index.sorted_positions(self._order[0][1]))
+        if plan.access is not None:
+            return (table[idx] for idx in plan.access.positions())
+        return table
+
+    def _filter(self, entries):
+        tests = [f.test for f in self._filters]
+        for e in entries:
+            for test in tests:
+                if not test(e):
+                    break
+            else:
+                yield e
+
+    def _run(self, plan=None, source=None):
+        plan = plan or self._plan()
+        if source is None:
+            source = self._source(plan)
+        entries = self._filter(source)
+        if not self._order or plan.order_index is not None:
+            return entries
+        entries = list(entries)
+        for key, reverse in self._order:
+            entries = _sort_entries(entries, key, reverse)
+        return iter(entries)
+
+    def _slice(self, entries):
+        if self._offset or self._limit is not None:
+            stop = None if self._limit is None else self._offset + self._limit
+            entries = islice(entries, self._offset, stop)
+        return entries
+
+    def explain(self):
+        """
+            run the query and describe how it was executed
+
+            the plan lists the filter whose index gave the entries to check, or a full scan, the estimated number
+            of entries computed from the index statistics before running the query and the actual numbers
+
+        :return: the plan
+        :rtype: dict
+        """
+        plan = self._plan()
+        scanned = [0]
+
+        def counted(entries):
+            for e in entries:
+                scanned[0] += 1
+                yield e
+        rows = sum(1 for _ in self._slice(
+            self._run(plan, counted(self._source(plan)))))
+        if plan.access is not None:
+            access = {"type": "index", "filter": repr(plan.driver),
+                      "index": plan.access.index.type,
+                      "method": plan.access.method,
+                      "estimated_rows": plan.access.estimate}
+        elif plan.order_index is not None:
+            access = {"type": "ordered scan", "index": plan.order_index.type,
+                      "estimated_rows": plan.size}
+        else:
+            access = {"type": "scan", "estimated_rows": plan.size}
+        estimate = max(plan.estimate - self._offset, 0)
+        if self._limit is not None:
+            estimate = min(estimate, self._limit)
+        return {
+            "entries": plan.size,
+            "access": access,
+            "residual_filters": [repr(f) for f in self._filters
+                        if f is not plan.driver],
+            "order": [{"key": key, "reverse": reverse,
+                       "method": "index" if plan.order_index is not None
+                       else "sort"} for key, reverse in self._order],
+            "offset": self._offset,
+            "limit": self._limit,
+            "estimated_rows": estimate,
+            "scanned_rows": scanned[0],
+            "actual_rows": rows
+        }
+
+    def __iter__(self):
+        return self._slice(self._run())
+
     def build(self):
-        return self.result
+        return list(self)
+
+    def first(self):
+        """ the first entry of the result, None if it is empty """
+        for e in self:
+            return e
+        return None
+
+    # aggregations, computed in one pass without building the result
+    def _rows(self):
+        # sorting does not change an aggregation unless offset or limit
+        # select the entries
+        if self._offset or self._limit is not None:
+            return iter(self)
+        return self._filter(self._source(self._plan()))
+
+    def _only_table(self):
+        """ the table if the query has no filter, offset or limit, the
+        index statistics then describe the whole result """
+        if self._db is None or self._filters or self._offset or \
+                self._limit is not None:
+            return None
+        return self._db._table()
+
+    def count(self):
+        """ number of entries in the result """
+        n = None
+        table = self._only_table()
+        if table is not None:
+            n = len(table)
+        elif self._db is not None and len(self._filters) == 1 and \
+                self._filters[0].access is not None:
+            access = self._filters[0].access()
+            if access is not None and access.count is not None:
+                n = access.count
+        if n is None:
+            n = 0
+            for _ in self._rows():
+                n += 1
+            return n
+        n = max(n - self._offset, 0)
+        return n if self._limit is None else min(n, self._limit)
+
+    def _aggregate(self, name, key):
+        agg = AGGREGATES[name](key)
+        agg.update(self._rows())
+        return agg.result()
+
+    def sum(self, key):
+        """ sum of the numbers under key, other values are ignored """
+        return self._aggregate("sum", key)
+
+    def avg(self, key):
+        """ mean of the numbers under key, None if there are none """
+        return self._aggregate("avg", key)
+
+    def min(self, key):
+        """ smallest value under key, numbers before strings, None if no
+        value can be ordered """
+        return self._extreme(key, False)
+
+    def max(self, key):
+        """ largest value under key, strings after numbers, None if no
+        value can be ordered """
+        return self._extreme(key, True)
+
+    def _extreme(self, key, reverse):
+        if self._only_table() is not None:
+            index = self._field_index(key)
+            if isinstance(index, OrderedIndex):
+                return index.first_key(reverse)
+        return self._aggregate("max" if reverse else "min", key)
+
+    def distinct(self, key):
+        """ distinct values under key in order of first appearance """
+        table = self._only_table()
+        if table is not None:
+            index = self._field_index(key)
+            if isinstance(index, FieldIndex) and \
+                    UNHASHABLE not in index._buckets:
+                # the first entry of every bucket, in table order
+                return [table[pos][key] for pos in
+                        sorted(index.positions(k)[0] for k in index._buckets
+                               if k is not MISSING)]
+        return self._aggregate("distinct", key)
+
+    def group_by(self, key):
+        """ group the result by the value of key, see GroupBy.agg """
+        return GroupBy(self, key)
+
+    def exists(self):
+        """ True if at least one entry passes the filters """
+        for _ in self:
+            return True
+        return False
+
+
+def _sort_entries(entries, key, reverse=False):
+    ordered = []
+    rest = []
+    for e in entries:
+        value = e.get(key) if isinstance(e, dict) else None
+        family = sort_family(value)
+        if family is None:
+            rest.append(e)
+        else:
+            ordered.append(((family, value), e))
+    ordered.sort(key=lambda i: i[0], reverse=reverse)
+    return [e for _, e in ordered] + rest
+
+
+class Aggregate:
+    """ folds the values of a key of the entries in a single pass
+
+    Arguments:
+        key (str): entries without the key are skipped, None to fold the
+                   entries themselves
+    """
+    def __init__(self, key=None):
+        self.key = key
+
+    def update(self, entries):
+        key = self.key
+        add = self.add
+        if key is None:
+            for e in entries:
+                add(e)
+            return
+        for e in entries:
+            if isinstance(e, dict) and key in e:
+                add(e[key])
+
+    def add(self, value):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+class Count(Aggregate):
+    def __init__(self, key=None):
+        super().__init__(key)
+        self.n = 0
+
+    def add(self, value):
+        self.n += 1
+
+    def result(self):
+        return self.n
+
+
+def _is_number(value):
+    return type(value) in (int, float)
+
+
+class Sum(Aggregate):
+    def __init__(self, key=None):
+        super().__init__(key)
+        self.total = 0
+
+    def add(self, value):
+        if _is_number(value):
+            self.total += value
+
+    def result(self):
+        return self.total
+
+
+class Avg(Sum):
+    def __init__(self, key=None):
+        super().__init__(key)
+        self.n = 0
+
+    def add(self, value):
+        if _is_number(value):
+            self.total += value
+            self.n += 1
+
+    def result(self):
+        return self.total / self.n if self.n else None
+
+
+class Min(Aggregate):
+    reverse = False
+
+    def __init__(self, key=None):
+        super().__init__(key)
+        self.best = None
+
+    def add(self, value):
+        family = sort_family(value)
+        if family is None:
+            return
+        item = (family, value)
+        if self.best is None or \
+                (item > self.best if self.reverse else item < self.best):
+            self.best = item
+
+    def result(self):
+        return None if self.best is None else self.best[1]
+
+
+class Max(Min):
+    reverse = True
+
+
+class Distinct(Aggregate):
+    def __init__(self, key=None):
+        super().__init__(key)
+        self.values = []
+        self._seen = set()
+
+    def add(self, value):
+        frozen = freeze(value)
+        try:
+            if frozen in self._seen:
+                return
+            self._seen.add(frozen)
+        except TypeError:
+            if value in self.values:
+                return
+        self.values.append(value)
+
+    def result(self):
+        return self.values
+
+
+# aggregation name -> class, used by Query and GroupBy.agg
+AGGREGATES = {
+    "count": Count,
+    "sum": Sum,
+    "avg": Avg,
+    "min": Min,
+    "max": Max,
+    "distinct": Distinct
+}
+
+
+class GroupBy:
+    """ groups of the entries of a Query with the same value of a key
+
+    Arguments:
+        query (Query): the grouped query
+        key (str): entries without the key are not grouped
+    """
+    def __init__(self, query, key):
+        self.query = query
+        self.key = key
+
+    def agg(self, **aggregations):
+        """
+            aggregate every group in a single pass over the query result
+
+            usage: group_by("country").agg(users="count", mean_age=("avg", "age"))
+
+        :param aggregations: result name -> aggregation name, or (aggregation name, key) to aggregate a key
+                             of the entries, see AGGREGATES
+        :return: one dict per group, in order of first appearance, with the grouped key and the results
+        :rtype: list
+        """
+        specs = {}
+        for name, spec in aggregations.items():
+            agg, key = (spec, None) if isinstance(spec, str) else spec
+            if agg not in AGGREGATES:
+                raise ValueError("unknown aggregation {}, must be one of "
+                                 "{}".format(agg, ", ".join(AGGREGATES)))
+            specs[name] = (AGGREGATES[agg], key)
+        counted = self._count_from_index(specs)
+        if counted is not None:
+            return counted
+        key = self.key
+        groups = {}
+        unhashable = []
+        for e in self.query._rows():
+            if not isinstance(e, dict) or key not in e:
+                continue
+            value = e[key]
+            frozen = freeze(value)
+            try:
+                group = groups.get(frozen)
+                if group is None:
+                    group = groups[frozen] = self._group(value, specs)
+            except TypeError:
+                for v, group in unhashable:
+                    if v == value:
+                        break
+                else:
+                    group = self._group(value, specs)
+                    unhashable.append((value, group))
+            for agg in group[1].values():
+                if agg.key is None:
+                    agg.add(e)
+                elif agg.key in e:
+                    agg.add(e[agg.key])
+        result = []
+        for value, aggs in list(groups.values()) + \
+                [group for _, group in unhashable]:
+            row = {key: value}
+            for name, agg in aggs.items():
+                row[name] = agg.result()
+            result.append(row)
+        return result
 
+    @staticmethod
+    def _group(value, specs):
+        return value, {name: cls(key) for name, (cls, key) in specs.items()}
 
+    def _count_from_index(self, specs):
+        # counting the entries of every value of an indexed key of the
+        # whole table only needs the bucket sizes
+        table = self.query._only_table()
+        if table is None or \
+                any(cls is not Count or key not in (None, self.key)
+                    for cls, key in specs.values()):
+            return None
+        index = self.query._field_index(self.key)
+        if not isinstance(index, FieldIndex) or \
+                UNHASHABLE in index._buckets:
+            return None
+        firsts = sorted((index.positions(k)[0], index.count(k))
+                        for k in index._buckets if k is not MISSING)
+        result = []
+        for pos, n in firsts:
+            row = {self.key: table[pos][self.key]}
+            for name in specs:
+                row[name] = n
+            result.append(row)
+        return result
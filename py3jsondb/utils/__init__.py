@@ -1,5 +1,19 @@
 import json
+import mmap
+import re
+from collections import Counter
+from collections.abc import MutableSequence
 from difflib import SequenceMatcher
+from functools import lru_cache
+from os import fstat
+from py3jsondb.utils.serializers import get_serializer
+from py3jsondb.utils.snapshot_cache import read_snapshot, write_snapshot
+
+# tables are plain lists or list-like objects such as JsonlTable
+SEQUENCE_TYPES = (list, MutableSequence)
+
+# a line starting with // or #, after leading whitespace
+_COMMENT_LINE = re.compile(rb"^[ \t\r\f\v]*(?://|#)", re.MULTILINE)
 
 
 def fuzzy_match(x, against):
@@ -8,16 +22,59 @@ def fuzzy_match(x, against):
         float: match percentage -- 1.0 for perfect match,
                down to 0.0 for no match at all.
     """
+    if type(x) is str and type(against) is str:
+        return _cached_ratio(x, against)
     return SequenceMatcher(None, x, against).ratio()
 
 
-def match_one(query, choices):
+# the caches keep the pairs of repeated searches, small bounds keep
+# their memory low with long strings
+@lru_cache(maxsize=4096)
+def _cached_ratio(x, against):
+    return SequenceMatcher(None, x, against).ratio()
+
+
+def fuzzy_match_thresh(x, against, thresh):
+    """Same as fuzzy_match for the strings that can score thresh or more
+
+    The length and character counts of the strings give upper bounds of
+    the score, when a bound is below thresh the exact score is not
+    computed and the bound is returned instead, comparisons of the result
+    with thresh give the same answer as with the exact score.
+
+    Returns:
+        float: match percentage, or an upper bound of it below thresh
+    """
+    if type(x) is not str or type(against) is not str:
+        return fuzzy_match(x, against)
+    return _bounded_ratio(x, against, thresh)
+
+
+@lru_cache(maxsize=4096)
+def _bounded_ratio(x, against, thresh):
+    # SequenceMatcher.real_quick_ratio and quick_ratio, without building
+    # the matcher for the strings rejected by them
+    length = len(x) + len(against)
+    if not length:
+        return 1.0
+    bound = 2.0 * min(len(x), len(against)) / length
+    if bound >= thresh:
+        matches = sum((Counter(x) & Counter(against)).values())
+        bound = 2.0 * matches / length
+        if bound >= thresh:
+            return _cached_ratio(x, against)
+    return bound
+
+
+def match_one(query, choices, thresh=None):
     """
         Find best match from a list or dictionary given an input
 
         Arguments:
             query:   string to test
             choices: list or dictionary of choices
+            thresh:  only scores reaching thresh need to be exact, see
+                     fuzzy_match_thresh
 
         Returns: tuple with best match, score
     """
@@ -28,9 +85,15 @@ def match_one(query, choices):
     else:
         raise ValueError('a list or dict of choices must be provided')
 
-    best = (_choices[0], fuzzy_match(query, _choices[0]))
+    if thresh is None:
+        match = fuzzy_match
+    else:
+        def match(x, against):
+            return fuzzy_match_thresh(x, against, thresh)
+
+    best = (_choices[0], match(query, _choices[0]))
     for c in _choices[1:]:
-        score = fuzzy_match(query, c)
+        score = match(query, c)
         if score > best[1]:
             best = (c, score)
 
@@ -74,7 +137,7 @@ def merge_dict(base, delta, merge_lists=True, skip_empty=True,
     return base
 
 
-def load_commented_json(filename):
+def load_commented_json(filename, serializer=None, cache=False):
     """ Loads an JSON file, ignoring comments
 
     Supports a trivial extension to the JSON file format.  Allow comments
@@ -87,14 +150,52 @@ def load_commented_json(filename):
 
     Args:
         filename (str):  path to the commented JSON file
+        serializer (str): json backend used to decode, see get_serializer
+        cache (bool): use and refresh a binary snapshot of the parsed file,
+                      see py3jsondb.utils.snapshot_cache
 
     Returns:
         obj: decoded Python object
     """
-    with open(filename, encoding='utf-8') as f:
-        contents = f.read()
+    if cache:
+        data = read_snapshot(filename)
+        if data is not None:
+            return data
+
+    serializer = get_serializer(serializer)
+    with open(filename, "rb") as f:
+        # the file that is parsed, another writer may replace filename
+        source_stat = fstat(f.fileno()) if cache else None
+        if _has_comments(f):
+            data = serializer.loads(_strip_comment_lines(f))
+        else:
+            data = serializer.load(f)
+    if cache:
+        write_snapshot(filename, data, source_stat=source_stat)
+    return data
+
+
+def _has_comments(f):
+    """ search a binary file for comment lines without reading it """
+    try:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _COMMENT_LINE.search(mm) is not None
+    except ValueError:  # empty file, can not be mapped
+        return False
+
 
-    return json.loads(uncomment_json(contents))
+def _strip_comment_lines(f):
+    """ copy a binary file line by line, leaving out comment lines
+
+    only the uncommented json is kept in memory, unlike uncomment_json
+    which needs the whole file, its lines and the joined result
+    """
+    f.seek(0)
+    contents = bytearray()
+    for line in f:
+        if not _COMMENT_LINE.match(line):
+            contents += line
+    return contents
 
 
 def uncomment_json(commented_json_str):
@@ -165,7 +266,7 @@ def get_key_recursively(search_dict, field, filter_None=True):
         elif isinstance(value, dict):
             fields_found += get_key_recursively(value, field, filter_None)
 
-        elif isinstance(value, list):
+        elif isinstance(value, SEQUENCE_TYPES):
             for item in value:
                 if not isinstance(item, dict):
                     try:
@@ -179,11 +280,14 @@ def get_key_recursively(search_dict, field, filter_None=True):
     return fields_found
 
 
-def get_key_recursively_fuzzy(search_dict, field, thresh=0.6, filter_None=True):
+def get_key_recursively_fuzzy(search_dict, field, thresh=0.6, filter_None=True, candidates=None):
     """
     Takes a dict with nested lists and dicts,
     and searches all dicts for a key of the field
     provided.
+
+    candidates are the keys that may reach thresh, eg. from a path index,
+    the other string keys are not scored, None scores every key
     """
     if not is_jsonifiable(search_dict):
         raise ValueError("unparseable format")
@@ -194,24 +298,24 @@ def get_key_recursively_fuzzy(search_dict, field, thresh=0.6, filter_None=True):
         if value is None and filter_None:
             continue
         score = 0
-        if isinstance(key, str):
-            score = fuzzy_match(key, field)
+        if isinstance(key, str) and (candidates is None or key in candidates):
+            score = fuzzy_match_thresh(key, field, thresh)
 
         if score >= thresh:
             fields_found.append((search_dict, score))
         elif isinstance(value, dict):
-            fields_found += get_key_recursively_fuzzy(value, field, thresh, filter_None)
+            fields_found += get_key_recursively_fuzzy(value, field, thresh, filter_None, candidates)
 
-        elif isinstance(value, list):
+        elif isinstance(value, SEQUENCE_TYPES):
             for item in value:
                 if not isinstance(item, dict):
                     try:
-                        if get_key_recursively_fuzzy(item.__dict__, field, thresh, filter_None):
+                        if get_key_recursively_fuzzy(item.__dict__, field, thresh, filter_None, candidates):
                             fields_found.append((item, score))
                     except:
                         continue  # can't parse
                 else:
-                    fields_found += get_key_recursively_fuzzy(item, field, thresh, filter_None)
+                    fields_found += get_key_recursively_fuzzy(item, field, thresh, filter_None, candidates)
     return sorted(fields_found, key = lambda i: i[1],reverse=True)
 
 
@@ -233,7 +337,7 @@ def get_value_recursively(search_dict, field, target_value):
         elif isinstance(value, dict):
             fields_found += get_value_recursively(value, field, target_value)
 
-        elif isinstance(value, list):
+        elif isinstance(value, SEQUENCE_TYPES):
             for item in value:
                 if not isinstance(item, dict):
                     try:
@@ -247,11 +351,14 @@ def get_value_recursively(search_dict, field, target_value):
     return fields_found
 
 
-def get_value_recursively_fuzzy(search_dict, field, target_value, thresh=0.6):
+def get_value_recursively_fuzzy(search_dict, field, target_value, thresh=0.6, candidates=None):
     """
     Takes a dict with nested lists and dicts,
     and searches all dicts for a key of the field
     provided.
+
+    candidates are the values that may reach thresh, eg. from a path index,
+    the other strings are not scored, None scores every value
     """
     if not is_jsonifiable(search_dict):
         raise ValueError("unparseable format")
@@ -259,34 +366,51 @@ def get_value_recursively_fuzzy(search_dict, field, target_value, thresh=0.6):
     for key, value in search_dict.items():
         if key == field:
             if isinstance(value, str):
-                score = fuzzy_match(target_value, value)
+                if candidates is not None and value not in candidates:
+                    continue
+                score = fuzzy_match_thresh(target_value, value, thresh)
                 if score >= thresh:
                     fields_found.append((search_dict, score))
             elif isinstance(value, list):
                 for item in value:
-                    score = fuzzy_match(target_value, item)
+                    if candidates is not None and type(item) is str and \
+                            item not in candidates:
+                        continue
+                    score = fuzzy_match_thresh(target_value, item, thresh)
                     if score >= thresh:
                         fields_found.append((search_dict, score))
         elif isinstance(value, dict):
-            fields_found += get_value_recursively_fuzzy(value, field, target_value, thresh)
+            fields_found += get_value_recursively_fuzzy(value, field, target_value, thresh, candidates)
 
-        elif isinstance(value, list):
+        elif isinstance(value, SEQUENCE_TYPES):
             for item in value:
                 if not isinstance(item, dict):
                     try:
-                        found = get_value_recursively_fuzzy(item.__dict__, field, target_value, thresh)
+                        found = get_value_recursively_fuzzy(item.__dict__, field, target_value, thresh, candidates)
                         if len(found):
                             fields_found.append((item, found[0][1]))
                     except:
                         continue  # can't parse
                 else:
-                    fields_found += get_value_recursively_fuzzy(item, field, target_value, thresh)
+                    fields_found += get_value_recursively_fuzzy(item, field, target_value, thresh, candidates)
 
     return sorted(fields_found, key = lambda i: i[1],reverse=True)
 
 
+_JSON_SCALARS = frozenset((str, int, float, bool, type(None)))
+
+
 def jsonify_recursively(thing):
-    if isinstance(thing, list):
+    # fast paths for plain json values, the checks below are slow for them
+    cls = type(thing)
+    if cls in _JSON_SCALARS:
+        return thing
+    if cls is list:
+        return [jsonify_recursively(item) for item in thing]
+    if cls is dict:
+        return {key: jsonify_recursively(value)
+                for key, value in thing.items()}
+    if isinstance(thing, SEQUENCE_TYPES):
         jsonified = list(thing)
         for idx, item in enumerate(thing):
             jsonified[idx] = jsonify_recursively(item)
@@ -305,3 +429,35 @@ def jsonify_recursively(thing):
         except:
             jsonified = thing
     return jsonified
+
+
+def apply_change(data, op, path, value=None):
+    """ Replays a single change record on a json tree
+
+    Change records are produced by JsonDatabase for every mutation, they
+    are used by the write-ahead log to rebuild the database.
+
+    Args:
+        data (dict): json tree to modify in place
+        op (str): one of 'append', 'set', 'update' or 'delete'
+        path (list): keys/indexes leading to the modified node, for
+                     'append' this is the path of the list itself
+        value: the new value, ignored for 'delete'
+    """
+    obj = data
+    for key in path[:-1]:
+        obj = obj[key]
+    key = path[-1]
+    if op == "append":
+        obj[key].append(value)
+    elif op == "set":
+        obj[key] = value
+    elif op == "update":
+        obj[key].update(value)
+    elif op == "delete":
+        if isinstance(obj, dict):
+            obj.pop(key, None)
+        else:
+            obj.pop(key)
+    else:
+        raise ValueError("unknown change operation: {}".format(op))
@@ -0,0 +1,83 @@
+from contextlib import contextmanager
+from os.path import dirname, isfile
+from uuid import uuid4
+import os
+
+# durability levels, from fastest to safest
+#   none  - atomic rename only, survives a crash of the process
+#   flush - the new file is fsynced before the rename, the file can never be
+#           torn but a power loss may still bring back the previous version
+#   fsync - the directory is fsynced after the rename as well, the new
+#           version is on disk when the save returns
+DURABILITY_NONE = "none"
+DURABILITY_FLUSH = "flush"
+DURABILITY_FSYNC = "fsync"
+DURABILITY_LEVELS = (DURABILITY_NONE, DURABILITY_FLUSH, DURABILITY_FSYNC)
+
+
+def check_durability(durability):
+    if durability not in DURABILITY_LEVELS:
+        raise ValueError("durability must be one of {}, got {}".format(
+            ", ".join(DURABILITY_LEVELS), durability))
+    return durability
+
+
+def fsync_dir(path):
+    """ fsync a directory so a rename or a new file inside it is durable """
+    try:
+        fd = os.open(path or ".", os.O_RDONLY)
+    except OSError:
+        return  # directories can not be opened on windows
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def sync_file(f, durability=DURABILITY_NONE):
+    """ flush and fsync an open file according to the durability level """
+    if durability != DURABILITY_NONE:
+        f.flush()
+        os.fsync(f.fileno())
+
+
+@contextmanager
+def atomic_write(path, durability=DURABILITY_NONE, mode="w",
+                 encoding="utf-8"):
+    """ Write a file atomically
+
+    Data is written to a temporary file in the same directory which is then
+    renamed over path, readers see either the old or the new file, never a
+    truncated one.
+
+    Args:
+        path (str): destination file
+        durability (str): one of 'none', 'flush' or 'fsync'
+        mode (str): 'w' or 'wb'
+
+    Yields:
+        file: the temporary file to write to
+    """
+    check_durability(durability)
+    tmp_path = "{}.{}.tmp".format(path, uuid4().hex[:8])
+    # same permissions a plain open() would give, mkstemp would use 0600
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        if "b" in mode:
+            f = os.fdopen(fd, mode)
+        else:
+            f = os.fdopen(fd, mode, encoding=encoding)
+        with f:
+            yield f
+            sync_file(f, durability)
+        if isfile(path):
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if durability == DURABILITY_FSYNC:
+        fsync_dir(dirname(path))
@@ -12,25 +12,100 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-from threading import Lock
-from fasteners.process_lock import InterProcessLock
-from os.path import exists
+from contextlib import contextmanager
+from hashlib import sha1
+from tempfile import gettempdir
+from threading import Condition, Lock
+from weakref import WeakValueDictionary
+from fasteners.process_lock import InterProcessReaderWriterLock
+from os.path import abspath, basename, exists, expanduser, join, realpath
 from os import chmod
 
 
+def get_lock_path(path, table_name=None):
+    """ Get the lock file of a database file, or of one of its tables.
+
+    The name is derived from the resolved absolute path, databases with the
+    same file name in different folders do not share a lock.
+
+    Arguments:
+        path (str): the database file
+        table_name (str): get the lock of this table instead
+
+    Returns:
+        str: path of the lock file in the temporary folder
+    """
+    path = realpath(expanduser(path))
+    key = path if table_name is None else path + "\0" + str(table_name)
+    digest = sha1(key.encode("utf-8", "surrogateescape")).hexdigest()[:16]
+    return join(gettempdir(), "{}.{}.lock".format(basename(path), digest))
+
+
+class _SharedState:
+    """ state of the locks of one lock file in this process
+
+    fcntl locks belong to the process, every ComboLock of a path shares
+    one state so threads coordinate before touching the file lock
+    """
+    def __init__(self, path, prefer_writers):
+        self.cond = Condition(Lock())
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+        self.prefer_writers = prefer_writers
+        self.plock = InterProcessReaderWriterLock(path)
+        # held by writers of any process while they wait, readers pass
+        # through it so they queue behind waiting writers
+        self.gate = InterProcessReaderWriterLock(path + ".gate")
+        # guards the process read lock shared by the reading threads
+        self.plock_mutex = Lock()
+        self.plock_readers = 0
+
+
+_STATES = WeakValueDictionary()
+_STATES_LOCK = Lock()
+
+
+def _shared_state(path, prefer_writers):
+    with _STATES_LOCK:
+        state = _STATES.get(path)
+        if state is None:
+            state = _STATES[path] = _SharedState(path, prefer_writers)
+        return state
+
+
 class ComboLock:
-    """ A combined process and thread lock.
+    """ A combined process and thread reader-writer lock.
+
+    Readers share the lock, a writer holds it alone, both between the
+    threads of this process and between processes. With prefer_writers,
+    new readers wait while a writer is waiting so a stream of readers can
+    not starve writers.
+
+    acquire(), release() and the context manager take the exclusive
+    (writer) lock, use read_lock() for shared access.
 
     Arguments:
         path (str): path to the lockfile for the lock
+        prefer_writers (bool): readers wait for waiting writers
     """
-    def __init__(self, path):
-        self.path = path
-        self.plock = InterProcessLock(self.path)
-        self.tlock = Lock()
+    def __init__(self, path, prefer_writers=True):
+        self.path = abspath(path)
+        self.prefer_writers = prefer_writers
+        self._state = _shared_state(self.path, prefer_writers)
 
-    def acquire(self, blocking=True):
-        """ Acquire lock, locks thread and process lock.
+    def _create_files(self):
+        # Create lock files if they don't exist and set permissions for
+        # all users to lock/unlock
+        for path in (self.path, self.path + ".gate"):
+            if not exists(path):
+                f = open(path, 'w+')
+                f.close()
+                chmod(path, 0o777)
+
+    # shared
+    def acquire_read(self, blocking=True):
+        """ Acquire a shared lock, other readers may hold it too.
 
         Arguments:
             blocking(bool): Set's blocking mode of acquire operation.
@@ -38,32 +113,118 @@ class ComboLock:
 
         Returns: True if lock succeeded otherwise False
         """
-        # Create lock file if it doesn't exist and set permissions for
-        # all users to lock/unlock
-        if not exists(self.path):
-            f = open(self.path, 'w+')
-            f.close()
-            chmod(self.path, 0o777)
-        if not blocking:
-            # Lock thread
-            tlocked = self.tlock.acquire(blocking=False)
-            if not tlocked:
+        self._create_files()
+        state = self._state
+        with state.cond:
+            while state.writer or \
+                    self.prefer_writers and state.waiting_writers:
+                if not blocking:
+                    return False
+                state.cond.wait()
+            state.readers += 1
+        # the first reading thread takes the process lock for all of them
+        with state.plock_mutex:
+            if state.plock_readers == 0 and \
+                    not self._acquire_process_read(blocking):
+                self._release_thread_read()
                 return False
-            # Lock process
-            plocked = self.plock.acquire(blocking=False)
-            if not plocked:
-                # Release thread lock if process couldn't be locked
-                self.tlock.release()
+            state.plock_readers += 1
+        return True
+
+    def _acquire_process_read(self, blocking):
+        state = self._state
+        if self.prefer_writers:
+            # wait behind writers of other processes
+            if not state.gate.acquire_read_lock(blocking=blocking):
                 return False
-        else:  # blocking, just wait and acquire ALL THE LOCKS!!!
-            self.tlock.acquire()
-            self.plock.acquire()
+            try:
+                return state.plock.acquire_read_lock(blocking=blocking)
+            finally:
+                state.gate.release_read_lock()
+        return state.plock.acquire_read_lock(blocking=blocking)
+
+    def release_read(self):
+        """ Release a shared lock. """
+        state = self._state
+        with state.plock_mutex:
+            state.plock_readers -= 1
+            if state.plock_readers == 0:
+                state.plock.release_read_lock()
+        self._release_thread_read()
+
+    def _release_thread_read(self):
+        state = self._state
+        with state.cond:
+            state.readers -= 1
+            if state.readers == 0:
+                state.cond.notify_all()
+
+    @contextmanager
+    def read_lock(self):
+        """ Context manager holding the shared lock. """
+        self.acquire_read()
+        try:
+            yield self
+        finally:
+            self.release_read()
+
+    # exclusive
+    def acquire(self, blocking=True):
+        """ Acquire the exclusive lock, locks thread and process lock.
+
+        Arguments:
+            blocking(bool): Set's blocking mode of acquire operation.
+                            Default True.
+
+        Returns: True if lock succeeded otherwise False
+        """
+        self._create_files()
+        state = self._state
+        with state.cond:
+            state.waiting_writers += 1
+            try:
+                while state.writer or state.readers:
+                    if not blocking:
+                        return False
+                    state.cond.wait()
+            finally:
+                state.waiting_writers -= 1
+                if not state.writer:
+                    # readers held back by this writer may go on
+                    state.cond.notify_all()
+            state.writer = True
+        if not self._acquire_process_write(blocking):
+            # Release thread lock if process couldn't be locked
+            self._release_thread_write()
+            return False
         return True
 
+    def _acquire_process_write(self, blocking):
+        state = self._state
+        if not self.prefer_writers:
+            return state.plock.acquire_write_lock(blocking=blocking)
+        # keep new readers of other processes out while waiting
+        if not state.gate.acquire_write_lock(blocking=blocking):
+            return False
+        try:
+            return state.plock.acquire_write_lock(blocking=blocking)
+        finally:
+            state.gate.release_write_lock()
+
     def release(self):
-        """ Release acquired lock. """
-        self.plock.release()
-        self.tlock.release()
+        """ Release the exclusive lock. """
+        self._state.plock.release_write_lock()
+        self._release_thread_write()
+
+    def _release_thread_write(self):
+        state = self._state
+        with state.cond:
+            state.writer = False
+            state.cond.notify_all()
+
+    def write_lock(self):
+        """ Context manager holding the exclusive lock. """
+        return self
 
     def __enter__(self):
         """ Context handler, acquires lock in blocking mode. """
@@ -99,6 +260,19 @@ class DummyLock:
         """ Release acquired lock. """
         pass
 
+    def acquire_read(self, blocking=True):
+        return True
+
+    def release_read(self):
+        pass
+
+    @contextmanager
+    def read_lock(self):
+        yield self
+
+    def write_lock(self):
+        return self
+
     def __enter__(self):
         """ Context handler, acquires lock in blocking mode. """
         return self
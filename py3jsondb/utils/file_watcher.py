@@ -0,0 +1,144 @@
+""" detect changes made to files by other processes
+
+StatWatcher compares size, mtime and inode of the files with the values
+recorded by mark(), InotifyWatcher (linux only) listens to inotify events
+on the parent folders instead so checking for changes costs no syscall
+besides a non blocking read
+"""
+from os.path import abspath, basename, dirname
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+
+LOG = logging.getLogger("JsonDatabase")
+
+
+class StatWatcher:
+    """ Detect changes of files by comparing their stat results
+
+    Arguments:
+        paths (str): files to watch, they do not need to exist
+    """
+    def __init__(self, *paths):
+        self.paths = [abspath(p) for p in paths]
+        self._ids = None
+
+    @staticmethod
+    def _file_id(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _current(self):
+        return [self._file_id(p) for p in self.paths]
+
+    def mark(self):
+        """ Record the current state of the files as known """
+        self._ids = self._current()
+
+    def changed(self):
+        """ Returns: True if a file changed since the last mark() """
+        return self._ids is None or self._current() != self._ids
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(StatWatcher):
+    """ Detect changes of files with inotify, linux only
+
+    The parent folders are watched because saves replace files by renaming
+    a temporary file over them.
+
+    Arguments:
+        paths (str): files to watch, they do not need to exist
+    """
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+        IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, *paths):
+        self._fd = None
+        super().__init__(*paths)
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                           use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._fd = fd
+        self._names = {}
+        for folder in set(dirname(p) for p in self.paths):
+            wd = libc.inotify_add_watch(self._fd, folder.encode(), self.MASK)
+            if wd < 0:
+                self.close()
+                raise OSError(ctypes.get_errno(),
+                              "inotify_add_watch failed for " + folder)
+            self._names[wd] = set(basename(p).encode() for p in self.paths
+                                  if dirname(p) == folder)
+        self._changed = True
+
+    def _drain(self):
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, size = self.EVENT.unpack_from(data, pos)
+                pos += self.EVENT.size
+                name = data[pos:pos + size].rstrip(b"\0")
+                pos += size
+                if mask & self.IN_Q_OVERFLOW or \
+                        name in self._names.get(wd, ()):
+                    self._changed = True
+
+    def mark(self):
+        self._drain()
+        self._changed = False
+
+    def changed(self):
+        self._drain()
+        return self._changed
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __del__(self):
+        self.close()
+
+
+def get_watcher(*paths, inotify=False):
+    """ Get a watcher for files
+
+    Arguments:
+        paths (str): files to watch
+        inotify (bool): use inotify when available, else compare stat
+                        results
+
+    Returns:
+        StatWatcher or InotifyWatcher
+    """
+    if inotify:
+        try:
+            return InotifyWatcher(*paths)
+        except (OSError, AttributeError) as e:
+            LOG.debug("inotify not available, watching files with stat: "
+                      "{}".format(repr(e)))
+    return StatWatcher(*paths)
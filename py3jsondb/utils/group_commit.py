@@ -0,0 +1,128 @@
+""" group commit, concurrent saves served by a single write
+
+GroupCommitWriter makes the writes of a database in a background thread,
+the saves requested while a write is running, or within window seconds
+after the first request, are all served by the next write, so writers
+calling save() at the same time share one file rewrite instead of taking
+the lock and rewriting the file in turn
+
+the writers that were not closed make their pending writes when the
+interpreter exits
+"""
+from threading import Condition, Thread
+from weakref import WeakSet
+import atexit
+import logging
+import time
+
+LOG = logging.getLogger("JsonDatabase")
+
+# writers that were not closed yet
+_OPEN_WRITERS = WeakSet()
+
+
+@atexit.register
+def _close_writers():
+    # the threads are daemons, they would be killed with their writes
+    for writer in list(_OPEN_WRITERS):
+        writer.close()
+
+
+class GroupCommitWriter:
+    """ Write in a background thread, one write per batch of requests
+
+    Arguments:
+        write (callable): makes the write, called with force=True if one of
+                          the requests of the batch asked for it
+        window (float): seconds to wait for more requests before writing
+    """
+    # failed batches remembered for the requests waiting on them
+    MAX_FAILURES = 16
+
+    def __init__(self, write, window=0.002):
+        self._write = write
+        self.window = window
+        self._cond = Condition()
+        # sequence number of the last request and of the last one written
+        self._requested = 0
+        self._written = 0
+        self._force = False
+        # (first request, last request, exception) of the failed writes
+        self._failures = []
+        self._thread = None
+        self._closed = False
+        # number of writes made
+        self.writes = 0
+        _OPEN_WRITERS.add(self)
+
+    def request(self, force=False):
+        """ ask for a write including every change made so far
+
+        Returns:
+            int: the ticket to wait() for
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("writer is closed")
+            self._requested += 1
+            self._force = self._force or force
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+            return self._requested
+
+    def wait(self, ticket=None):
+        """ block until the write serving a request is done
+
+        Arguments:
+            ticket (int): returned by request(), default is the last request
+
+        Raises:
+            the exception of the write if it failed
+        """
+        with self._cond:
+            if ticket is None:
+                ticket = self._requested
+            while self._written < ticket:
+                self._cond.wait()
+            for first, last, exc in self._failures:
+                if first <= ticket <= last:
+                    raise exc
+
+    def close(self):
+        """ make the pending writes and stop the thread """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        _OPEN_WRITERS.discard(self)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._requested == self._written and not self._closed:
+                    self._cond.wait()
+                if self._requested == self._written:
+                    return
+            if self.window:
+                # let the other writers of this moment join the batch
+                time.sleep(self.window)
+            with self._cond:
+                first, last = self._written + 1, self._requested
+                force, self._force = self._force, False
+            try:
+                self._write(force=force)
+                exc = None
+            except Exception as e:
+                LOG.error("Group commit of requests {}-{} failed: "
+                          "{}".format(first, last, e))
+                exc = e
+            with self._cond:
+                self._written = last
+                self.writes += 1
+                if exc is not None:
+                    self._failures.append((first, last, exc))
+                    del self._failures[:-self.MAX_FAILURES]
+                self._cond.notify_all()
@@ -0,0 +1,271 @@
+""" json serializer backends and binary codecs
+
+json backends share one interface, dumps returns utf-8 encoded bytes and
+loads accepts bytes or str, the stdlib json is used unless a faster
+library is requested by name:
+
+    orjson, msgspec, ujson, json (stdlib, always available, the default)
+
+binary codecs are not json, they are meant for internal caches only:
+
+    msgpack > marshal (stdlib, always available), pickle
+
+NOTE: the fast backends do not cover every corner of the stdlib, orjson and
+      msgspec decode integers above 64 bits as floats and encode NaN and
+      Infinity as null, keep the default if your data needs those
+"""
+from io import TextIOWrapper, UnsupportedOperation
+import json
+import marshal
+import mmap
+import pickle
+
+
+class JsonSerializer:
+    """ stdlib json, the fallback of every other backend """
+    name = "json"
+
+    def dumps(self, obj, pretty=True):
+        """ serialize obj to utf-8 encoded json
+
+        Args:
+            obj: json compatible python object
+            pretty (bool): indent the output, else use a compact format
+
+        Returns:
+            bytes: the encoded json
+        """
+        if pretty:
+            return json.dumps(obj, indent=4, ensure_ascii=False).encode("utf-8")
+        return json.dumps(obj, separators=(",", ":"),
+                          ensure_ascii=False).encode("utf-8")
+
+    def dump(self, obj, f, pretty=True):
+        """ serialize obj into a binary file """
+        f.write(self.dumps(obj, pretty))
+
+    def loads(self, data):
+        """ decode json from bytes, bytearray or str """
+        return json.loads(data)
+
+    def load(self, f):
+        """ decode json from a binary file """
+        return self.loads(f.read())
+
+
+class StdlibJsonSerializer(JsonSerializer):
+    def dump(self, obj, f, pretty=True):
+        # stream into the file instead of building the whole string
+        text = TextIOWrapper(f, encoding="utf-8")
+        if pretty:
+            json.dump(obj, text, indent=4, ensure_ascii=False)
+        else:
+            json.dump(obj, text, separators=(",", ":"), ensure_ascii=False)
+        text.flush()
+        text.detach()
+
+
+_STDLIB = StdlibJsonSerializer()
+
+
+class OrjsonSerializer(JsonSerializer):
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+        self._options = orjson.OPT_NON_STR_KEYS
+        # orjson only supports 2 spaces indentation
+        self._pretty_options = self._options | orjson.OPT_INDENT_2
+
+    def dumps(self, obj, pretty=True):
+        try:
+            return self._orjson.dumps(
+                obj, option=self._pretty_options if pretty else self._options)
+        except TypeError:
+            # objects orjson can not encode, eg. integers above 64 bits
+            return _STDLIB.dumps(obj, pretty)
+
+    def loads(self, data):
+        try:
+            return self._orjson.loads(data)
+        except ValueError:
+            # NaN and Infinity are accepted by the stdlib
+            if isinstance(data, memoryview):
+                data = bytes(data)
+            return _STDLIB.loads(data)
+
+    def load(self, f):
+        # orjson decodes straight from the memory mapped file, the file
+        # contents are never copied into a bytes object
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError, UnsupportedOperation):
+            return super().load(f)
+        with mm:
+            with memoryview(mm) as view:
+                return self.loads(view)
+
+
+class MsgspecSerializer(JsonSerializer):
+    name = "msgspec"
+
+    def __init__(self):
+        import msgspec
+        self._msgspec = msgspec
+        self._encoder = msgspec.json.Encoder()
+        self._decoder = msgspec.json.Decoder()
+
+    def dumps(self, obj, pretty=True):
+        try:
+            data = self._encoder.encode(obj)
+        except (TypeError, OverflowError):
+            return _STDLIB.dumps(obj, pretty)
+        if pretty:
+            return self._msgspec.json.format(data, indent=4)
+        return data
+
+    def loads(self, data):
+        try:
+            return self._decoder.decode(data)
+        except self._msgspec.DecodeError:
+            return _STDLIB.loads(data)
+
+
+class UjsonSerializer(JsonSerializer):
+    name = "ujson"
+
+    def __init__(self):
+        import ujson
+        self._ujson = ujson
+
+    def dumps(self, obj, pretty=True):
+        try:
+            return self._ujson.dumps(obj, indent=4 if pretty else 0,
+                                     ensure_ascii=False).encode("utf-8")
+        except (TypeError, OverflowError):
+            return _STDLIB.dumps(obj, pretty)
+
+    def loads(self, data):
+        if not isinstance(data, (bytes, str)):
+            data = bytes(data)  # ujson does not accept other buffers
+        try:
+            return self._ujson.loads(data)
+        except ValueError:
+            return _STDLIB.loads(data)
+
+
+class MarshalCodec:
+    """ stdlib marshal, fast but tied to the python version """
+    name = "marshal"
+
+    def dumps(self, obj):
+        return marshal.dumps(obj)
+
+    def loads(self, data):
+        return marshal.loads(data)
+
+
+class PickleCodec:
+    name = "pickle"
+
+    def dumps(self, obj):
+        return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class MsgpackCodec:
+    name = "msgpack"
+
+    def __init__(self):
+        import msgpack
+        self._msgpack = msgpack
+
+    def dumps(self, obj):
+        return self._msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data):
+        return self._msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+SERIALIZERS = {
+    "orjson": OrjsonSerializer,
+    "msgspec": MsgspecSerializer,
+    "ujson": UjsonSerializer,
+    "json": StdlibJsonSerializer
+}
+
+CODECS = {
+    "msgpack": MsgpackCodec,
+    "marshal": MarshalCodec,
+    "pickle": PickleCodec
+}
+
+_instances = {}
+
+
+def _get(registry, name):
+    if isinstance(name, str):
+        candidates = [name]
+        if name not in registry:
+            raise ValueError("unknown backend {}, must be one of {}".format(
+                name, ", ".join(registry)))
+    elif name is None:
+        candidates = list(registry)
+    else:
+        return name  # already a serializer instance
+    for candidate in candidates:
+        if candidate not in _instances:
+            try:
+                _instances[candidate] = registry[candidate]()
+            except ImportError:
+                if len(candidates) == 1:
+                    raise
+                continue
+        return _instances[candidate]
+
+
+def get_serializer(name=None):
+    """ get a json serializer
+
+    Args:
+        name (str): orjson, msgspec, ujson or json, None is the stdlib json,
+                    the other backends change how some values are stored
+
+    Returns:
+        JsonSerializer: the serializer
+    """
+    return _get(SERIALIZERS, "json" if name is None else name)
+
+
+def get_codec(name=None):
+    """ get a binary codec for internal caches
+
+    Args:
+        name (str): msgpack, marshal or pickle, None picks the fastest
+                    installed codec
+
+    Returns:
+        the codec, an object with dumps and loads methods
+    """
+    return _get(CODECS, name)
+
+
+def available_serializers():
+    """ names of the json backends that are installed """
+    return [name for name in SERIALIZERS if _installed(SERIALIZERS, name)]
+
+
+def available_codecs():
+    """ names of the binary codecs that are installed """
+    return [name for name in CODECS if _installed(CODECS, name)]
+
+
+def _installed(registry, name):
+    try:
+        _get(registry, name)
+        return True
+    except ImportError:
+        return False
@@ -0,0 +1,80 @@
+""" binary snapshots of parsed json files
+
+a snapshot is the decoded python object of a json file encoded with a
+binary codec, it is stored next to the json file (<path>.cache) and only
+used while the json file keeps the size, mtime and inode it had when the
+snapshot was taken, the json file is always the source of truth
+"""
+from os import stat
+import logging
+import struct
+
+from py3jsondb.utils.serializers import get_codec
+from py3jsondb.utils.atomic_write import atomic_write
+
+LOG = logging.getLogger("JsonDatabase")
+
+MAGIC = b"PY3JSONDB-SNAPSHOT1"
+HEADER = struct.Struct("<QQQB")
+
+
+def snapshot_path(path):
+    return path + ".cache"
+
+
+def _source_id(path=None, st=None):
+    st = st or stat(path)
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+def read_snapshot(path):
+    """ Loads the snapshot of a json file
+
+    Args:
+        path (str): the json file
+
+    Returns:
+        obj: the decoded python object, None if there is no valid snapshot
+    """
+    try:
+        with open(snapshot_path(path), "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            size, mtime, ino, name_len = HEADER.unpack(f.read(HEADER.size))
+            if (size, mtime, ino) != _source_id(path):
+                return None
+            codec = get_codec(f.read(name_len).decode("utf-8"))
+            return codec.loads(f.read())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # wrong python version for marshal, codec not installed...
+        LOG.debug("Ignoring snapshot of '{}': {}".format(path, repr(e)))
+        return None
+
+
+def write_snapshot(path, data, codec=None, source_stat=None):
+    """ Stores the snapshot of a json file
+
+    Args:
+        path (str): the json file data was decoded from
+        data: the decoded python object
+        codec (str): binary codec, see get_codec
+        source_stat (os.stat_result): fstat of the file descriptor data was
+                                      read from, taken before reading, path
+                                      may have been replaced since
+    """
+    codec = get_codec(codec)
+    try:
+        source_id = _source_id(path, source_stat)
+        payload = codec.dumps(data)
+        name = codec.name.encode("utf-8")
+        with atomic_write(snapshot_path(path), mode="wb") as f:
+            f.write(MAGIC)
+            f.write(HEADER.pack(*source_id, len(name)))
+            f.write(name)
+            f.write(payload)
+    except Exception as e:
+        # read only folder, data the codec can not encode...
+        LOG.debug("Could not write snapshot of '{}': {}".format(path,
+                                                               repr(e)))
@@ -11,5 +11,5 @@ setup(
     license='MIT',
     author='jarbasAI,Alex',
     author_email='',
-    install_requires=["pyxdg", "fasteners"],
+    install_requires=["pyxdg", "fasteners>=0.16"],
 )
@@ -0,0 +1,49 @@
+import asyncio
+import threading
+
+import pytest
+
+from py3jsondb.aio import AsyncJsonDatabase
+
+
+def test_cancelled_call_keeps_the_lock(tmp_path):
+    # created outside of the event loop running it
+    db = AsyncJsonDatabase("t", str(tmp_path / "db.json"))
+    started = threading.Event()
+    release = threading.Event()
+    running = []
+
+    def slow(obj):
+        running.append(True)
+        started.set()
+        release.wait(5)
+        running.pop()
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(db._run(slow))
+        await loop.run_in_executor(None, started.wait)
+        task.cancel()
+        second = asyncio.ensure_future(db._run(lambda obj: len(running)))
+        await asyncio.sleep(0.05)
+        assert not second.done()
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert await second == 0
+
+    asyncio.run(main())
+
+
+def test_save_forwards_wait(tmp_path):
+    path = str(tmp_path / "db.json")
+    db = AsyncJsonDatabase("t", path, group_commit=True)
+
+    async def main():
+        await db.add_entry({"a": 1})
+        await db.save(wait=False)
+        await db.flush()
+
+    asyncio.run(main())
+    assert db.db._writer.writes == 1
+    assert not db.db.is_dirty
@@ -0,0 +1,51 @@
+from os import stat
+
+from py3jsondb import JsonDatabase
+
+
+def test_changes_are_recorded_until_saved(tmp_path):
+    db = JsonDatabase("t", str(tmp_path / "db.json"))
+    db.save(force=True)
+    assert not db.is_dirty
+    db.add_entry({"a": 1})
+    assert db.changes() == [{"op": "append", "path": ["t"],
+                             "value": {"a": 1}}]
+    db.save()
+    assert not db.is_dirty and db.changes() == []
+
+
+def test_clean_save_does_not_write(tmp_path):
+    db = JsonDatabase("t", str(tmp_path / "db.json"))
+    db.add_entry({"a": 1})
+    db.save()
+    before = stat(db.path)
+    db.save()
+    after = stat(db.path)
+    assert (before.st_ino, before.st_mtime_ns) == \
+        (after.st_ino, after.st_mtime_ns)
+
+
+def test_save_stores_entries_modified_in_place(tmp_path):
+    db = JsonDatabase("t", str(tmp_path / "db.json"))
+    db.add_entry({"name": "a"})
+    db.save()
+    e = db[0]
+    e["name"] = "b"
+    db.save()
+    assert JsonDatabase("t", db.path)[0]["name"] == "b"
+
+
+def test_split_save_stores_entries_modified_in_place(tmp_path):
+    for table_format in ("json", "jsonl"):
+        path = str(tmp_path / "{}.db".format(table_format))
+        db = JsonDatabase("t", path, split_tables=True,
+                          table_format=table_format)
+        db.add_entry({"name": "a"})
+        db.save()
+        db = JsonDatabase("t", path, split_tables=True,
+                          table_format=table_format)
+        db[0]["name"] = "b"
+        db.save()
+        db = JsonDatabase("t", path, split_tables=True,
+                          table_format=table_format)
+        assert db[0]["name"] == "b"
@@ -0,0 +1,48 @@
+from os import listdir
+
+import pytest
+
+from py3jsondb import JsonDatabase, JsonStorage
+from py3jsondb.utils.atomic_write import DURABILITY_LEVELS
+
+
+class _FailingSerializer:
+    """ writes half of the output then fails, like a crash mid-write """
+
+    def __init__(self, serializer):
+        self._serializer = serializer
+
+    def __getattr__(self, name):
+        return getattr(self._serializer, name)
+
+    def dump(self, obj, f, pretty=True):
+        data = self._serializer.dumps(obj, pretty)
+        f.write(data[:len(data) // 2])
+        raise OSError("disk full")
+
+
+@pytest.mark.parametrize("durability", DURABILITY_LEVELS)
+def test_levels_store(tmp_path, durability):
+    path = str(tmp_path / "db.json")
+    db = JsonDatabase("t", path, durability=durability)
+    db.add_entry({"a": 1})
+    db.save()
+    assert list(JsonDatabase("t", path)) == [{"a": 1}]
+
+
+def test_unknown_level(tmp_path):
+    with pytest.raises(ValueError):
+        JsonStorage(str(tmp_path / "db.json"), durability="always")
+
+
+def test_failed_write_keeps_previous_file(tmp_path):
+    path = str(tmp_path / "db.json")
+    s = JsonStorage(path)
+    s["a"] = 1
+    s.store()
+    s["a"] = 2
+    s.serializer = _FailingSerializer(s.serializer)
+    with pytest.raises(OSError):
+        s.store()
+    assert dict(JsonStorage(path)) == {"a": 1}
+    assert sorted(listdir(str(tmp_path))) == ["db.json"]
@@ -0,0 +1,81 @@
+import random
+
+from py3jsondb import JsonDatabase
+from py3jsondb.indexes import FuzzyIndex, FuzzyStrings
+from py3jsondb.search import Query
+from py3jsondb.utils import fuzzy_match
+
+rnd = random.Random(0)
+STRINGS = ["".join(rnd.choice("abcdeé ") for _ in range(rnd.randrange(9)))
+           for _ in range(400)]
+
+
+def test_candidates_keep_every_match():
+    strings = FuzzyStrings(STRINGS)
+    for value in STRINGS[:40] + ["", "abc", "zzz"]:
+        for thresh in (0.3, 0.6, 0.9):
+            candidates = set(strings.candidates(value, thresh))
+            for s in set(STRINGS):
+                if fuzzy_match(value, s) >= thresh:
+                    assert s in candidates
+    for s in STRINGS[::2]:
+        strings.discard(s)
+    assert set(strings) == set(STRINGS[1::2]) - set(STRINGS[::2])
+    assert set(strings.candidates("abc", 0.5)) <= set(strings)
+
+
+def test_fuzzy_index_matches_scan():
+    table = [{"name": s} for s in STRINGS] + [{"name": 1}, {}]
+    index = FuzzyIndex("name")
+    index.build(table)
+    for value in ("abc", "deed", "a"):
+        for thresh in (0.5, 0.8):
+            expected = [(pos, fuzzy_match(value, e["name"]))
+                        for pos, e in enumerate(table)
+                        if isinstance(e.get("name"), str) and
+                        fuzzy_match(value, e["name"]) >= thresh]
+            assert sorted(index.search(value, thresh)) == expected
+
+
+def test_fuzzy_query_index_matches_scan(tmp_path):
+    indexed = JsonDatabase("t", str(tmp_path / "indexed.json"))
+    scanned = JsonDatabase("t", str(tmp_path / "scanned.json"))
+    for db in (indexed, scanned):
+        for i, s in enumerate(STRINGS):
+            db.add_entry({"id": i, "name": s}, allow_duplicates=True)
+    indexed.create_index("name", index_type="fuzzy")
+    for value in ("abc", "deed"):
+        for ignore_case in (False, True):
+            assert Query(indexed).contains_value(
+                "name", value, fuzzy=True, thresh=0.7,
+                ignore_case=ignore_case).build() == \
+                Query(scanned).contains_value(
+                    "name", value, fuzzy=True, thresh=0.7,
+                    ignore_case=ignore_case).build()
+
+
+def test_fuzzy_path_lookups_use_the_path_index(tmp_path):
+    indexed = JsonDatabase("t", str(tmp_path / "indexed.json"),
+                           path_index=True)
+    walked = JsonDatabase("t", str(tmp_path / "walked.json"))
+    for db in (indexed, walked):
+        for i, s in enumerate(STRINGS[:100]):
+            db.add_entry({"name": s, s.strip() or "x": {"tag": s[::-1]}},
+                         allow_duplicates=True)
+    for value in ("abc", "deed", "ba"):
+        for thresh in (0.6, 0.8):
+            assert indexed.get_path_by_key(value, True, thresh) == \
+                walked.get_path_by_key(value, True, thresh)
+            assert indexed.get_path_by_value(value, True, thresh) == \
+                walked.get_path_by_value(value, True, thresh)
+            assert indexed.search_by_key(value, True, thresh) == \
+                walked.search_by_key(value, True, thresh)
+            assert indexed.search_by_value("tag", value, True, thresh) == \
+                walked.search_by_value("tag", value, True, thresh)
+    assert indexed._path_index._fuzzy_values is not None
+    # the candidates follow the changes
+    for db in (indexed, walked):
+        db.update_entry(0, {"name": "abcabc"})
+        db.remove_entry(1)
+    assert indexed.get_path_by_value("abcab", True, 0.8) == \
+        walked.get_path_by_value("abcab", True, 0.8) == [["t", 0, "name"]]
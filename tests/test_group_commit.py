@@ -0,0 +1,113 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from py3jsondb import JsonDatabase
+
+
+class _HookedSerializer:
+    """ runs a callback once, right after the first dump """
+
+    def __init__(self, serializer, hook):
+        self._serializer = serializer
+        self._hook = hook
+
+    def __getattr__(self, name):
+        return getattr(self._serializer, name)
+
+    def dump(self, obj, f, pretty=True):
+        self._serializer.dump(obj, f, pretty)
+        hook, self._hook = self._hook, None
+        if hook is not None:
+            hook()
+
+
+def test_change_logged_during_group_write_is_kept(tmp_path):
+    path = str(tmp_path / "db.json")
+    db = JsonDatabase("t", path, group_commit=True)
+    db.add_entry({"a": 1})
+    # another thread adds an entry while the background write is running
+    db.db.serializer = _HookedSerializer(db.db.serializer,
+                                         lambda: db.add_entry({"b": 2}))
+    db.save()
+    assert db.is_dirty
+    assert db.changes() == [{"op": "append", "path": ["t"],
+                             "value": {"b": 2}}]
+    db.save()
+    assert not db.is_dirty
+    assert list(JsonDatabase("t", path)) == [{"a": 1}, {"b": 2}]
+
+
+def test_change_logged_during_wal_snapshot_is_not_replayed_twice(tmp_path):
+    path = str(tmp_path / "db.json")
+    db = JsonDatabase("t", path, wal=True, group_commit=True)
+    db.add_entry({"a": 1})
+    db.db.serializer = _HookedSerializer(db.db.serializer,
+                                         lambda: db.add_entry({"b": 2}))
+    db.save(force=True)
+    db.save()
+    db.add_entry({"c": 3})
+    db.save()
+    assert list(JsonDatabase("t", path, wal=True)) == \
+        [{"a": 1}, {"b": 2}, {"c": 3}]
+
+
+def test_concurrent_saves(tmp_path):
+    path = str(tmp_path / "db.json")
+    db = JsonDatabase("t", path, group_commit=True)
+    mutex = threading.Lock()
+
+    def writer(n):
+        for i in range(25):
+            with mutex:
+                db.add_entry({"writer": n, "i": i})
+            db.save()
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not db.is_dirty
+    assert db._writer.writes < 8 * 25
+    assert len(JsonDatabase("t", path)) == 8 * 25
+
+
+def test_write_error_is_raised_by_save(tmp_path):
+    db = JsonDatabase("t", str(tmp_path / "db.json"), group_commit=True)
+    db.add_entry({"a": 1})
+    db.path = str(tmp_path / "\0db.json")
+    with pytest.raises(ValueError):
+        db.save()
+
+
+def test_close_writes_pending_saves_and_stops_the_writer(tmp_path):
+    path = str(tmp_path / "db.json")
+    db = JsonDatabase("t", path, group_commit=True, commit_window=0.05)
+    db.add_entry({"a": 1})
+    db.save(wait=False)
+    db.close()
+    assert not db._writer._thread.is_alive()
+    assert list(JsonDatabase("t", path)) == [{"a": 1}]
+    with pytest.raises(RuntimeError):
+        db.save()
+    with JsonDatabase("t", path, group_commit=True) as db:
+        db.add_entry({"b": 2})
+    assert not db._writer._thread.is_alive()
+    assert list(JsonDatabase("t", path)) == [{"a": 1}, {"b": 2}]
+
+
+def test_open_writers_are_flushed_at_exit(tmp_path):
+    script = (
+        "from py3jsondb import JsonDatabase\n"
+        "db = JsonDatabase('t', {!r}, group_commit=True, "
+        "commit_window=0.2)\n"
+        "db.add_entry({{'a': 1}})\n"
+        "db.save(wait=False)\n").format(str(tmp_path / "db.json"))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", script], check=True,
+                   cwd=str(tmp_path), env=dict(os.environ, PYTHONPATH=root))
+    assert list(JsonDatabase("t", str(tmp_path / "db.json"))) == [{"a": 1}]
@@ -0,0 +1,65 @@
+import random
+
+from py3jsondb import JsonDatabase
+from py3jsondb.indexes import FieldIndex, OrderedIndex, TokenIndex
+
+
+def _lookups(index, table):
+    if isinstance(index, TokenIndex):
+        return {token: index.positions(token)
+                for token in ("a", "b", "c", "d")}
+    found = {value: index.find(value) for value in range(5)}
+    if isinstance(index, OrderedIndex):
+        found["range"] = index.range(1, 3, include_low=True)
+        found["sorted"] = index.sorted_positions()
+    return found
+
+
+def test_index_follows_deletes():
+    rnd = random.Random(0)
+    for factory in (lambda: FieldIndex("v"), lambda: OrderedIndex("v"),
+                    lambda: TokenIndex("t")):
+        table = []
+        index = factory()
+        index.build(table)
+        for _ in range(2000):
+            op = rnd.random()
+            if op < 0.4 or not table:
+                v = rnd.randrange(5)
+                table.append({"v": v, "t": "a b" if v % 2 else "c d"})
+                index.append(table[-1])
+            elif op < 0.8:
+                pos = rnd.randrange(len(table))
+                del table[pos]
+                index.delete(pos)
+            else:
+                pos = rnd.randrange(len(table))
+                table[pos] = {"v": rnd.randrange(5), "t": "b c"}
+                index.replace(pos, table[pos])
+            assert index.size == len(table)
+            if rnd.random() < 0.1:
+                fresh = factory()
+                fresh.build(table)
+                assert _lookups(index, table) == _lookups(fresh, table)
+
+
+def test_bulk_delete_is_not_quadratic():
+    table = [{"v": i} for i in range(100000)]
+    index = FieldIndex("v")
+    index.build(table)
+    for pos in range(len(table) - 1, 0, -2):
+        del table[pos]
+        index.delete(pos)
+    assert index.find(99998) == [49999]
+    assert index.find(99999) == []
+
+
+def test_membership_after_in_place_edit(tmp_path):
+    db = JsonDatabase("t", str(tmp_path / "db.json"))
+    db.add_entry({"name": "a"})
+    assert {"name": "a"} in db
+    db[0]["name"] = "b"
+    assert {"name": "b"} in db
+    assert {"name": "a"} not in db
+    assert db.add_entry({"name": "b"}) == 0
+    assert len(db) == 1
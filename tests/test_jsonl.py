@@ -0,0 +1,52 @@
+import os
+
+from py3jsondb.jsonl import JsonlTable
+
+
+def test_append_keeps_lines_of_other_writers(tmp_path):
+    path = str(tmp_path / "t.jsonl")
+    JsonlTable.from_list(path, [{"i": 0}])
+    a = JsonlTable(path)
+    b = JsonlTable(path)
+    a.append({"i": 1})
+    a.flush()
+    b.append({"i": 2})
+    b.flush()
+    assert list(b) == [{"i": 0}, {"i": 1}, {"i": 2}]
+    assert list(JsonlTable(path)) == [{"i": 0}, {"i": 1}, {"i": 2}]
+
+
+def test_append_to_a_replaced_file(tmp_path):
+    path = str(tmp_path / "t.jsonl")
+    JsonlTable.from_list(path, [{"i": 0}, {"i": 1}])
+    a = JsonlTable(path)
+    JsonlTable.from_list(path, [{"j": 0}])
+    a.append({"j": 1})
+    a.flush()
+    assert list(JsonlTable(path)) == [{"j": 0}, {"j": 1}]
+
+
+def test_torn_line_is_dropped(tmp_path):
+    path = str(tmp_path / "t.jsonl")
+    JsonlTable.from_list(path, [{"i": 0}])
+    with open(path, "ab") as f:
+        f.write(b'{"i": ')
+    table = JsonlTable(path)
+    assert list(table) == [{"i": 0}]
+    table.append({"i": 1})
+    table.flush()
+    assert list(JsonlTable(path)) == [{"i": 0}, {"i": 1}]
+
+
+def test_index_of_a_replaced_file_is_not_used(tmp_path):
+    path = str(tmp_path / "t.jsonl")
+    JsonlTable.from_list(path, [{"i": 0}, {"i": 1}])
+    st = os.stat(path)
+    # one line of the same size and mtime
+    data = b'{"i": 12345678}\n'
+    assert len(data) == st.st_size
+    with open(path + ".new", "wb") as f:
+        f.write(data)
+    os.utime(path + ".new", ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.replace(path + ".new", path)
+    assert list(JsonlTable(path)) == [{"i": 12345678}]
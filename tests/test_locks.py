@@ -0,0 +1,48 @@
+import os
+from threading import Thread
+
+import pytest
+
+from py3jsondb import JsonDatabase
+from py3jsondb.utils.combo_lock import get_lock_path
+
+
+def test_lock_path_depends_on_the_absolute_path(tmp_path, monkeypatch):
+    a = tmp_path / "a" / "users.db"
+    b = tmp_path / "b" / "users.db"
+    assert get_lock_path(str(a)) != get_lock_path(str(b))
+    assert os.path.basename(get_lock_path(str(a))).startswith("users.db.")
+    monkeypatch.chdir(tmp_path / "..")
+    relative = os.path.join(tmp_path.name, "a", "users.db")
+    assert get_lock_path(relative) == get_lock_path(str(a))
+
+
+def test_every_table_has_its_own_lock(tmp_path):
+    path = str(tmp_path / "users.db")
+    assert get_lock_path(path, "t") == get_lock_path(path, "t")
+    assert len({get_lock_path(path), get_lock_path(path, "t"),
+                get_lock_path(path, "u")}) == 3
+    with pytest.raises(ValueError):
+        JsonDatabase("t", path, table_locks=True)
+    db = JsonDatabase("t", path, split_tables=True, table_locks=True)
+    assert db.db.table_lock("t") is db.db.table_lock("t")
+    assert db.db.table_lock("t") is not db.db.table_lock("u")
+    # without table_locks the tables share the database lock
+    shared = JsonDatabase("t", path, split_tables=True).db
+    assert shared.table_lock("t") is shared.lock
+
+
+def test_writers_of_other_tables_do_not_wait(tmp_path):
+    path = str(tmp_path / "users.db")
+    db = JsonDatabase("t", path, split_tables=True, table_locks=True)
+    db.add_table("u")
+    db.save()
+    other = JsonDatabase("u", path, split_tables=True, table_locks=True)
+    other.add_entry({"a": 1})
+    with db.db.table_lock("t"):
+        writer = Thread(target=other.save)
+        writer.start()
+        writer.join(5)
+        assert not writer.is_alive()
+    reader = JsonDatabase("u", path, split_tables=True)
+    assert list(reader) == [{"a": 1}]
@@ -0,0 +1,53 @@
+from py3jsondb import JsonDatabase
+
+KEYS = ["name", "children", "age", "tags", "city", 0, 1]
+VALUES = ["bob", "ana", 12, 30, "x", "porto", None, True]
+
+
+def _lookups(db):
+    found = {}
+    for key in KEYS:
+        found["key", key] = db.get_path_by_key(key)
+        for value in VALUES:
+            found["key_value", key, value] = \
+                db.get_path_by_key_value(key, value)
+    for value in VALUES:
+        found["value", value] = db.get_path_by_value(value)
+    found["fuzzy"] = db.get_path_by_value("bobby", fuzzy=True, thresh=0.5)
+    return found
+
+
+def test_path_index_matches_jsonpath_after_every_mutator(tmp_path):
+    indexed = JsonDatabase("t", str(tmp_path / "indexed.json"),
+                           path_index=True)
+    walked = JsonDatabase("t", str(tmp_path / "walked.json"))
+    steps = [
+        lambda db: db.add_entry({"name": "bob", "age": 12, "tags": ["x"]}),
+        lambda db: db.add_entry({"name": "ana", "age": 30,
+                                 "children": {"name": "bob"}}),
+        lambda db: db.add_entry({"name": "joe", "city": "porto"}),
+        lambda db: db.update_entry(0, {"name": "ana", "age": 30}),
+        lambda db: db.update_entry(1, {"city": "porto", "age": 12},
+                                   overwrite=False),
+        lambda db: db.add_child_to_entry(0, {"name": "bob", "tags": ["x"]}),
+        lambda db: db.update_child_of_entry(0, {"age": 12},
+                                            overwrite=False),
+        lambda db: db.update_child_of_entry(1, ["bob", "ana"]),
+        lambda db: db.update_value_by_path(["t", 2, "city"], "x"),
+        lambda db: db.update_value_by_path(["t", 0, "children", "name"],
+                                           "joe"),
+        lambda db: db.add_child_to_path(["t", 2, "city"], {"name": "ana"}),
+        lambda db: db.update_child_of_path(["t", 2, "city"], {"age": 30},
+                                           overwrite=False),
+        lambda db: db.delete_child_of_path(["t", 0, "name"]),
+        lambda db: db.delete_child_of_entry(1),
+        lambda db: db.remove_entry(0),
+        lambda db: db.add_table("u"),
+        lambda db: db.add_entry({"name": "bob", "tags": [True, None]}),
+        lambda db: db.delete_table("t"),
+    ]
+    for step in steps:
+        for db in (indexed, walked):
+            step(db)
+        assert _lookups(indexed) == _lookups(walked)
+    assert indexed._path_index._root is not None
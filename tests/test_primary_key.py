@@ -0,0 +1,37 @@
+from py3jsondb import JsonDatabase
+
+
+def test_removed_ids_are_not_reused_after_reopen(tmp_path):
+    path = str(tmp_path / "db.json")
+    db = JsonDatabase("t", path, primary_key="id")
+    for i in range(4):
+        assert db.add_entry({"n": i}) == i
+    db.remove_entry(2)
+    db.remove_entry(3)
+    db.save()
+    db = JsonDatabase("t", path, primary_key="id")
+    assert db.add_entry({"n": 4}) == 4
+    db.remove_entry(4)
+    db.save()
+    db = JsonDatabase("t", path, primary_key="id")
+    assert db.add_entry({"n": 5}) == 5
+    assert [e["id"] for e in db] == [0, 1, 5]
+
+
+def test_rebuild_keeps_the_high_water_mark(tmp_path):
+    db = JsonDatabase("t", str(tmp_path / "db.json"), primary_key="id")
+    for i in range(3):
+        db.add_entry({"n": i})
+    db.remove_entry(2)
+    db.reindex()
+    assert db.add_entry({"n": 3}) == 3
+
+
+def test_lookup_by_id(tmp_path):
+    db = JsonDatabase("t", str(tmp_path / "db.json"), primary_key="id")
+    for i in range(5):
+        db.add_entry({"n": i})
+    db.remove_entry(1)
+    assert db[3] == {"n": 3, "id": 3}
+    assert db.get_entry_by_id(4)["n"] == 4
+    assert len(db) == 4
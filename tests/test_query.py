@@ -0,0 +1,229 @@
+import random
+
+import pytest
+
+from py3jsondb import JsonDatabase
+from py3jsondb.search import Query
+
+NAMES = ["ana", "bob", "joe", "Bob", ""]
+
+
+def _entries(n=300, seed=0):
+    rnd = random.Random(seed)
+    entries = []
+    for i in range(n):
+        entry = {"id": i, "name": rnd.choice(NAMES), "age": rnd.randrange(40)}
+        if rnd.random() < 0.1:
+            del entry["age"]
+        entries.append(entry)
+    return entries
+
+
+def _databases(tmp_path, entries, indexes):
+    """ a database with the indexes and the same one without indexes """
+    indexed = JsonDatabase("t", str(tmp_path / "indexed.json"))
+    scanned = JsonDatabase("t", str(tmp_path / "scanned.json"))
+    for db in (indexed, scanned):
+        for entry in entries:
+            db.add_entry(entry, allow_duplicates=True)
+    for field, options in indexes.items():
+        indexed.create_index(field, **options)
+    return indexed, scanned
+
+
+def test_equal_index_matches_scan(tmp_path):
+    indexed, scanned = _databases(tmp_path, _entries(), {"name": {}})
+    for name in NAMES + ["nobody"]:
+        expected = Query(scanned).equal("name", name).build()
+        assert Query(indexed).equal("name", name).build() == expected
+        assert Query(indexed).equal("name", name).count() == len(expected)
+        assert Query(indexed).equal("name", name, ignore_case=True).build() \
+            == Query(scanned).equal("name", name, ignore_case=True).build()
+        assert indexed.get_entry_id_by_key_value("name", name) == \
+            scanned.get_entry_id_by_key_value("name", name)
+        assert indexed.match_entry({"name": name}, strictly=False) == \
+            scanned.match_entry({"name": name}, strictly=False)
+    assert Query(indexed).explain()["access"]["type"] == "scan"
+    assert Query(indexed).equal("name", "ana").explain()["access"]["type"] \
+        == "index"
+
+
+def test_equal_index_follows_changes(tmp_path):
+    indexed, scanned = _databases(tmp_path, _entries(50), {"name": {}})
+    for db in (indexed, scanned):
+        db.update_entry(3, {"name": "zoe"}, overwrite=False)
+        db.remove_entry(0)
+        db.add_entry({"name": "zoe", "age": 1})
+    assert Query(indexed).equal("name", "zoe").build() == \
+        Query(scanned).equal("name", "zoe").build()
+
+
+MIXED = [3, "b", 1.5, True, None, [1], "a", 0, "", float("nan"), {"x": 1}, 2,
+         False]
+
+
+def _ids(query):
+    try:
+        return [e["id"] for e in query]
+    except TypeError:
+        return TypeError
+
+
+def test_range_index_matches_scan(tmp_path):
+    indexed, scanned = _databases(tmp_path, _entries(),
+                                  {"age": {"index_type": "ordered"}})
+    for query in (lambda db: Query(db).above("age", 30),
+                  lambda db: Query(db).bellow_or_equal("age", 3),
+                  lambda db: Query(db).in_range("age", 5, 9),
+                  lambda db: Query(db).above_or_equal("age", 0.5),
+                  lambda db: Query(db).order_by("age"),
+                  lambda db: Query(db).order_by("age", reverse=True),
+                  lambda db: Query(db).above("age", 20).order_by("age")):
+        assert _ids(query(indexed)) == _ids(query(scanned))
+    assert Query(indexed).above("age", 30).explain()["access"]["method"] \
+        == "range"
+
+
+def test_range_index_with_mixed_types(tmp_path):
+    entries = [{"id": i, "age": v} for i, v in enumerate(MIXED)]
+    entries.append({"id": len(MIXED)})
+    indexed, scanned = _databases(tmp_path, entries,
+                                  {"age": {"index_type": "ordered"}})
+    for query in (lambda db: Query(db).above("age", 1),
+                  lambda db: Query(db).in_range("age", "a", "c"),
+                  lambda db: Query(db).order_by("age"),
+                  lambda db: Query(db).order_by("age", reverse=True)):
+        assert _ids(query(indexed)) == _ids(query(scanned))
+    # explain() would run the failing scan
+    assert Query(indexed).above("age", 1)._plan().access is None
+    assert Query(indexed).order_by("age").explain()["order"][0]["method"] \
+        == "index"
+    # once only numbers and falsy values are left the index is used again
+    for db in (indexed, scanned):
+        for entry_id in (10, 9, 6, 5, 1):
+            db.remove_entry(entry_id)
+    assert _ids(Query(indexed).above("age", 1)) == \
+        _ids(Query(scanned).above("age", 1)) == [0, 2, 11]
+    assert Query(indexed).above("age", 1).explain()["access"]["type"] == \
+        "index"
+
+
+WORDS = ["python", "Python", "rust", "go", "py", "thon", "c++", "data-base"]
+
+
+def _documents(n=200, seed=1):
+    rnd = random.Random(seed)
+    entries = []
+    for i in range(n):
+        words = rnd.sample(WORDS, rnd.randrange(4))
+        if i % 5 == 0:
+            bio = words
+        elif i % 7 == 0:
+            bio = {w: 1 for w in words}
+        else:
+            bio = " ".join(words)
+        entries.append({"id": i, "bio": bio})
+    return entries
+
+
+def test_token_index_matches_scan(tmp_path):
+    for options in ({}, {"ignore_case": False},
+                    {"tokenizer": "words", "ignore_case": False}):
+        options["index_type"] = "token"
+        path = tmp_path / options.get("tokenizer", "ws") / \
+            str(options.get("ignore_case"))
+        path.mkdir(parents=True)
+        indexed, scanned = _databases(path, _documents(), {"bio": options})
+        for word in WORDS + ["java", "pyt", "c"]:
+            for ignore_case in (False, True):
+                for query in (
+                        lambda db: Query(db).value_contains_token(
+                            "bio", word, ignore_case=ignore_case),
+                        lambda db: Query(db).value_contains(
+                            "bio", word, ignore_case=ignore_case)):
+                    assert _ids(query(indexed)) == _ids(query(scanned))
+    indexed, _ = _databases(tmp_path, _documents(),
+                            {"bio": {"index_type": "token"}})
+    plan = Query(indexed).value_contains_token("bio", "rust").explain()
+    assert plan["access"]["method"] == "tokens"
+
+
+def test_limit_and_offset_stop_the_scan(tmp_path):
+    db, _ = _databases(tmp_path, _entries(), {})
+    everything = Query(db).equal("name", "ana").build()
+    assert len(everything) > 20
+    query = Query(db).equal("name", "ana").offset(5).limit(10)
+    assert query.build() == everything[5:15]
+    plan = query.explain()
+    assert plan["actual_rows"] == 10
+    assert plan["scanned_rows"] < len(db)
+    assert Query(db).equal("name", "ana").first() == everything[0]
+    assert Query(db).equal("name", "ana").exists()
+    assert not Query(db).equal("name", "nobody").exists()
+    assert Query(db).equal("name", "ana").offset(len(everything) - 3) \
+        .limit(10).count() == 3
+    # sorting reads every entry, offset and limit apply to the sorted result
+    ordered = Query(db).above("age", 3).order_by("age").offset(2).limit(4)
+    assert ordered.build() == \
+        Query(db).above("age", 3).order_by("age").build()[2:6]
+
+
+def test_explain_picks_the_most_selective_index(tmp_path):
+    indexed, scanned = _databases(tmp_path, _entries(), {
+        "name": {}, "id": {}, "age": {"index_type": "ordered"}})
+    narrow_range = lambda db: Query(db).equal("name", "ana") \
+        .in_range("age", 5, 7)
+    one_id = lambda db: Query(db).above("age", 2).equal("id", 42)
+    for query, driver in ((narrow_range, "in_range('age', 5, 7)"),
+                          (one_id, "equal('id', 42)")):
+        plan = query(indexed).explain()
+        assert plan["access"]["type"] == "index"
+        assert plan["access"]["filter"] == driver
+        assert driver not in plan["residual_filters"]
+        assert plan["scanned_rows"] <= plan["access"]["estimated_rows"]
+        assert query(indexed).build() == query(scanned).build()
+    assert Query(scanned).equal("name", "ana").explain()["access"] == \
+        {"type": "scan", "estimated_rows": len(scanned)}
+
+
+def test_aggregations_match_python(tmp_path):
+    entries = _entries()
+    indexed, scanned = _databases(tmp_path, entries, {
+        "name": {}, "age": {"index_type": "ordered"}})
+    ages = [e["age"] for e in entries if "age" in e]
+    adults = [a for a in ages if a > 17]
+    for db in (indexed, scanned):
+        assert Query(db).count() == len(entries)
+        assert Query(db).sum("age") == sum(ages)
+        assert Query(db).min("age") == min(ages)
+        assert Query(db).max("age") == max(ages)
+        assert Query(db).above("age", 17).count() == len(adults)
+        assert Query(db).above("age", 17).avg("age") == \
+            pytest.approx(sum(adults) / len(adults))
+        assert Query(db).equal("name", "nobody").avg("age") is None
+        assert Query(db).distinct("name") == \
+            list(dict.fromkeys(e["name"] for e in entries))
+        assert Query(db).order_by("age").limit(5).sum("age") == \
+            sum(sorted(ages)[:5])
+
+
+def test_group_by_matches_python(tmp_path):
+    entries = _entries()
+    indexed, scanned = _databases(tmp_path, entries, {"name": {}})
+    expected = {}
+    for e in entries:
+        group = expected.setdefault(e["name"], {"name": e["name"], "n": 0,
+                                                "oldest": None})
+        group["n"] += 1
+        if "age" in e:
+            group["oldest"] = max(group["oldest"] or 0, e["age"])
+    for db in (indexed, scanned):
+        assert Query(db).group_by("name").agg(n="count") == \
+            [{"name": g["name"], "n": g["n"]} for g in expected.values()]
+        assert Query(db).group_by("name").agg(
+            n="count", oldest=("max", "age")) == list(expected.values())
+        young = Query(db).bellow("age", 10).group_by("name").agg(n="count")
+        assert sum(g["n"] for g in young) == \
+            len([e for e in entries if 0 < e.get("age", 0) < 10])
+    with pytest.raises(ValueError):
+        Query(scanned).group_by("name").agg(n="median")
@@ -0,0 +1,33 @@
+import pytest
+
+from py3jsondb import JsonDatabase
+
+
+@pytest.mark.parametrize("inotify", [False, True])
+def test_reads_and_own_saves_do_not_parse_again(tmp_path, inotify):
+    path = str(tmp_path / "db.json")
+    JsonDatabase("t", path).save(force=True)
+    db = JsonDatabase("t", path, inotify=inotify)
+    assert db.parse_count == 1
+    for _ in range(3):
+        db.get_tables()
+        list(db)
+    db.add_table("u")
+    db.add_entry({"a": 1})
+    db.save()
+    db.get_tables()
+    assert db.parse_count == 1
+
+
+@pytest.mark.parametrize("inotify", [False, True])
+def test_external_write_reloads_once(tmp_path, inotify):
+    path = str(tmp_path / "db.json")
+    JsonDatabase("t", path).save(force=True)
+    db = JsonDatabase("t", path, inotify=inotify)
+    other = JsonDatabase("t", path)
+    other.add_table("u")
+    other.save()
+    assert "u" in db.get_tables()
+    assert db.parse_count == 2
+    db.get_tables()
+    assert db.parse_count == 2
@@ -0,0 +1,57 @@
+import subprocess
+import sys
+from multiprocessing import resource_tracker
+from os.path import dirname
+
+import pytest
+
+from py3jsondb import JsonDatabase
+from py3jsondb.exceptions import ReadOnlyReplica
+
+# multiprocessing.shared_memory is missing on python 3.7
+shm_replica = pytest.importorskip("py3jsondb.replica")
+JsonReplica = shm_replica.JsonReplica
+ReplicaPublisher = shm_replica.ReplicaPublisher
+
+ROOT = dirname(dirname(__file__))
+READER = """
+import sys
+sys.path.insert(0, {root!r})
+from py3jsondb.replica import JsonReplica
+print(len(JsonReplica("t", {path!r})))
+"""
+
+
+@pytest.fixture
+def publisher(tmp_path):
+    db = JsonDatabase("t", str(tmp_path / "db.json"))
+    for i in range(10):
+        db.add_entry({"i": i})
+    with ReplicaPublisher(db) as pub:
+        pub.publish()
+        yield pub
+
+
+def test_readers_see_new_generations(publisher):
+    replica = JsonReplica("t", publisher.db.path)
+    assert len(replica) == 10 and replica[3] == {"i": 3}
+    assert not replica.refresh()
+    publisher.db.add_entry({"i": 10})
+    publisher.publish()
+    assert len(replica) == 10
+    assert replica.refresh()
+    assert replica[10] == {"i": 10}
+    with pytest.raises(ReadOnlyReplica):
+        replica.add_entry({"i": 11})
+
+
+def test_segments_outlive_reader_processes(publisher):
+    register = resource_tracker.register
+    code = READER.format(root=ROOT, path=publisher.db.path)
+    for _ in range(2):
+        out = subprocess.run([sys.executable, "-c", code],
+                             capture_output=True, text=True, check=True)
+        assert out.stdout.strip() == "10"
+        assert out.stderr == ""
+    assert resource_tracker.register is register
+    assert len(JsonReplica("t", publisher.db.path)) == 10
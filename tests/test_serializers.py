@@ -0,0 +1,19 @@
+import math
+
+from py3jsondb import JsonStorage
+from py3jsondb.utils.serializers import get_serializer
+
+
+def test_default_is_stdlib_json():
+    assert get_serializer().name == "json"
+
+
+def test_non_finite_floats_are_kept(tmp_path):
+    path = str(tmp_path / "db.json")
+    s = JsonStorage(path)
+    s["x"] = [float("nan"), float("inf")]
+    s.store()
+    with open(path) as f:
+        assert f.read() == '{\n    "x": [\n        NaN,\n        Infinity\n    ]\n}'
+    x = JsonStorage(path)["x"]
+    assert math.isnan(x[0]) and x[1] == float("inf")
@@ -0,0 +1,32 @@
+import os
+
+from py3jsondb.utils import load_commented_json
+from py3jsondb.utils.serializers import get_serializer
+
+
+class _ReplacingSerializer:
+    """ replaces the file being parsed once, right after reading it """
+
+    def __init__(self, path):
+        self._serializer = get_serializer("json")
+        self._path = path
+
+    def __getattr__(self, name):
+        return getattr(self._serializer, name)
+
+    def load(self, f):
+        data = self._serializer.load(f)
+        new_path = self._path + ".new"
+        with open(new_path, "w") as new:
+            new.write('{"a": 2, "b": 3}')
+        os.replace(new_path, self._path)
+        return data
+
+
+def test_snapshot_of_replaced_file_is_not_used(tmp_path):
+    path = str(tmp_path / "db.json")
+    with open(path, "w") as f:
+        f.write('{"a": 1}')
+    data = load_commented_json(path, _ReplacingSerializer(path), cache=True)
+    assert data == {"a": 1}
+    assert load_commented_json(path, cache=True) == {"a": 2, "b": 3}
@@ -0,0 +1,18 @@
+from os import stat
+
+from py3jsondb import JsonDatabase
+
+
+def test_split_tables_only_write_dirty_tables(tmp_path):
+    path = str(tmp_path / "db.json")
+    db = JsonDatabase("t", path, split_tables=True)
+    db.add_entry({"a": 1})
+    db.add_table("u")
+    db.add_entry({"b": 2})
+    db.save()
+    untouched = stat(db.db.table_path("t")).st_mtime_ns
+    db.add_entry({"b": 3})
+    db.save()
+    assert stat(db.db.table_path("t")).st_mtime_ns == untouched
+    db = JsonDatabase("u", path, split_tables=True)
+    assert list(db) == [{"b": 2}, {"b": 3}]
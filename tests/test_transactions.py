@@ -0,0 +1,83 @@
+import pytest
+
+from py3jsondb import JsonDatabase, TransactionClosed, TransactionConflict
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = JsonDatabase("t", str(tmp_path / "db.json"))
+    db.add_entry({"a": 1, "tags": ["x"]})
+    db.save()
+    return db
+
+
+def test_changes_are_isolated_until_commit(db):
+    tx = db.transaction()
+    tx.add_entry({"b": 2})
+    tx.update_entry(0, {"a": 3, "tags": ["y"]})
+    assert list(db) == [{"a": 1, "tags": ["x"]}]
+    tx.commit()
+    assert list(db) == [{"a": 3, "tags": ["y"]}, {"b": 2}]
+    assert db.is_dirty
+    db.save()
+    assert list(JsonDatabase("t", db.path)) == list(db)
+
+
+def test_failed_block_rolls_back(db):
+    with pytest.raises(RuntimeError):
+        with db.transaction() as tx:
+            tx.add_entry({"b": 2})
+            raise RuntimeError
+    assert tx.closed
+    assert list(db) == [{"a": 1, "tags": ["x"]}]
+    assert not db.is_dirty
+    with pytest.raises(TransactionClosed):
+        tx.add_entry({"c": 3})
+
+
+def test_concurrent_change_conflicts(db):
+    tx = db.transaction()
+    tx.add_entry({"b": 2})
+    db.add_entry({"c": 3})
+    with pytest.raises(TransactionConflict):
+        tx.commit()
+    assert list(db) == [{"a": 1, "tags": ["x"]}, {"c": 3}]
+
+
+def test_snapshot_does_not_see_later_writes(db):
+    tx = db.transaction()
+    db.add_entry({"c": 3})
+    db.update_entry(0, {"b": 5}, overwrite=False)
+    assert list(tx) == [{"a": 1, "tags": ["x"]}]
+    assert list(db) == [{"a": 1, "tags": ["x"], "b": 5}, {"c": 3}]
+    tx.rollback()
+    db.add_entry({"d": 4})
+    assert len(db) == 3 and not db._snapshots
+
+
+def test_snapshot_of_unloaded_table(tmp_path):
+    path = str(tmp_path / "split.db")
+    db = JsonDatabase("t", path, split_tables=True)
+    db.add_table("u")
+    db.add_entry({"u": 1})
+    db.save()
+    db = JsonDatabase("t", path, split_tables=True)
+    tx = db.transaction()
+    db.use_table("u")
+    db.add_entry({"u": 2})
+    tx.use_table("u")
+    assert list(tx) == [{"u": 1}]
+
+
+def test_commit_publishes_every_table(db):
+    db.add_table("u")
+    db.use_table("t")
+    with db.transaction() as tx:
+        tx.add_entry({"b": 2})
+        tx.use_table("u")
+        tx.add_entry({"u": 1})
+    db.save()
+    saved = JsonDatabase("t", db.path)
+    assert list(saved) == [{"a": 1, "tags": ["x"]}, {"b": 2}]
+    saved.use_table("u")
+    assert list(saved) == [{"u": 1}]
@@ -0,0 +1,111 @@
+import threading
+from os.path import getsize, isfile
+
+from py3jsondb import JsonDatabase, JsonStorage, SplitJsonStorage
+
+
+def _crashed_db(tmp_path):
+    """ a database whose last log append was torn by a crash """
+    path = str(tmp_path / "db.json")
+    db = JsonDatabase("t", path, wal=True)
+    db.save(force=True)
+    for i in range(3):
+        db.add_entry({"i": i})
+        db.save()
+    with open(path + ".wal", "ab") as f:
+        f.write(b'{"op": "append", "path": ["t"], "val')
+    return path
+
+
+def test_torn_log_is_replayed_and_truncated(tmp_path):
+    path = _crashed_db(tmp_path)
+    db = JsonDatabase("t", path, wal=True)
+    assert list(db) == [{"i": 0}, {"i": 1}, {"i": 2}]
+    db.add_entry({"i": 3})
+    db.save()
+    assert len(JsonDatabase("t", path, wal=True)) == 4
+
+
+def test_stale_log_is_discarded(tmp_path):
+    path = str(tmp_path / "db.json")
+    db = JsonDatabase("t", path, wal=True)
+    db.save(force=True)
+    db.add_entry({"i": 0})
+    db.save()
+    # the snapshot was replaced without the log, eg. by an older version
+    JsonStorage(path).store()
+    assert list(JsonDatabase("t", path, wal=True)) == []
+    assert not isfile(path + ".wal")
+
+
+def test_log_is_repaired_under_the_write_lock(tmp_path):
+    path = _crashed_db(tmp_path)
+    size = getsize(path + ".wal")
+    reader = JsonStorage(path)
+    opened = threading.Event()
+
+    def open_db():
+        JsonStorage(path, wal=True)
+        opened.set()
+
+    with reader.lock.read_lock():
+        t = threading.Thread(target=open_db)
+        t.start()
+        assert not opened.wait(0.2)
+        assert getsize(path + ".wal") == size
+    t.join()
+    assert opened.is_set()
+    assert getsize(path + ".wal") < size
+
+
+def test_background_compaction_without_lock(tmp_path):
+    path = str(tmp_path / "db.json")
+    db = JsonDatabase("t", path, wal=True, wal_threshold=4096,
+                      disable_lock=True)
+    db.save(force=True)
+    for i in range(3000):
+        db.add_entry({"i": i})
+        db.save()
+    if db.db._compactor is not None:
+        db.db._compactor.join()
+    assert len(JsonDatabase("t", path, wal=True, disable_lock=True)) == 3000
+
+
+def test_dict_writes_are_stored(tmp_path):
+    path = str(tmp_path / "db.json")
+    s = JsonStorage(path, wal=True)
+    s["a"] = 1
+    s.store()
+    s["b"] = 2
+    s.update(c=3)
+    assert s.is_dirty
+    s.store()
+    del s["a"]
+    s.store()
+    assert not s.is_dirty
+    assert dict(JsonStorage(path, wal=True)) == {"b": 2, "c": 3}
+
+
+def test_logged_changes_are_appended(tmp_path):
+    path = str(tmp_path / "db.json")
+    db = JsonDatabase("t", path, wal=True)
+    db.save(force=True)
+    size = getsize(path)
+    db.add_table("u")
+    db.use_table("t")
+    db.add_entry({"a": 1})
+    with db.transaction() as tx:
+        tx.add_entry({"b": 2})
+    db.save()
+    assert isfile(path + ".wal")
+    assert getsize(path) == size
+    assert list(JsonDatabase("t", path, wal=True)) == [{"a": 1}, {"b": 2}]
+
+
+def test_split_dict_writes_are_stored(tmp_path):
+    path = str(tmp_path / "db.json")
+    s = SplitJsonStorage(path)
+    s["t"] = [{"a": 1}]
+    s.store()
+    assert not s.is_dirty
+    assert dict(SplitJsonStorage(path).items()) == {"t": [{"a": 1}]}